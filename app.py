@@ -2,41 +2,227 @@ import streamlit as st
 import json
 import datetime
 import os
-import shutil # Added for directory operations
+import time
 # import re # No longer needed in app.py
-from llm_access.llm_api import get_llm_response # Import for fetching city list
-from pipeline import create_travel_itinerary # Import the main pipeline function
+import job_queue # Generation runs as a background job, so reruns do not throw the work away
+from destination_index import get_popular_destinations, get_interest_options # Cached across reruns
 
-# --- Helper function to get famous cities from LLM ---
-def get_famous_cities_from_llm():
+JOB_POLL_INTERVAL = 0.5 # Seconds between checks for new progress of the session's job
+
+job_queue.start_workers() # Once per process; a no-op on later reruns
+
+# DEFAULT_DESTINATIONS list has been removed as per user request.
+
+# --- Rendering helpers (used for progressive rendering while the itinerary streams in) ---
+def render_trip_header(itinerary_data):
+    """Renders the trip title, dates and travellers from an itinerary (or preview) dictionary."""
+    st.subheader(f"Your Trip to {itinerary_data.get('destination', 'Your Destination')}")
+    
+    from_date_str_display = itinerary_data.get('from_date') # Already formatted string from pipeline
+    to_date_str_display = itinerary_data.get('to_date') # Already formatted string from pipeline
+    duration_display = itinerary_data.get('duration', 'N/A')
+    num_travellers_display = itinerary_data.get('num_travellers', 1)
+
+    if from_date_str_display and to_date_str_display:
+        st.markdown(f"**Dates:** {from_date_str_display} to {to_date_str_display} ({duration_display} days)")
+    else:
+        st.markdown(f"**Duration:** {duration_display} days")
+    
+    st.markdown(f"**Travellers:** {num_travellers_display}")
+
+def render_day_plan(day_plan):
+    """Renders one day: header, summary, activity cards, meal suggestions and logistical tips."""
+    st.markdown(f"---") # Separator line
+    
+    # Custom HTML for styled day header
+    day_number = day_plan.get('day', 'N/A')
+    day_header_html = f"""
+    <div class="day-header">
+        <img src="https://i.postimg.cc/KcMBSWSY/travel-4988737.png" alt="Day Icon">
+        <h3>Day {day_number}</h3>
+    </div>
     """
-    Fetches a list of famous cities from the LLM.
-    Returns a list of city strings or None if an error occurs.
+    st.markdown(day_header_html, unsafe_allow_html=True)
+    
+    # Display day summary
+    day_summary = day_plan.get("day_summary")
+    if day_summary:
+        st.markdown(f"*{day_summary}*")
+
+    # Display activities for the day
+    activities = day_plan.get("activities", [])
+    if activities:
+        st.markdown("<div class='section-title'>Activities:</div>", unsafe_allow_html=True)
+        for activity in activities:
+            activity_html = "<div class='activity-card'>"
+            activity_html += f"<h4>{activity.get('name', 'N/A')} ({activity.get('time_of_day', 'N/A')})</h4>"
+            
+            poi_image = activity.get("poi_image_url")
+            if poi_image and isinstance(poi_image, str) and poi_image.strip():
+                activity_html += f"<img src='{poi_image}' alt='{activity.get('name', 'Activity Image')}' style='width:100%; max-width:400px;'>" # Basic styling for POI image
+            
+            if activity.get('description'):
+                activity_html += f"<p><strong>Description:</strong> {activity.get('description')}</p>"
+            if activity.get('why_relevant'):
+                activity_html += f"<p><strong>Why this?:</strong> {activity.get('why_relevant')}</p>"
+            if activity.get('estimated_duration'):
+                activity_html += f"<p><strong>Duration:</strong> {activity.get('estimated_duration')}</p>"
+            if activity.get('estimated_cost'):
+                activity_html += f"<p><strong>Cost:</strong> {activity.get('estimated_cost')}</p>"
+            activity_html += "</div>"
+            st.markdown(activity_html, unsafe_allow_html=True)
+    else:
+        st.markdown("<p>No specific activities planned for this day.</p>", unsafe_allow_html=True)
+
+    # Display Meal Suggestions
+    meal_suggestions_data = day_plan.get("daily_meal_suggestions")
+    if isinstance(meal_suggestions_data, dict) and any(str(v).strip() for v in meal_suggestions_data.values()): # Check if any value is non-empty after stripping
+        meal_html_parts = []
+        breakfast = str(meal_suggestions_data.get("breakfast", "")).strip()
+        lunch = str(meal_suggestions_data.get("lunch", "")).strip()
+        dinner = str(meal_suggestions_data.get("dinner", "")).strip()
+
+        if breakfast:
+            meal_html_parts.append(f"<div class='meal-item'><strong>Breakfast:</strong> {breakfast}</div>")
+        if lunch:
+            meal_html_parts.append(f"<div class='meal-item'><strong>Lunch:</strong> {lunch}</div>")
+        if dinner:
+            meal_html_parts.append(f"<div class='meal-item'><strong>Dinner:</strong> {dinner}</div>")
+        
+        if meal_html_parts: # Only build the full HTML if there's actual content
+            full_meal_html = "<div class='section-title'>🍽️ Meal Suggestions:</div>" # Added icon
+            full_meal_html += "<div class='meal-suggestions-container'>"
+            full_meal_html += "".join(meal_html_parts)
+            full_meal_html += "</div>"
+            st.markdown(full_meal_html, unsafe_allow_html=True)
+            
+    elif isinstance(meal_suggestions_data, str) and meal_suggestions_data.strip(): # Fallback for old string format
+        st.markdown(f"<div class='section-title'>🍽️ Meal Suggestions:</div><p>{meal_suggestions_data}</p>", unsafe_allow_html=True)
+
+
+    # Display Logistical Tips
+    logistical_tips = day_plan.get("daily_logistical_tips")
+    if logistical_tips and str(logistical_tips).strip():
+        st.markdown(f"<div class='section-title'>💡 Logistical Tips:</div><p>{str(logistical_tips).strip()}</p>", unsafe_allow_html=True) # Added icon and strip
+
+def render_costs(itinerary_data):
+    """Renders the overall and meal cost estimates of a completed itinerary."""
+    # Display Estimated Costs
+    estimated_cost_main = itinerary_data.get("estimated_cost")
+    estimated_total_meal_cost = itinerary_data.get("total_estimated_meal_cost")
+    estimated_daily_meal_cost_person = itinerary_data.get("estimated_daily_meal_cost_per_person")
+
+    if estimated_cost_main:
+        cost_label = "Estimated Cost (Excl. Meals)" if estimated_total_meal_cost or estimated_daily_meal_cost_person else "Estimated Cost"
+        cost_html = f"""
+        <div class="estimated-cost-display">
+            {cost_label}: {estimated_cost_main}
+        </div>
+        """
+        st.markdown(cost_html, unsafe_allow_html=True)
+
+    if estimated_total_meal_cost: # This is the calculated total string from pipeline.py
+        meal_cost_html = f"""
+        <div class="meal-cost-estimation">
+            <span class="cost-label">Total Estimated Meal Cost:</span><span class="cost-value">{estimated_total_meal_cost}</span>
+        </div>
+        """
+        st.markdown(meal_cost_html, unsafe_allow_html=True)
+    elif estimated_daily_meal_cost_person: # Fallback if total wasn't calculated but daily per person is there
+         meal_cost_html = f"""
+        <div class="meal-cost-estimation">
+            <span class="cost-label">Daily Meal Cost (per person):</span><span class="cost-value">{estimated_daily_meal_cost_person}</span>
+        </div>
+        """
+         st.markdown(meal_cost_html, unsafe_allow_html=True)
+
+def render_job(job_id):
     """
-    prompt = (
-        "Generate a list of approximately 75-100 globally famous cities suitable for tourism. "
-        "Format the response as a single JSON object with one key: 'cities'. "
-        "The value of 'cities' should be a JSON list of strings. "
-        "Each string should be in the format 'City Name, Country Name'. "
-        "Example: {\"cities\": [\"Paris, France\", \"Tokyo, Japan\", \"Rome, Italy\"]}"
-    )
-    try:
-        response_data = get_llm_response(prompt) # Expects a dictionary
-        if response_data and isinstance(response_data, dict) and "cities" in response_data and isinstance(response_data["cities"], list):
-            cities = [str(city) for city in response_data["cities"] if isinstance(city, str)]
-            if cities:
-                return sorted(list(set(cities))) # Ensure uniqueness and sort
-            else:
-                # st.sidebar.warning("LLM returned an empty or invalid list of cities.")
-                return None
+    Renders the session's itinerary job: days as the worker produces them (re-rendered once
+    their images are downloaded), then the final itinerary with costs. Polls until the job has
+    finished; a rerun simply starts polling the same job again.
+    """
+    job = job_queue.get_job(job_id)
+    if job is None: # Expired or removed
+        st.session_state.pop("job_id", None)
+        st.info("Fill in your preferences in the sidebar and click 'Generate Itinerary'.")
+        return
+    preferences = job["preferences"] # JSON copy: dates are 'YYYY-MM-DD' strings
+
+    # --- Wrap itinerary display in a content-container ---
+    st.markdown("<div class='content-container'>", unsafe_allow_html=True)
+
+    header_placeholder = st.empty()
+    with header_placeholder.container():
+        render_trip_header({
+            "destination": preferences.get("destination"),
+            "from_date": preferences.get("from_date"),
+            "to_date": preferences.get("to_date"),
+            "duration": preferences.get("duration"),
+            "num_travellers": preferences.get("num_travellers", 1),
+        })
+    status_placeholder = st.empty()
+    day_placeholders = []
+    last_seq = 0
+    attempt = None
+
+    while True:
+        job = job_queue.get_job(job_id) # Status first: events written before it finished are all visible below
+        if job is None: # Expired or removed while polling
+            st.session_state.pop("job_id", None)
+            header_placeholder.empty()
+            status_placeholder.empty()
+            for placeholder in day_placeholders:
+                placeholder.empty()
+            st.info("This itinerary is no longer available. Fill in your preferences in the sidebar and click 'Generate Itinerary'.")
+            st.markdown("</div>", unsafe_allow_html=True) # Close content-container
+            return
+        if job["attempts"] != attempt: # A restarted job replaces its events, numbered from 1 again
+            attempt = job["attempts"]
+            last_seq = 0
+            for placeholder in day_placeholders:
+                placeholder.empty()
+        for event in job_queue.get_events(job_id, last_seq):
+            last_seq = event["seq"]
+            if event["event"] in ("day", "day_images") and job["status"] != "done":
+                while len(day_placeholders) <= event["index"]:
+                    day_placeholders.append(st.empty())
+                with day_placeholders[event["index"]].container():
+                    render_day_plan(event["day"])
+        if job["status"] in job_queue.FINISHED_STATUSES:
+            break
+        if job["status"] == "queued":
+            status_placeholder.info(f"✈️ Your trip is queued (position {job['queue_position']})... it will start shortly.")
         else:
-            # st.sidebar.warning(f"Could not parse city list from LLM response. Response: {str(response_data)[:200]}") # Log part of response
-            return None
-    except Exception as e:
-        # st.sidebar.error(f"Error fetching cities from LLM: {e}")
-        return None
+            status_placeholder.info("✈️ Planning your trip... days will appear as soon as they are ready.")
+        time.sleep(JOB_POLL_INTERVAL)
+    status_placeholder.empty()
 
-# DEFAULT_DESTINATIONS list has been removed as per user request.
+    itinerary_data = job["result"]
+    if not itinerary_data: # Failed to generate itinerary
+        for placeholder in day_placeholders: # Days streamed before the failure are not a usable itinerary
+            placeholder.empty()
+        st.error(job["error"] or "Failed to generate itinerary. Please try again.")
+        st.stop() # Stop further execution in app if generation failed
+
+    with header_placeholder.container(): # The LLM may have refined the destination name
+        render_trip_header(itinerary_data)
+
+    details = itinerary_data.get("details") or []
+    for index, day_plan in enumerate(details): # Final versions, with local image paths
+        while len(day_placeholders) <= index:
+            day_placeholders.append(st.empty())
+        with day_placeholders[index].container():
+            render_day_plan(day_plan)
+    if not details:
+        st.warning("Could not generate detailed itinerary. Please try adjusting your preferences.")
+
+    render_costs(itinerary_data)
+
+    # with st.expander("View Raw Itinerary Data (JSON)"):
+    #     st.json(itinerary_data)
+
+    st.markdown("</div>", unsafe_allow_html=True) # Close content-container
 
 def main():
     st.set_page_config(page_title="WanderLust - AI Travel Planner", layout="wide") # Changed page_title
@@ -267,90 +453,11 @@ def main():
     st.markdown("Let's plan your next adventure! Fill in your preferences below.")
 
     # --- Initialize POPULAR_DESTINATIONS and INTEREST_OPTIONS ---
-    POPULAR_DESTINATIONS = []
-    INTEREST_OPTIONS = []
-
-    # 1. Prioritize loading from input/world_cities.json
-    world_cities_file_path = os.path.join("input", "world_cities.json") # Ensure correct path
-    loaded_from_file = False
-    if os.path.exists(world_cities_file_path):
-        try:
-            with open(world_cities_file_path, 'r', encoding='utf-8') as f:
-                world_cities_data = json.load(f)
-            if world_cities_data and isinstance(world_cities_data, dict) and \
-               "cities" in world_cities_data and isinstance(world_cities_data["cities"], list):
-                cities_from_file = [str(city) for city in world_cities_data["cities"] if isinstance(city, str)]
-                if cities_from_file:
-                    POPULAR_DESTINATIONS.extend(cities_from_file)
-                    loaded_from_file = True
-                    # st.sidebar.info(f"Loaded {len(cities_from_file)} destinations from {world_cities_file_path}.") # User-facing message removed
-                else:
-                    # st.sidebar.warning(f"{world_cities_file_path} was found but contained no valid cities. Will try LLM fallback.") # User-facing message removed
-                    pass
-            else:
-                # st.sidebar.warning(f"Invalid format in {world_cities_file_path}. Will try LLM fallback.") # User-facing message removed
-                pass
-        except json.JSONDecodeError:
-            # st.sidebar.warning(f"Could not decode {world_cities_file_path}. Will try LLM fallback.") # User-facing message removed
-            pass
-        except Exception as e:
-            # st.sidebar.warning(f"Error reading {world_cities_file_path}: {e}. Will try LLM fallback.") # User-facing message removed
-            pass
-    else:
-        # st.sidebar.info(f"{world_cities_file_path} not found. Will try LLM for destinations.") # User-facing message removed
-        pass
-
-    # 2. If loading from file failed or yielded no destinations, try LLM as a fallback
-    if not loaded_from_file or not POPULAR_DESTINATIONS:
-        # st.sidebar.info(f"Primary city list ({world_cities_file_path}) empty, not found, or failed to load. Attempting to fetch a dynamic list from AI as a fallback...") # User-facing message removed
-        llm_cities = get_famous_cities_from_llm() # This fetches a smaller, dynamic list
-        if llm_cities:
-            POPULAR_DESTINATIONS.extend(llm_cities)
-            # st.sidebar.info(f"Loaded {len(llm_cities)} destinations from LLM as fallback.") # User-facing message removed
-    
-    # 3. If still no destinations after file and LLM, the list will be empty (before adding "Other")
-    if not POPULAR_DESTINATIONS:
-        # st.sidebar.error("CRITICAL: Failed to load destinations. The destination list will be initially empty (except for 'Other').") # Simplified error
-        pass 
-    
-    # Ensure "Other - type your own" is present and list is unique and sorted
-    POPULAR_DESTINATIONS = sorted(list(set(POPULAR_DESTINATIONS))) # Deduplicate and sort
-    if not POPULAR_DESTINATIONS: # Ensure there's at least 'Other' if all loads fail
-        POPULAR_DESTINATIONS.append("Other - type your own")
-    elif "Other - type your own" not in POPULAR_DESTINATIONS: # Add if not present
-        POPULAR_DESTINATIONS.append("Other - type your own")
-
-
-    # --- Load INTEREST_OPTIONS from Dataset.json ---
-    # This part remains for interest categories
-    dataset_file_path = "input/Dataset.json"
-    try:
-        with open(dataset_file_path, 'r', encoding='utf-8') as f:
-            poi_data = json.load(f) # poi_data is now locally scoped here
-        
-        if poi_data and isinstance(poi_data, list):
-            all_categories = set()
-            for poi in poi_data:
-                categories_str = poi.get('category')
-                if categories_str and isinstance(categories_str, str):
-                    all_categories.update([cat.strip() for cat in categories_str.split('|') if cat.strip()])
-            if all_categories:
-                INTEREST_OPTIONS.extend(sorted(list(all_categories)))
-                # st.sidebar.info(f"Loaded {len(INTEREST_OPTIONS)} interest categories from {dataset_file_path}.")
-    except FileNotFoundError:
-        # st.sidebar.warning(f"Interest categories file {dataset_file_path} not found. Using defaults.")
-        pass
-    except json.JSONDecodeError:
-        # st.sidebar.warning(f"Could not decode interest categories from {dataset_file_path}. Using defaults.")
-        pass
-    except Exception as e:
-        # st.sidebar.warning(f"Error reading interest categories from {dataset_file_path}: {e}. Using defaults.")
-        pass
-
-    if not INTEREST_OPTIONS: # Fallback for INTEREST_OPTIONS
-        INTEREST_OPTIONS = ["History", "Adventure", "Relaxation", "Food", "Culture", "Nature", "Nightlife", "Shopping"]
-        # st.sidebar.warning(f"Using default interest categories.")
-    INTEREST_OPTIONS = sorted(list(set(INTEREST_OPTIONS))) # Deduplicate and sort
+    # Both come from process-wide indexes (see destination_index.py): the input files are parsed
+    # once and re-read only when they change, and the LLM city fallback is persisted to disk,
+    # so widget interactions do not pay for file parsing or LLM calls.
+    POPULAR_DESTINATIONS = get_popular_destinations() # world_cities.json, else LLM list; ends with "Other - type your own"
+    INTEREST_OPTIONS = get_interest_options() # Categories from Dataset.json, else defaults
 
     with st.sidebar:
         st.header("🌍 Your Travel Preferences") # Added icon
@@ -412,153 +519,18 @@ def main():
                 "additional_prefs": additional_prefs
             }
 
-            # --- Clear and recreate the output directory ---
-            output_dir = "Output" # Changed to capital 'O'
-            if os.path.exists(output_dir):
-                shutil.rmtree(output_dir)
-            os.makedirs(output_dir)
-            # --- End of clearing output directory ---
-
-            itinerary_data, saved_filepath = create_travel_itinerary(preferences)
-
-            if itinerary_data and saved_filepath:
-                # st.sidebar.success(f"Itinerary saved to {saved_filepath}")
-                pass
-            elif itinerary_data: # Itinerary generated but not saved
-                # st.sidebar.warning("Itinerary generated, but there was an issue saving it.")
-                pass
-            else: # Failed to generate itinerary
-                # st.sidebar.error("Failed to generate itinerary. Please check logs or try again.")
-                st.stop() # Stop further execution in app if generation failed
-            
-            # --- Wrap itinerary display in a content-container ---
-            st.markdown("<div class='content-container'>", unsafe_allow_html=True)
-
-
-            st.subheader(f"Your Trip to {itinerary_data.get('destination', 'Your Destination')}")
-            
-            from_date_str_display = itinerary_data.get('from_date') # Already formatted string from pipeline
-            to_date_str_display = itinerary_data.get('to_date') # Already formatted string from pipeline
-            duration_display = itinerary_data.get('duration', 'N/A')
-            num_travellers_display = itinerary_data.get('num_travellers', 1)
-
-            if from_date_str_display and to_date_str_display:
-                st.markdown(f"**Dates:** {from_date_str_display} to {to_date_str_display} ({duration_display} days)")
-            else:
-                st.markdown(f"**Duration:** {duration_display} days")
-            
-            st.markdown(f"**Travellers:** {num_travellers_display}")
-
-            if "details" in itinerary_data and itinerary_data["details"]:
-                for day_plan in itinerary_data["details"]:
-                    st.markdown(f"---") # Separator line
-                    
-                    # Custom HTML for styled day header
-                    day_number = day_plan.get('day', 'N/A')
-                    day_header_html = f"""
-                    <div class="day-header">
-                        <img src="https://i.postimg.cc/KcMBSWSY/travel-4988737.png" alt="Day Icon">
-                        <h3>Day {day_number}</h3>
-                    </div>
-                    """
-                    st.markdown(day_header_html, unsafe_allow_html=True)
-                    
-                    # Display day summary
-                    day_summary = day_plan.get("day_summary")
-                    if day_summary:
-                        st.markdown(f"*{day_summary}*")
-
-                    # Display activities for the day
-                    activities = day_plan.get("activities", [])
-                    if activities:
-                        st.markdown("<div class='section-title'>Activities:</div>", unsafe_allow_html=True)
-                        for activity in activities:
-                            activity_html = "<div class='activity-card'>"
-                            activity_html += f"<h4>{activity.get('name', 'N/A')} ({activity.get('time_of_day', 'N/A')})</h4>"
-                            
-                            poi_image = activity.get("poi_image_url")
-                            if poi_image and isinstance(poi_image, str) and poi_image.strip():
-                                activity_html += f"<img src='{poi_image}' alt='{activity.get('name', 'Activity Image')}' style='width:100%; max-width:400px;'>" # Basic styling for POI image
-                            
-                            if activity.get('description'):
-                                activity_html += f"<p><strong>Description:</strong> {activity.get('description')}</p>"
-                            if activity.get('why_relevant'):
-                                activity_html += f"<p><strong>Why this?:</strong> {activity.get('why_relevant')}</p>"
-                            if activity.get('estimated_duration'):
-                                activity_html += f"<p><strong>Duration:</strong> {activity.get('estimated_duration')}</p>"
-                            if activity.get('estimated_cost'):
-                                activity_html += f"<p><strong>Cost:</strong> {activity.get('estimated_cost')}</p>"
-                            activity_html += "</div>"
-                            st.markdown(activity_html, unsafe_allow_html=True)
-                    else:
-                        st.markdown("<p>No specific activities planned for this day.</p>", unsafe_allow_html=True)
-
-                    # Display Meal Suggestions
-                    meal_suggestions_data = day_plan.get("daily_meal_suggestions")
-                    if isinstance(meal_suggestions_data, dict) and any(str(v).strip() for v in meal_suggestions_data.values()): # Check if any value is non-empty after stripping
-                        meal_html_parts = []
-                        breakfast = str(meal_suggestions_data.get("breakfast", "")).strip()
-                        lunch = str(meal_suggestions_data.get("lunch", "")).strip()
-                        dinner = str(meal_suggestions_data.get("dinner", "")).strip()
-
-                        if breakfast:
-                            meal_html_parts.append(f"<div class='meal-item'><strong>Breakfast:</strong> {breakfast}</div>")
-                        if lunch:
-                            meal_html_parts.append(f"<div class='meal-item'><strong>Lunch:</strong> {lunch}</div>")
-                        if dinner:
-                            meal_html_parts.append(f"<div class='meal-item'><strong>Dinner:</strong> {dinner}</div>")
-                        
-                        if meal_html_parts: # Only build the full HTML if there's actual content
-                            full_meal_html = "<div class='section-title'>🍽️ Meal Suggestions:</div>" # Added icon
-                            full_meal_html += "<div class='meal-suggestions-container'>"
-                            full_meal_html += "".join(meal_html_parts)
-                            full_meal_html += "</div>"
-                            st.markdown(full_meal_html, unsafe_allow_html=True)
-                            
-                    elif isinstance(meal_suggestions_data, str) and meal_suggestions_data.strip(): # Fallback for old string format
-                        st.markdown(f"<div class='section-title'>🍽️ Meal Suggestions:</div><p>{meal_suggestions_data}</p>", unsafe_allow_html=True)
-
-
-                    # Display Logistical Tips
-                    logistical_tips = day_plan.get("daily_logistical_tips")
-                    if logistical_tips and str(logistical_tips).strip():
-                        st.markdown(f"<div class='section-title'>💡 Logistical Tips:</div><p>{str(logistical_tips).strip()}</p>", unsafe_allow_html=True) # Added icon and strip
-            else:
-                st.warning("Could not generate detailed itinerary. Please try adjusting your preferences.")
-
-            # Display Estimated Costs
-            estimated_cost_main = itinerary_data.get("estimated_cost")
-            estimated_total_meal_cost = itinerary_data.get("total_estimated_meal_cost")
-            estimated_daily_meal_cost_person = itinerary_data.get("estimated_daily_meal_cost_per_person")
-
-            if estimated_cost_main:
-                cost_label = "Estimated Cost (Excl. Meals)" if estimated_total_meal_cost or estimated_daily_meal_cost_person else "Estimated Cost"
-                cost_html = f"""
-                <div class="estimated-cost-display">
-                    {cost_label}: {estimated_cost_main}
-                </div>
-                """
-                st.markdown(cost_html, unsafe_allow_html=True)
-
-            if estimated_total_meal_cost: # This is the calculated total string from pipeline.py
-                meal_cost_html = f"""
-                <div class="meal-cost-estimation">
-                    <span class="cost-label">Total Estimated Meal Cost:</span><span class="cost-value">{estimated_total_meal_cost}</span>
-                </div>
-                """
-                st.markdown(meal_cost_html, unsafe_allow_html=True)
-            elif estimated_daily_meal_cost_person: # Fallback if total wasn't calculated but daily per person is there
-                 meal_cost_html = f"""
-                <div class="meal-cost-estimation">
-                    <span class="cost-label">Daily Meal Cost (per person):</span><span class="cost-value">{estimated_daily_meal_cost_person}</span>
-                </div>
-                """
-                 st.markdown(meal_cost_html, unsafe_allow_html=True)
-            
-            # with st.expander("View Raw Itinerary Data (JSON)"):
-            #     st.json(itinerary_data)
-            
-            st.markdown("</div>", unsafe_allow_html=True) # Close content-container
+            # --- Queue the generation as a background job ---
+            # Only the job id is kept in the session; the job keeps running (and this session
+            # keeps polling it) across reruns. The session's previous job and output are dropped.
+            previous_job_id = st.session_state.get("job_id")
+            if previous_job_id:
+                job_queue.discard_job(previous_job_id)
+            st.session_state["job_id"] = job_queue.submit_job(preferences)
+            # --- End of job submission ---
+
+    job_id = st.session_state.get("job_id")
+    if job_id:
+        render_job(job_id)
     else:
         st.info("Fill in your preferences in the sidebar and click 'Generate Itinerary'.")
 
@@ -0,0 +1,175 @@
+# batch_runner.py
+# Batch itinerary generation over a JSONL file of preference sets, e.g. for pre-generating
+# itineraries for top destinations overnight.
+#
+# Each input line is one JSON object with the same keys app.py passes to the pipeline:
+#   {"request_id": "paris-7d", "destination": "Paris, France", "from_date": "2025-07-10",
+#    "to_date": "2025-07-16", "num_travellers": 2, "interests": ["Museums"], "budget": "Mid-Range"}
+# 'request_id' (or 'id') is optional; without it a stable id is derived from the line content.
+#
+# Usage:
+#   python batch_runner.py preferences.jsonl --output Output/batch/results.jsonl --workers 4
+#
+# Every request writes its itinerary and images to its own directory under --output-dir and
+# appends one result line to --output. The output file doubles as the checkpoint: rerunning
+# the same command skips requests that already completed successfully.
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pipeline import create_travel_itinerary, sanitize_foldername, to_pipeline_preferences
+
+DEFAULT_OUTPUT_DIR = os.path.join("Output", "batch")
+DEFAULT_WORKERS = 4
+PROGRESS_EVERY = 10 # Print a throughput line after this many finished requests
+
+def request_id_for(preferences, raw_line):
+    """Returns the request's id: its 'request_id'/'id' field, else a hash of the input line."""
+    explicit_id = preferences.get("request_id") or preferences.get("id")
+    if explicit_id:
+        return str(explicit_id)
+    return hashlib.sha1(raw_line.strip().encode('utf-8')).hexdigest()[:16]
+
+def iter_requests(input_path):
+    """Streams (line_number, request_id, preferences) from a JSONL file, skipping blank and invalid lines."""
+    with open(input_path, 'r', encoding='utf-8') as f:
+        for line_number, raw_line in enumerate(f, start=1):
+            if not raw_line.strip():
+                continue
+            try:
+                preferences = json.loads(raw_line)
+            except json.JSONDecodeError as e:
+                print(f"Skipping line {line_number}: invalid JSON ({e})")
+                continue
+            if not isinstance(preferences, dict):
+                print(f"Skipping line {line_number}: expected a JSON object")
+                continue
+            yield line_number, request_id_for(preferences, raw_line), preferences
+
+def load_completed_ids(output_path):
+    """Reads the result file of a previous run and returns the ids that completed successfully."""
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for raw_line in f:
+            try:
+                result = json.loads(raw_line)
+            except json.JSONDecodeError:
+                continue # Partially written last line from an interrupted run
+            if isinstance(result, dict) and result.get("status") == "ok":
+                completed.add(result.get("request_id"))
+    return completed
+
+def process_request(request_id, preferences, output_dir):
+    """Generates one itinerary into its own directory. Returns the result record written to the output file."""
+    request_output_dir = os.path.join(output_dir, sanitize_foldername(request_id))
+    started_at = time.time()
+    try:
+        itinerary_data, saved_path = create_travel_itinerary(dict(to_pipeline_preferences(preferences), request_id=request_id), output_dir=request_output_dir)
+        error = None if itinerary_data else "Failed to get itinerary from LLM."
+    except Exception as e: # One bad request must not stop the batch
+        itinerary_data, saved_path, error = None, None, f"{e.__class__.__name__}: {e}"
+    return {
+        "request_id": request_id,
+        "status": "ok" if itinerary_data else "error",
+        "error": error,
+        "saved_path": saved_path,
+        "elapsed_seconds": round(time.time() - started_at, 3),
+        "itinerary": itinerary_data,
+    }
+
+class _Progress:
+    """Thread-safe counters for the throughput report."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.succeeded = 0
+        self.failed = 0
+        self.skipped = 0
+        self.total_latency = 0.0
+
+    def record(self, result):
+        with self.lock:
+            if result["status"] == "ok":
+                self.succeeded += 1
+            else:
+                self.failed += 1
+            self.total_latency += result["elapsed_seconds"]
+            return self.succeeded + self.failed
+
+    def report(self, final=False):
+        with self.lock:
+            finished = self.succeeded + self.failed
+            elapsed = max(time.time() - self.started_at, 1e-9)
+            mean_latency = self.total_latency / finished if finished else 0.0
+            label = "Batch finished" if final else "Progress"
+            print(
+                f"{label}: {finished} processed ({self.succeeded} ok, {self.failed} failed, {self.skipped} skipped) "
+                f"in {elapsed:.1f}s - {finished / elapsed * 60:.1f} itineraries/min, mean latency {mean_latency:.1f}s"
+            )
+
+def run_batch(input_path, output_path, output_dir=DEFAULT_OUTPUT_DIR, workers=DEFAULT_WORKERS):
+    """
+    Processes every preference set in input_path with a pool of worker threads and appends
+    one JSON result per request to output_path. Requests already marked 'ok' in output_path
+    are skipped, so an interrupted batch can simply be rerun. At most 2 * workers requests
+    are in flight at once, keeping memory flat for inputs with thousands of lines.
+    Returns the progress counters.
+    """
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    completed_ids = load_completed_ids(output_path)
+    if completed_ids:
+        print(f"Resuming: {len(completed_ids)} request(s) already completed in {output_path}")
+
+    progress = _Progress()
+    write_lock = threading.Lock()
+    seen_ids = set()
+
+    with open(output_path, 'a', encoding='utf-8') as output_file, \
+         ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="batch") as executor:
+
+        def handle_done(done_futures):
+            for future in done_futures:
+                result = future.result()
+                with write_lock:
+                    output_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    output_file.flush() # Checkpoint immediately
+                finished = progress.record(result)
+                if result["status"] != "ok":
+                    print(f"Request {result['request_id']} failed: {result['error']}")
+                if finished % PROGRESS_EVERY == 0:
+                    progress.report()
+
+        in_flight = set()
+        for line_number, request_id, preferences in iter_requests(input_path):
+            if request_id in completed_ids or request_id in seen_ids:
+                progress.skipped += 1
+                continue
+            seen_ids.add(request_id)
+            if len(in_flight) >= 2 * max(1, workers):
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                handle_done(done)
+            in_flight.add(executor.submit(process_request, request_id, preferences, output_dir))
+
+        done, _ = wait(in_flight)
+        handle_done(done)
+
+    progress.report(final=True)
+    return progress
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate travel itineraries for every preference set in a JSONL file.")
+    parser.add_argument("input", help="JSONL file with one preference object per line")
+    parser.add_argument("--output", default=os.path.join(DEFAULT_OUTPUT_DIR, "results.jsonl"), help="JSONL file receiving one result per request (also used as checkpoint)")
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR, help="Base directory for per-request itinerary and image folders")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Number of itineraries generated concurrently")
+    args = parser.parse_args()
+    run_batch(args.input, args.output, output_dir=args.output_dir, workers=args.workers)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+# benchmarks/mock_services.py
+# Offline stand-ins for everything the pipeline talks to over the network:
+#   POST /v1/openai/token                        - token endpoint (credentials for llm_api)
+#   POST .../chat/completions                    - OpenAI/Azure-compatible chat completions, incl. stream=True (SSE)
+#   GET  /images/<name>.jpg                      - image server (404 for /images/missing/...)
+# Completions are canned JSON shaped like Output/Generated_Output.json, chosen from the prompt
+# (full itinerary, continuation, skeleton, single day, placeholder images, city list).
+# Latency, generation speed, error rate and truncation are configurable.
+#
+# Usage:
+#   python benchmarks/mock_services.py --port 8800 --tokens-per-second 400 --error-rate 0.05
+#   LLM_TOKEN_URL=http://127.0.0.1:8800/v1/openai/token LLM_OPENAI_BASE_URL=http://127.0.0.1:8800 streamlit run app.py
+import argparse
+import io
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from PIL import Image # Optional: without Pillow a tiny static PNG is served
+except ImportError:
+    Image = None
+
+CHARS_PER_TOKEN = 4 # Same rough estimate as llm_access.token_count's fallback
+STREAM_CHUNK_TOKENS = 8 # Tokens per SSE chunk
+TINY_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d49484452000000010000000108060000001f15c489"
+    "0000000d49444154789c6360f8cfc0f01f0005000201e221bc330000000049454e44ae426082"
+)
+
+class MockConfig:
+    """Behaviour of the mock services; every field can be changed while the server runs."""
+
+    def __init__(self, latency_seconds=0.2, tokens_per_second=500.0, error_rate=0.0, truncate_rate=0.0,
+                 broken_image_rate=0.2, image_latency_seconds=0.02, image_size=(1200, 800), token_ttl_seconds=3600):
+        self.latency_seconds = latency_seconds # Time to first token
+        self.tokens_per_second = tokens_per_second # Generation speed; 0 disables the delay
+        self.error_rate = error_rate # Fraction of completions answered with 429 or 500
+        self.truncate_rate = truncate_rate # Fraction of completions cut off as if max_tokens was hit
+        self.broken_image_rate = broken_image_rate # Fraction of POI image URLs that return 404
+        self.image_latency_seconds = image_latency_seconds
+        self.image_size = image_size
+        self.token_ttl_seconds = token_ttl_seconds
+        self.stats = {"token": 0, "completions": 0, "errors": 0, "truncated": 0, "images": 0}
+        self.stats_lock = threading.Lock()
+
+    def count(self, key):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+def _image_bytes(size):
+    if Image is None:
+        return TINY_PNG, "image/png"
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (random.randint(0, 255), 120, 80)).save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue(), "image/jpeg"
+
+def _slug(text):
+    return re.sub(r'[^a-z0-9]+', '-', text.lower()).strip('-') or "poi"
+
+def _activity(base_url, config, city, day_number, index):
+    name = f"{city} Highlight {day_number}.{index}"
+    broken = random.random() < config.broken_image_rate
+    return {
+        "name": name,
+        "time_of_day": ["Morning", "Afternoon", "Evening", "Night"][index % 4],
+        "description": f"A detailed look at {name}, one of the places visitors to {city} should not miss. " * 2,
+        "why_relevant": f"Matches the traveller's interests and is a well-known part of {city}.",
+        "estimated_duration": "2-3 hours",
+        "estimated_cost": "€20 per person",
+        "poi_image_url": f"{base_url}/images/{'missing/' if broken else ''}{_slug(name)}.jpg",
+    }
+
+def _day(base_url, config, city, day_number, activities_per_day=4):
+    return {
+        "day": day_number,
+        "day_summary": f"Day {day_number} exploring {city}.",
+        "activities": [_activity(base_url, config, city, day_number, i) for i in range(1, activities_per_day + 1)],
+        "daily_meal_suggestions": {"breakfast": "Local bakery.", "lunch": "Cafe near the sights.", "dinner": "Traditional restaurant."},
+        "daily_logistical_tips": "Buy a day pass for public transport and book popular sights online.",
+    }
+
+def canned_response(prompt, base_url, config):
+    """Returns the response object the real model would be expected to produce for prompt."""
+    destination_match = re.search(r"- Destination: ([^-]+?)(?: - |$)", prompt)
+    destination = destination_match.group(1).strip() if destination_match else "Paris, France"
+    city = destination.split(",")[0]
+    duration_match = re.search(r"\((\d+) days\)|Duration: (\d+) days", prompt)
+    duration = int(next(g for g in duration_match.groups() if g)) if duration_match else 3
+    costs = {"estimated_cost": "€1200 - €1600 for 2 people", "estimated_daily_meal_cost_per_person": "€40-60 EUR"}
+
+    if "'images'" in prompt: # Batched placeholder request
+        ids = [int(i) for i in re.findall(r"^(\d+): ", prompt, re.MULTILINE)]
+        return {"images": [{"id": i, "image_url": f"{base_url}/images/placeholder-{i}.jpg"} for i in ids]}
+    if "'cities'" in prompt:
+        return {"cities": ["Paris, France", "Rome, Italy", "Tokyo, Japan", "New York, USA"]}
+    if "compact trip skeleton" in prompt:
+        days = [{"day": d, "theme": f"Theme of day {d}.", "anchor_pois": [f"{city} Highlight {d}.1"]} for d in range(1, duration + 1)]
+        return dict({"destination": destination, "days": days}, **costs)
+    if "representing this one day's plan" in prompt:
+        day_match = re.search(r"Set 'day' to (\d+)", prompt)
+        return _day(base_url, config, city, int(day_match.group(1)) if day_match else 1)
+    if "'itinerary'" in prompt:
+        continuation = re.search(r"ONLY days (\d+) to (\d+)", prompt)
+        first, last = (int(continuation.group(1)), int(continuation.group(2))) if continuation else (1, duration)
+        return dict({"destination": destination, "itinerary": [_day(base_url, config, city, d) for d in range(first, last + 1)]}, **costs)
+    return {"image_url": f"{base_url}/images/{_slug(prompt[:40])}.jpg"} # Single placeholder request
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive, like the real services
+    config = None # Set by start_mock_services
+    base_url = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            return {}
+
+    def do_POST(self):
+        request = self._read_json()
+        if self.path.rstrip("/").endswith("/token"):
+            self.config.count("token")
+            return self._send_json(200, {
+                "token": "mock-token",
+                "openai_key": "mock-key",
+                "openai_endpoint": self.base_url,
+                "azure_deployment": "gpt-4o/mock-deployment",
+                "openai_api_version": "2024-02-01",
+                "expires_in": self.config.token_ttl_seconds,
+            })
+        if "/chat/completions" in self.path:
+            return self._completion(request)
+        self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def _completion(self, request):
+        config = self.config
+        config.count("completions")
+        time.sleep(config.latency_seconds)
+        if random.random() < config.error_rate:
+            config.count("errors")
+            if random.random() < 0.5:
+                return self._send_json(429, {"error": {"message": "Rate limit exceeded (mock)"}}, {"Retry-After": "1"})
+            return self._send_json(500, {"error": {"message": "Internal error (mock)"}})
+
+        prompt = " ".join(m.get("content", "") for m in request.get("messages", []) if m.get("role") == "user")
+        content = json.dumps(canned_response(prompt, self.base_url, config), ensure_ascii=False)
+        finish_reason = "stop"
+        max_chars = int(request.get("max_tokens") or 4096) * CHARS_PER_TOKEN
+        if len(content) > max_chars or random.random() < config.truncate_rate:
+            content = content[:min(max_chars, int(len(content) * random.uniform(0.5, 0.9)))]
+            finish_reason = "length"
+            config.count("truncated")
+
+        completion_tokens = len(content) // CHARS_PER_TOKEN + 1
+        prompt_tokens = len(prompt) // CHARS_PER_TOKEN + 1
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+        if request.get("stream"):
+            return self._stream(content, finish_reason)
+        if config.tokens_per_second:
+            time.sleep(completion_tokens / config.tokens_per_second)
+        self._send_json(200, {
+            "id": f"chatcmpl-mock-{random.getrandbits(32):08x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "gpt-4o"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": finish_reason}],
+            "usage": usage,
+        })
+
+    def _stream(self, content, finish_reason):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunk_chars = STREAM_CHUNK_TOKENS * CHARS_PER_TOKEN
+
+        def send_event(payload):
+            data = f"data: {payload}\n\n".encode('utf-8')
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        for start in range(0, len(content), chunk_chars):
+            if self.config.tokens_per_second:
+                time.sleep(STREAM_CHUNK_TOKENS / self.config.tokens_per_second)
+            send_event(json.dumps({"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()), "model": "gpt-4o",
+                                   "choices": [{"index": 0, "delta": {"content": content[start:start + chunk_chars]}, "finish_reason": None}]}))
+        send_event(json.dumps({"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()), "model": "gpt-4o",
+                               "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]}))
+        send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _image(self, head_only):
+        if not self.path.startswith("/images/") or self.path.startswith("/images/missing/"):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.config.count("images")
+        time.sleep(self.config.image_latency_seconds)
+        body, content_type = _image_bytes(self.config.image_size)
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", f'"{_slug(self.path)}"')
+        self.end_headers()
+        if not head_only:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        self._image(head_only=False)
+
+    def do_HEAD(self):
+        self._image(head_only=True)
+
+def start_mock_services(config=None, host="127.0.0.1", port=0):
+    """
+    Starts the mock services on a daemon thread. port=0 picks a free port.
+    Returns (server, base_url); call server.shutdown() to stop.
+    """
+    config = config or MockConfig()
+    server = ThreadingHTTPServer((host, port), type("ConfiguredMockHandler", (MockHandler,), {}))
+    server.daemon_threads = True
+    base_url = f"http://{host}:{server.server_address[1]}"
+    server.RequestHandlerClass.config = config
+    server.RequestHandlerClass.base_url = base_url
+    threading.Thread(target=server.serve_forever, name="mock-services", daemon=True).start()
+    return server, base_url
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the mock token, chat completions and image services.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=500.0, help="Generation speed (0 = instant)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of completions failing with 429/500")
+    parser.add_argument("--truncate-rate", type=float, default=0.0, help="Fraction of completions cut off early")
+    parser.add_argument("--broken-image-rate", type=float, default=0.2, help="Fraction of POI image URLs returning 404")
+    args = parser.parse_args()
+    config = MockConfig(args.latency, args.tokens_per_second, args.error_rate, args.truncate_rate, args.broken_image_rate)
+    server, base_url = start_mock_services(config, args.host, args.port)
+    print(f"Mock services listening on {base_url}")
+    print(f"  LLM_TOKEN_URL={base_url}/v1/openai/token LLM_OPENAI_BASE_URL={base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# benchmarks/run_benchmark.py
+# End-to-end latency/throughput benchmark for create_travel_itinerary against the offline
+# mock services (benchmarks/mock_services.py): token fetch, chat completions, placeholder
+# resolution, image probing/download/thumbnailing and saving, under varying trip lengths
+# and concurrency.
+#
+# Usage:
+#   python benchmarks/run_benchmark.py --durations 3,7,14 --concurrency 1,4,8 --requests 8
+#   python benchmarks/run_benchmark.py --mode parallel_days --error-rate 0.05 --json results.json
+import argparse
+import datetime
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+from benchmarks.mock_services import MockConfig, start_mock_services # noqa: E402
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(fraction * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def _preferences(duration_days, request_number):
+    from_date = datetime.date(2025, 7, 1) + datetime.timedelta(days=request_number) # Distinct prompts, no cache hits
+    return {
+        "destination": "Paris, France",
+        "from_date": from_date,
+        "to_date": from_date + datetime.timedelta(days=duration_days - 1),
+        "num_travellers": 2,
+        "interests": ["Museums", "Food"],
+        "budget": "Mid-Range",
+        "additional_prefs": "",
+    }
+
+def run_scenario(pipeline, duration_days, concurrency, request_count, generation_mode, work_dir):
+    """Runs request_count itineraries with concurrency workers. Returns a result dictionary."""
+    latencies = []
+    failures = 0
+
+    def one_request(request_number):
+        output_dir = os.path.join(work_dir, f"d{duration_days}_c{concurrency}_{request_number}")
+        started_at = time.perf_counter()
+        itinerary_data, _ = pipeline.create_travel_itinerary(
+            _preferences(duration_days, request_number), generation_mode=generation_mode, output_dir=output_dir
+        )
+        return time.perf_counter() - started_at, bool(itinerary_data)
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for latency, ok in executor.map(one_request, range(request_count)):
+            latencies.append(latency)
+            failures += 0 if ok else 1
+    wall_time = time.perf_counter() - started_at
+
+    latencies.sort()
+    return {
+        "duration_days": duration_days,
+        "concurrency": concurrency,
+        "requests": request_count,
+        "failures": failures,
+        "p50_seconds": round(percentile(latencies, 0.50), 3),
+        "p95_seconds": round(percentile(latencies, 0.95), 3),
+        "p99_seconds": round(percentile(latencies, 0.99), 3),
+        "mean_seconds": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+        "wall_seconds": round(wall_time, 3),
+        "itineraries_per_minute": round(request_count / wall_time * 60, 2) if wall_time else 0.0,
+    }
+
+def _int_list(value):
+    return [int(part) for part in value.split(",") if part.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark create_travel_itinerary end to end against local mock services.")
+    parser.add_argument("--durations", type=_int_list, default=[3, 7, 14], help="Comma-separated trip lengths in days")
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 4, 8], help="Comma-separated numbers of concurrent requests")
+    parser.add_argument("--requests", type=int, default=8, help="Itineraries per scenario")
+    parser.add_argument("--mode", default="single", choices=["single", "parallel_days", "auto"], help="Generation mode")
+    parser.add_argument("--latency", type=float, default=0.2, help="Mock time to first token (seconds)")
+    parser.add_argument("--tokens-per-second", type=float, default=500.0, help="Mock generation speed")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of mock completions failing with 429/500")
+    parser.add_argument("--truncate-rate", type=float, default=0.0, help="Fraction of mock completions truncated")
+    parser.add_argument("--broken-image-rate", type=float, default=0.2, help="Fraction of POI image URLs returning 404")
+    parser.add_argument("--json", dest="json_path", help="Also write the results to this JSON file")
+    parser.add_argument("--keep-output", action="store_true", help="Keep the generated itineraries and caches")
+    args = parser.parse_args()
+
+    config = MockConfig(args.latency, args.tokens_per_second, args.error_rate, args.truncate_rate, args.broken_image_rate)
+    server, base_url = start_mock_services(config)
+    os.environ["LLM_TOKEN_URL"] = f"{base_url}/v1/openai/token" # Read by llm_api at import time
+    os.environ["LLM_OPENAI_BASE_URL"] = base_url
+    work_dir = tempfile.mkdtemp(prefix="itinerary-benchmark-")
+
+    import image_cache # Imported after the environment is set up
+    import pipeline
+    from llm_access import llm_api, usage_ledger
+    image_cache.IMAGE_CACHE_DIR = os.path.join(work_dir, "image-cache") # Cold cache, isolated from the real one
+    usage_ledger.LEDGER_DB_PATH = os.path.join(work_dir, "llm_usage.sqlite3") # Keep benchmark calls out of the real ledger
+    llm_api.enable_response_cache(False)
+    llm_api.configure_rate_limits(requests_per_minute=100000, tokens_per_minute=100000000) # Measure the pipeline, not the limiter
+
+    print(f"Mock services at {base_url}; writing to {work_dir}")
+    results = []
+    try:
+        for duration_days in args.durations:
+            for concurrency in args.concurrency:
+                result = run_scenario(pipeline, duration_days, concurrency, args.requests, args.mode, work_dir)
+                results.append(result)
+                print(
+                    f"{duration_days:>3}d x{concurrency:<3} p50 {result['p50_seconds']:>7.3f}s  p95 {result['p95_seconds']:>7.3f}s  "
+                    f"p99 {result['p99_seconds']:>7.3f}s  {result['itineraries_per_minute']:>8.2f}/min  failures {result['failures']}"
+                )
+        usage_by_caller = usage_ledger.summarize_usage("caller")
+        for row in usage_by_caller:
+            print(f"{row['group']:<18} {row['calls']:>5} calls  {row['total_tokens']:>9} tokens  {row['avg_total_tokens']:>8} avg  ${row['cost_usd']:.4f}")
+    finally:
+        server.shutdown()
+        if not args.keep_output:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"Mock service counters: {config.stats}")
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({"mode": args.mode, "mock_stats": config.stats, "usage_by_caller": usage_by_caller, "results": results}, f, indent=4)
+        print(f"Results written to {args.json_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# destination_index.py
+# Process-wide indexes behind the app's sidebar: the destination list (input/world_cities.json,
+# else a city list from the LLM) and the interest categories (input/Dataset.sqlite3, see
+# poi_dataset.py, else input/Dataset.json).
+# Streamlit reruns app.main on every widget interaction; these are parsed once per process and
+# only re-read when the source file's mtime or size changes. The LLM fallback list is persisted
+# to disk so it is fetched once, not once per rerun or per process.
+import json
+import os
+import threading
+import time
+import sqlite3
+from llm_access.llm_api import get_llm_response # For the LLM city list fallback
+import poi_dataset
+
+WORLD_CITIES_PATH = os.path.join("input", "world_cities.json")
+DATASET_PATH = os.path.join("input", "Dataset.json")
+DATASET_DB_PATH = poi_dataset.DATASET_DB_PATH # Preferred: only the categories table is read
+LLM_CITIES_CACHE_PATH = os.path.join(".cache", "llm_cities.json") # Persisted LLM fallback list
+LLM_CITIES_RETRY_AFTER = 5 * 60 # Seconds before a failed LLM fallback is attempted again
+OTHER_DESTINATION_OPTION = "Other - type your own"
+DEFAULT_INTEREST_OPTIONS = ["History", "Adventure", "Relaxation", "Food", "Culture", "Nature", "Nightlife", "Shopping"]
+
+_file_cache = {} # path -> ((mtime, size), parsed value)
+_file_cache_lock = threading.Lock()
+_llm_cities_lock = threading.Lock() # Only one session fetches the fallback list
+_llm_cities_failed_at = 0.0
+
+def get_famous_cities_from_llm():
+    """
+    Fetches a list of famous cities from the LLM.
+    Returns a list of city strings or None if an error occurs.
+    """
+    prompt = (
+        "Generate a list of approximately 75-100 globally famous cities suitable for tourism. "
+        "Format the response as a single JSON object with one key: 'cities'. "
+        "The value of 'cities' should be a JSON list of strings. "
+        "Each string should be in the format 'City Name, Country Name'. "
+        "Example: {\"cities\": [\"Paris, France\", \"Tokyo, Japan\", \"Rome, Italy\"]}"
+    )
+    try:
+        response_data = get_llm_response(prompt, caller="city_list") # Expects a dictionary
+        if response_data and isinstance(response_data, dict) and "cities" in response_data and isinstance(response_data["cities"], list):
+            cities = [str(city) for city in response_data["cities"] if isinstance(city, str)]
+            if cities:
+                return sorted(list(set(cities))) # Ensure uniqueness and sort
+        return None
+    except Exception as e:
+        print(f"Error fetching cities from LLM: {e}")
+        return None
+
+def _load_file_with_cache(path, load_fn):
+    """
+    Returns load_fn(path), reusing the previous result while the file's mtime and size are
+    unchanged. Returns None if the file is missing or load_fn fails.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _file_cache_lock:
+        cached = _file_cache.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+    try:
+        value = load_fn(path)
+    except (IOError, json.JSONDecodeError, sqlite3.Error) as e:
+        print(f"Could not load {path}: {e}")
+        value = None
+    with _file_cache_lock:
+        _file_cache[path] = (signature, value)
+    return value
+
+def _load_with_cache(path, parse_fn):
+    """Cached parse_fn(json_data) for the JSON file at path; see _load_file_with_cache."""
+    def load_json(json_path):
+        with open(json_path, 'r', encoding='utf-8') as f:
+            return parse_fn(json.load(f))
+    return _load_file_with_cache(path, load_json)
+
+def _parse_cities(data):
+    if isinstance(data, dict) and isinstance(data.get("cities"), list):
+        return sorted(set(str(city) for city in data["cities"] if isinstance(city, str)))
+    return None
+
+def _parse_categories(data):
+    """Splits every POI's pipe-delimited 'category' field into a sorted list of unique categories."""
+    if not isinstance(data, list):
+        return None
+    all_categories = set()
+    for poi in data:
+        if isinstance(poi, dict):
+            all_categories.update(poi_dataset.split_categories(poi.get(poi_dataset.CATEGORY_COLUMN)))
+    return sorted(all_categories)
+
+def _llm_fallback_cities():
+    """Returns the persisted LLM city list, fetching and saving it on first use."""
+    global _llm_cities_failed_at
+    cities = _load_with_cache(LLM_CITIES_CACHE_PATH, _parse_cities)
+    if cities:
+        return cities
+    with _llm_cities_lock:
+        cities = _load_with_cache(LLM_CITIES_CACHE_PATH, _parse_cities) # Another session may have fetched it
+        if cities:
+            return cities
+        if time.time() - _llm_cities_failed_at < LLM_CITIES_RETRY_AFTER:
+            return None
+        cities = get_famous_cities_from_llm()
+        if not cities:
+            _llm_cities_failed_at = time.time()
+            return None
+        try:
+            os.makedirs(os.path.dirname(LLM_CITIES_CACHE_PATH), exist_ok=True)
+            tmp_path = f"{LLM_CITIES_CACHE_PATH}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"cities": cities}, f, indent=4, ensure_ascii=False)
+            os.replace(tmp_path, LLM_CITIES_CACHE_PATH)
+        except IOError as e:
+            print(f"Could not persist LLM city list: {e}")
+        return cities
+
+def get_popular_destinations():
+    """
+    Returns the sorted destination options: world_cities.json if it has any cities, else the
+    LLM fallback list, always ending with OTHER_DESTINATION_OPTION. Returns a fresh list.
+    """
+    cities = _load_with_cache(WORLD_CITIES_PATH, _parse_cities) or _llm_fallback_cities() or []
+    return cities + [OTHER_DESTINATION_OPTION] if OTHER_DESTINATION_OPTION not in cities else list(cities)
+
+def get_interest_options():
+    """Returns the sorted interest categories from the POI dataset, or DEFAULT_INTEREST_OPTIONS. Returns a fresh list."""
+    categories = _load_file_with_cache(DATASET_DB_PATH, poi_dataset.load_categories) or _load_with_cache(DATASET_PATH, _parse_categories)
+    return list(categories) if categories else sorted(DEFAULT_INTEREST_OPTIONS)
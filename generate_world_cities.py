@@ -30,7 +30,7 @@ def generate_and_save_world_cities():
     )
     
     try:
-        response_data = get_llm_response(prompt) # Expects a dictionary
+        response_data = get_llm_response(prompt, caller="city_list") # Expects a dictionary
         
         if response_data and isinstance(response_data, dict) and "cities" in response_data and isinstance(response_data["cities"], list):
             cities_list = [str(city) for city in response_data["cities"] if isinstance(city, str)]
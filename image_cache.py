@@ -0,0 +1,396 @@
+# image_cache.py
+# Persistent, content-addressed cache for downloaded images, shared by every itinerary run
+# and every process using the same IMAGE_CACHE_DIR (the app, batch runs, job queue workers).
+# Layout under IMAGE_CACHE_DIR:
+#   blobs/<sha256><ext>  - image bytes, stored once per unique content
+#   thumbnails/...       - renditions derived from blobs (see image_thumbnails.py)
+#   index.sqlite3        - URL -> blob mapping plus HTTP validators (ETag / Last-Modified), access times
+#                          and the derived files of each blob
+import contextlib
+import json
+import os
+import shutil
+import hashlib
+import sqlite3
+import threading
+import time
+import uuid
+import requests
+from urllib.parse import urlparse
+from llm_access import http_session # Pooled keep-alive sessions shared with the rest of the app
+from llm_access import telemetry # fetch_image records hit/revalidated/miss on the caller's span
+
+IMAGE_CACHE_DIR = os.path.join(".cache", "images") # Kept outside 'Output', whose request directories are garbage collected
+IMAGE_CACHE_MAX_BYTES = 512 * 1024 * 1024 # Total size of cached blobs and their derived files before LRU eviction kicks in
+IMAGE_CACHE_REVALIDATE_AFTER = 24 * 60 * 60 # Seconds a cached URL is served without asking the server again
+IMAGE_CACHE_TOUCH_INTERVAL = 10 * 60 # Seconds between last_access updates for the same entry; LRU order needs no finer grain
+BLOBS_SUBDIR = "blobs"
+THUMBNAILS_SUBDIR = "thumbnails" # Renditions derived from blobs (see image_thumbnails.py), evicted with them
+INDEX_FILENAME = "index.sqlite3"
+LEGACY_INDEX_FILENAME = "index.json" # Index format of earlier versions, imported once and removed
+DOWNLOAD_TIMEOUT = 10 # Seconds, same as the original direct download
+PROBE_TIMEOUT = 3 # Seconds for the HEAD / ranged GET that checks a URL before downloading it
+IMAGE_MAX_BYTES = 20 * 1024 * 1024 # Larger images are rejected by probe_image and aborted mid-download
+DEAD_URL_TTL = 60 * 60 # Seconds a URL that definitely failed probing (404/410, not an image, too large) is rejected without asking again
+PROBE_RETRY_TTL = 60 # Seconds other probe failures (5xx, timeouts, connection errors) are remembered; they are often transient
+DEAD_STATUS_CODES = (404, 410)
+
+_connection = None
+_connection_path = None # IMAGE_CACHE_DIR can be changed at runtime (benchmarks); reopen when it is
+_index_lock = threading.RLock() # One shared connection, serialized across threads; other processes use SQLite locking
+_dead_urls = {} # url -> (retry_after_timestamp, reason) for URLs that failed probing
+_dead_urls_lock = threading.Lock()
+
+class ImageTooLargeError(requests.exceptions.RequestException):
+    """Raised when an image response exceeds IMAGE_MAX_BYTES; the partial download is discarded."""
+
+def _index_path():
+    return os.path.join(IMAGE_CACHE_DIR, INDEX_FILENAME)
+
+def _blobs_dir():
+    return os.path.join(IMAGE_CACHE_DIR, BLOBS_SUBDIR)
+
+def _get_connection():
+    """Opens (and creates, if needed) the index database. Caller must hold _index_lock."""
+    global _connection, _connection_path
+    if _connection is not None and _connection_path == _index_path():
+        return _connection
+    if _connection is not None:
+        _connection.close()
+    os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
+    # Autocommit mode: multi-statement updates use explicit BEGIN IMMEDIATE transactions
+    conn = sqlite3.connect(_index_path(), timeout=30, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL") # Cache hits read while other processes store downloads
+    conn.row_factory = sqlite3.Row
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS urls ("
+        " url TEXT PRIMARY KEY,"
+        " sha256 TEXT NOT NULL,"
+        " ext TEXT NOT NULL,"
+        " etag TEXT,"
+        " last_modified TEXT,"
+        " validated_at REAL NOT NULL,"
+        " last_access REAL NOT NULL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_urls_sha256 ON urls (sha256)")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS blobs ("
+        " sha256 TEXT PRIMARY KEY,"
+        " ext TEXT NOT NULL,"
+        " size INTEGER NOT NULL,"
+        " last_access REAL NOT NULL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_blobs_last_access ON blobs (last_access)")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS derived ("
+        " path TEXT PRIMARY KEY,"
+        " sha256 TEXT NOT NULL,"
+        " size INTEGER NOT NULL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_derived_sha256 ON derived (sha256)")
+    _connection, _connection_path = conn, _index_path()
+    _import_legacy_index(conn)
+    return _connection
+
+@contextlib.contextmanager
+def _transaction():
+    """Runs the block in a write transaction that also excludes other processes. Yields the connection."""
+    with _index_lock:
+        conn = _get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+def _import_legacy_index(conn):
+    """Moves entries from an index.json written by earlier versions into the database, then removes the file."""
+    legacy_path = os.path.join(IMAGE_CACHE_DIR, LEGACY_INDEX_FILENAME)
+    try:
+        with open(legacy_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return
+    except (json.JSONDecodeError, IOError) as e:
+        print(f"Legacy image cache index unreadable, ignoring it: {e}")
+        data = {}
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        for sha256, blob in (data.get("blobs") or {}).items():
+            conn.execute(
+                "INSERT OR IGNORE INTO blobs (sha256, ext, size, last_access) VALUES (?, ?, ?, ?)",
+                (sha256, blob["ext"], blob.get("size", 0), blob.get("last_access", 0))
+            )
+        for url, entry in (data.get("urls") or {}).items():
+            conn.execute(
+                "INSERT OR IGNORE INTO urls (url, sha256, ext, etag, last_modified, validated_at, last_access) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, entry["sha256"], entry["ext"], entry.get("etag"), entry.get("last_modified"), entry.get("validated_at", 0), entry.get("last_access", 0))
+            )
+        conn.execute("COMMIT")
+    except (sqlite3.Error, KeyError, AttributeError, TypeError) as e:
+        conn.execute("ROLLBACK")
+        print(f"Failed to import legacy image cache index: {e}")
+    try:
+        os.remove(legacy_path)
+    except OSError:
+        pass
+
+def _blob_path(sha256, ext):
+    return os.path.join(_blobs_dir(), f"{sha256}{ext}")
+
+def _extension_for(image_url):
+    path_parts = os.path.splitext(urlparse(image_url).path)
+    return path_parts[1] if len(path_parts) > 1 and path_parts[1] else '.jpg' # Default to .jpg
+
+def _http_get(image_url, headers):
+    """GETs image_url on the shared session, retrying without SSL verification if verification fails."""
+    return http_session.get(image_url, stream=True, timeout=http_session.default_timeout(DOWNLOAD_TIMEOUT), headers=headers, insecure_fallback=True)
+
+def _cached_entry(image_url):
+    """Returns (entry, blob_path) for image_url if both the index entry and its blob exist."""
+    with _index_lock:
+        conn = _get_connection()
+        row = conn.execute("SELECT * FROM urls WHERE url = ?", (image_url,)).fetchone()
+        if row is None:
+            return None, None
+        entry = dict(row)
+        path = _blob_path(entry["sha256"], entry["ext"])
+        if not os.path.exists(path): # Blob removed behind our back (manual cleanup, eviction by another process)
+            conn.execute("DELETE FROM urls WHERE url = ?", (image_url,))
+            return None, None
+        return entry, path
+
+def _touch(image_url, entry, validated):
+    """
+    Records an access (and optionally a successful revalidation) for a URL and its blob.
+    Plain hits only write when the stored access time is older than IMAGE_CACHE_TOUCH_INTERVAL,
+    so serving a hot image does not cost a database write each time.
+    """
+    now = time.time()
+    if not validated and now - entry.get("last_access", 0) < IMAGE_CACHE_TOUCH_INTERVAL:
+        return
+    try:
+        with _transaction() as conn:
+            if validated:
+                conn.execute("UPDATE urls SET last_access = ?, validated_at = ? WHERE url = ?", (now, now, image_url))
+            else:
+                conn.execute("UPDATE urls SET last_access = ? WHERE url = ?", (now, image_url))
+            conn.execute("UPDATE blobs SET last_access = ? WHERE sha256 = ?", (now, entry["sha256"]))
+    except sqlite3.Error as e:
+        print(f"Failed to update image cache access time: {e}")
+
+def _store_response(image_url, response, ext):
+    """Streams a 200 response into the blob store, deduplicating by content hash. Returns the blob path."""
+    os.makedirs(_blobs_dir(), exist_ok=True)
+    tmp_path = os.path.join(_blobs_dir(), f".{uuid.uuid4().hex}.part")
+    hasher = hashlib.sha256()
+    size = 0
+    declared_size = response.headers.get("Content-Length", "")
+    if declared_size.isdigit() and int(declared_size) > IMAGE_MAX_BYTES:
+        raise ImageTooLargeError(f"{image_url} is {declared_size} bytes, limit is {IMAGE_MAX_BYTES}")
+    try:
+        with open(tmp_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=8192):
+                hasher.update(chunk)
+                size += len(chunk)
+                if size > IMAGE_MAX_BYTES: # Content-Length missing or wrong; stop reading early
+                    raise ImageTooLargeError(f"{image_url} exceeded {IMAGE_MAX_BYTES} bytes while downloading")
+                f.write(chunk)
+        sha256 = hasher.hexdigest()
+        with _transaction() as conn:
+            existing_blob = conn.execute("SELECT ext FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            if existing_blob and os.path.exists(_blob_path(sha256, existing_blob[0])):
+                ext = existing_blob[0] # Same bytes already cached (possibly under another URL or by another process)
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, _blob_path(sha256, ext))
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO blobs (sha256, ext, size, last_access) VALUES (?, ?, ?, ?)",
+                (sha256, ext, size, now)
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO urls (url, sha256, ext, etag, last_modified, validated_at, last_access) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (image_url, sha256, ext, response.headers.get("ETag"), response.headers.get("Last-Modified"), now, now)
+            )
+            _evict_if_needed(conn, keep=sha256)
+        return _blob_path(sha256, ext)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def register_derived_file(blob_path, derived_path):
+    """
+    Records a file derived from a cached blob (e.g. its thumbnail) so it counts toward
+    IMAGE_CACHE_MAX_BYTES and is evicted with the blob. Files of blobs that are no longer
+    cached are not recorded.
+    """
+    sha256 = os.path.splitext(os.path.basename(blob_path))[0]
+    try:
+        size = os.path.getsize(derived_path)
+        with _transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO derived (path, sha256, size) SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM blobs WHERE sha256 = ?)",
+                (os.path.abspath(derived_path), sha256, size, sha256)
+            )
+            _evict_if_needed(conn, keep=sha256)
+    except (OSError, sqlite3.Error) as e:
+        print(f"Failed to record derived image {derived_path}: {e}")
+
+def _remove_derived_files(conn, sha256):
+    """
+    Removes files derived from a blob: those recorded by register_derived_file and any
+    '<sha256>_*' file under THUMBNAILS_SUBDIR left by earlier versions. Returns the bytes recorded.
+    """
+    rows = conn.execute("SELECT path, size FROM derived WHERE sha256 = ?", (sha256,)).fetchall()
+    conn.execute("DELETE FROM derived WHERE sha256 = ?", (sha256,))
+    derived_dir = os.path.join(IMAGE_CACHE_DIR, THUMBNAILS_SUBDIR)
+    try:
+        names = os.listdir(derived_dir)
+    except FileNotFoundError:
+        names = []
+    paths = {row[0] for row in rows} | {os.path.abspath(os.path.join(derived_dir, name)) for name in names if name.startswith(f"{sha256}_")}
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return sum(row[1] for row in rows)
+
+def _evict_if_needed(conn, keep=None):
+    """
+    Removes least-recently-used blobs, with their derived files, until the cache fits
+    IMAGE_CACHE_MAX_BYTES. Runs inside the caller's transaction.
+    """
+    (total,) = conn.execute(
+        "SELECT (SELECT COALESCE(SUM(size), 0) FROM blobs) + (SELECT COALESCE(SUM(size), 0) FROM derived)"
+    ).fetchone()
+    if total <= IMAGE_CACHE_MAX_BYTES:
+        return
+    rows = conn.execute("SELECT sha256, ext, size FROM blobs ORDER BY last_access ASC").fetchall()
+    for sha256, ext, size in rows:
+        if total <= IMAGE_CACHE_MAX_BYTES:
+            break
+        if sha256 == keep:
+            continue
+        try:
+            os.remove(_blob_path(sha256, ext))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Failed to evict cached image {sha256}: {e}")
+            continue
+        total -= size + _remove_derived_files(conn, sha256)
+        conn.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+        conn.execute("DELETE FROM urls WHERE sha256 = ?", (sha256,))
+    print(f"Image cache evicted down to {total} bytes.")
+
+def _probe_request(image_url):
+    """HEADs image_url, falling back to a one-byte ranged GET for servers that do not support HEAD."""
+    timeout = (min(PROBE_TIMEOUT, http_session.HTTP_CONNECT_TIMEOUT), PROBE_TIMEOUT)
+    response = http_session.head(image_url, timeout=timeout, allow_redirects=True, retries=0, insecure_fallback=True)
+    if response.status_code in (403, 405, 501): # HEAD refused or not implemented; many CDNs still serve GET
+        response = http_session.get(image_url, timeout=timeout, stream=True, headers={"Range": "bytes=0-0"}, retries=0, insecure_fallback=True)
+        response.close()
+    return response
+
+def _content_length(response):
+    content_range = response.headers.get("Content-Range", "") # 'bytes 0-0/12345' for ranged responses
+    if "/" in content_range:
+        total = content_range.rsplit("/", 1)[1]
+        return int(total) if total.isdigit() else None
+    content_length = response.headers.get("Content-Length", "")
+    return int(content_length) if response.status_code != 206 and content_length.isdigit() else None
+
+def probe_image(image_url):
+    """
+    Checks that image_url is worth downloading: the server answers with a success status, an
+    image content type (when one is declared) and a size within IMAGE_MAX_BYTES. Uses a HEAD
+    request with a short timeout instead of committing to a full download, so dead links fail
+    fast. URLs with a cache entry pass without network access (stale entries are revalidated
+    by fetch_image's conditional GET). Definite failures are remembered for DEAD_URL_TTL
+    seconds, possibly transient ones for PROBE_RETRY_TTL. Returns (ok, reason).
+    """
+    entry, _ = _cached_entry(image_url)
+    if entry:
+        fresh = time.time() - entry.get("validated_at", 0) < IMAGE_CACHE_REVALIDATE_AFTER
+        return True, "cached" if fresh else "cached, stale"
+    with _dead_urls_lock:
+        dead = _dead_urls.get(image_url)
+        if dead and dead[0] > time.time():
+            return False, dead[1]
+
+    reason = None
+    definite = True
+    try:
+        response = _probe_request(image_url)
+        content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        size = _content_length(response)
+        if response.status_code >= 400:
+            reason = f"HTTP {response.status_code}"
+            definite = response.status_code in DEAD_STATUS_CODES
+        elif content_type and not content_type.startswith("image/") and content_type != "application/octet-stream":
+            reason = f"content type {content_type}"
+        elif size is not None and size > IMAGE_MAX_BYTES:
+            reason = f"{size} bytes exceeds the {IMAGE_MAX_BYTES} byte limit"
+    except requests.exceptions.RequestException as e:
+        reason = f"{e.__class__.__name__}: {e}"
+        definite = False
+
+    if reason:
+        with _dead_urls_lock:
+            _dead_urls[image_url] = (time.time() + (DEAD_URL_TTL if definite else PROBE_RETRY_TTL), reason)
+        return False, reason
+    return True, "ok"
+
+def fetch_image(image_url):
+    """
+    Returns the path of a cached blob holding the image at image_url, downloading it if needed.
+    Fresh entries are served without network access; stale ones are revalidated with
+    If-None-Match / If-Modified-Since and only re-downloaded if the server reports a change.
+    Raises requests.exceptions.RequestException on network/HTTP errors when nothing usable is cached.
+    """
+    entry, cached_path = _cached_entry(image_url)
+    if entry and time.time() - entry.get("validated_at", 0) < IMAGE_CACHE_REVALIDATE_AFTER:
+        _touch(image_url, entry, validated=False)
+        print(f"Image cache hit for {image_url}")
+        telemetry.annotate(cache="hit")
+        return cached_path
+
+    headers = {}
+    if entry:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    response = _http_get(image_url, headers)
+    try:
+        if entry and response.status_code == 304:
+            _touch(image_url, entry, validated=True)
+            print(f"Image cache revalidated {image_url}")
+            telemetry.annotate(cache="revalidated")
+            return cached_path
+        response.raise_for_status()
+        telemetry.annotate(cache="miss")
+        return _store_response(image_url, response, _extension_for(image_url))
+    finally:
+        response.close()
+
+def link_cached_image(blob_path, destination_path):
+    """
+    Makes blob_path available at destination_path, preferring a hard link (no extra disk
+    space, no copy) and falling back to a file copy when linking is not possible.
+    """
+    os.makedirs(os.path.dirname(destination_path) or ".", exist_ok=True)
+    if os.path.exists(destination_path):
+        return destination_path
+    try:
+        os.link(blob_path, destination_path)
+    except FileExistsError: # Another worker linked the same image concurrently
+        pass
+    except OSError: # Cross-device links, filesystems without hard link support, etc.
+        shutil.copy2(blob_path, destination_path)
+    return destination_path
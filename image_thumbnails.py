@@ -0,0 +1,88 @@
+# image_thumbnails.py
+# Bounded-resolution thumbnails for cached images. The Streamlit cards show activity images
+# at most 400px wide, so the itinerary links a small WebP rendition instead of the original.
+# Thumbnails are stored next to the image cache, keyed on the source blob, and are generated
+# in a process pool so decoding large JPEGs does not hold up the image worker threads.
+# Thumbnails count toward IMAGE_CACHE_MAX_BYTES and are evicted with their source blob.
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+import image_cache
+
+try:
+    from PIL import Image # Pillow is optional; without it the original images are used
+except ImportError:
+    Image = None
+
+THUMBNAIL_MAX_SIZE = (800, 800) # Twice the 400px card width, for high-DPI screens
+THUMBNAIL_FORMAT = "WEBP"
+THUMBNAIL_FALLBACK_FORMAT = "JPEG" # Used when this Pillow build has no WebP support
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_WORKERS = 2 # Processes decoding/encoding images
+THUMBNAIL_TIMEOUT = 30 # Seconds to wait for one thumbnail before using the original
+
+_FORMAT_EXTENSIONS = {"WEBP": ".webp", "JPEG": ".jpg"}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned, not forked: forking this multithreaded process could copy locks held by other threads
+            _pool = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def _output_format():
+    if Image is not None and THUMBNAIL_FORMAT in Image.registered_extensions().values():
+        return THUMBNAIL_FORMAT
+    return THUMBNAIL_FALLBACK_FORMAT
+
+def _render_thumbnail(source_path, destination_path, max_size, image_format, quality):
+    """Runs in a worker process: decodes source_path, downscales it and writes destination_path atomically."""
+    tmp_path = f"{destination_path}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        with Image.open(source_path) as img:
+            img.draft("RGB", max_size) # Lets the JPEG decoder skip full-resolution decoding
+            img.thumbnail(max_size) # Keeps the aspect ratio, never upscales
+            if img.mode not in ("RGB", "RGBA") or (image_format == "JPEG" and img.mode == "RGBA"):
+                img = img.convert("RGB")
+            img.save(tmp_path, format=image_format, quality=quality)
+        os.replace(tmp_path, destination_path)
+        return destination_path
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def thumbnail_path_for(blob_path):
+    """Returns where the thumbnail of a cached blob is (or will be) stored."""
+    blob_name = os.path.splitext(os.path.basename(blob_path))[0]
+    width, height = THUMBNAIL_MAX_SIZE
+    extension = _FORMAT_EXTENSIONS.get(_output_format(), ".jpg")
+    return os.path.join(image_cache.IMAGE_CACHE_DIR, image_cache.THUMBNAILS_SUBDIR, f"{blob_name}_{width}x{height}{extension}")
+
+def get_thumbnail(blob_path):
+    """
+    Returns the path of a bounded-resolution thumbnail for blob_path, creating it on first use.
+    Returns None if Pillow is not installed or the image cannot be decoded (e.g. SVG, corrupt
+    data); callers then keep using the original.
+    """
+    if Image is None:
+        return None
+    destination_path = thumbnail_path_for(blob_path)
+    if os.path.exists(destination_path):
+        return destination_path
+    os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+    try:
+        future = _get_pool().submit(
+            _render_thumbnail, blob_path, destination_path, THUMBNAIL_MAX_SIZE, _output_format(), THUMBNAIL_QUALITY
+        )
+        future.result(timeout=THUMBNAIL_TIMEOUT)
+    except Exception as e: # Undecodable image, broken pool, timeout: fall back to the original
+        print(f"Could not create thumbnail for {blob_path}: {e}")
+        return None
+    image_cache.register_derived_file(blob_path, destination_path)
+    return destination_path
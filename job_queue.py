@@ -0,0 +1,316 @@
+# job_queue.py
+# Background itinerary generation. The Streamlit app submits preferences and keeps only the
+# job id in st.session_state; worker threads run the pipeline outside the script run, so a
+# rerun mid-generation polls the same job instead of throwing the work away.
+# Jobs and their progress live in a local SQLite database shared by every worker:
+#   jobs        - one row per job: status, preferences, result, lease of the worker running it
+#   job_events  - the job's pipeline.stream_travel_itinerary events ('day', 'day_images', 'error'), in order
+# Workers claim queued jobs atomically, so the in-process pool (start_workers) and any number
+# of separate worker processes (python job_queue.py --workers N) share the load. A running job
+# whose worker stops renewing its lease is handed to another worker.
+#
+# Usage (extra worker process next to the app):
+#   python job_queue.py --workers 4
+import argparse
+import datetime
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+import output_store # Each job writes into its own request directory
+import poi_index # Built in the background when workers start
+from llm_access import telemetry
+from pipeline import stream_travel_itinerary, to_pipeline_preferences # Same JSON -> pipeline conversion as batch runs
+
+JOB_DB_PATH = os.path.join(".cache", "jobs.sqlite3")
+JOB_WORKERS = int(os.environ.get("ITINERARY_JOB_WORKERS", "2")) # In-process workers started by the app (0 = external workers only)
+JOB_LEASE_SECONDS = 60 # A running job not renewed for this long is considered abandoned
+JOB_MAX_ATTEMPTS = 2 # Abandoned jobs are retried until they have been started this many times
+JOB_IDLE_POLL_SECONDS = 1.0 # How often idle workers look for jobs submitted by other processes
+JOB_RETENTION_SECONDS = output_store.OUTPUT_MAX_AGE_SECONDS # Finished jobs are forgotten with their output
+FINISHED_STATUSES = ("done", "failed", "cancelled")
+
+_connection = None
+_lock = threading.Lock() # One shared connection, serialized across threads; other processes use SQLite locking
+_wakeup = threading.Event() # Set on submit so local workers pick new jobs up without waiting for the next poll
+_workers = []
+_workers_lock = threading.Lock()
+
+def _get_connection():
+    """Opens (and creates, if needed) the job database. Caller must hold _lock."""
+    global _connection
+    if _connection is None:
+        os.makedirs(os.path.dirname(JOB_DB_PATH), exist_ok=True)
+        # Autocommit mode: claims use explicit BEGIN IMMEDIATE transactions
+        _connection = sqlite3.connect(JOB_DB_PATH, timeout=30, check_same_thread=False, isolation_level=None)
+        _connection.execute("PRAGMA journal_mode=WAL") # Pollers read while workers write
+        _connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " status TEXT NOT NULL," # queued, running, done, failed, cancelled
+            " preferences TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " started_at REAL,"
+            " finished_at REAL,"
+            " worker TEXT,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " lease_expires_at REAL,"
+            " output_dir TEXT,"
+            " saved_path TEXT,"
+            " result TEXT,"
+            " error TEXT)"
+        )
+        _connection.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at)")
+        _connection.execute(
+            "CREATE TABLE IF NOT EXISTS job_events ("
+            " job_id TEXT NOT NULL,"
+            " seq INTEGER NOT NULL,"
+            " event TEXT NOT NULL,"
+            " PRIMARY KEY (job_id, seq))"
+        )
+    return _connection
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return str(value)
+
+def _purge_expired(conn):
+    """Deletes finished jobs (and their events) older than JOB_RETENTION_SECONDS. Caller must hold _lock."""
+    cutoff = time.time() - JOB_RETENTION_SECONDS
+    conn.execute("DELETE FROM job_events WHERE job_id IN (SELECT id FROM jobs WHERE finished_at < ?)", (cutoff,))
+    conn.execute("DELETE FROM jobs WHERE finished_at < ?", (cutoff,))
+
+def submit_job(preferences):
+    """
+    Queues an itinerary generation for preferences (the dictionary app.py builds; dates may be
+    datetime.date objects). Returns the job id, which is also the run's output_store request id
+    and its usage ledger request id.
+    """
+    job_id = output_store.new_request_id()
+    serialized = json.dumps(preferences, default=_json_default, ensure_ascii=False)
+    with _lock:
+        conn = _get_connection()
+        _purge_expired(conn)
+        conn.execute("INSERT INTO jobs (id, status, preferences, created_at) VALUES (?, 'queued', ?, ?)", (job_id, serialized, time.time()))
+    _wakeup.set()
+    return job_id
+
+def get_job(job_id):
+    """
+    Returns the job as a dictionary ('id', 'status', 'preferences', 'result', 'saved_path',
+    'error', timestamps and, while queued, 'queue_position' counting from 1), or None if unknown.
+    """
+    with _lock:
+        conn = _get_connection()
+        row = conn.execute(
+            "SELECT status, preferences, created_at, started_at, finished_at, attempts, saved_path, result, error"
+            " FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        queue_position = None
+        if row[0] == "queued":
+            (ahead,) = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at < ?", (row[2],)).fetchone()
+            queue_position = ahead + 1
+    status, preferences, created_at, started_at, finished_at, attempts, saved_path, result, error = row
+    return {
+        "id": job_id,
+        "status": status,
+        "preferences": json.loads(preferences),
+        "created_at": created_at,
+        "started_at": started_at,
+        "finished_at": finished_at,
+        "attempts": attempts,
+        "queue_position": queue_position,
+        "saved_path": saved_path,
+        "result": json.loads(result) if result else None,
+        "error": error,
+    }
+
+def get_events(job_id, after_seq=0):
+    """
+    Returns the job's events with seq > after_seq as dictionaries with an added 'seq' key, in order.
+    A restarted job's events are replaced and numbered from 1 again; callers following a job
+    restart from after_seq=0 when get_job reports a new 'attempts' value.
+    """
+    with _lock:
+        rows = _get_connection().execute(
+            "SELECT seq, event FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq", (job_id, after_seq)
+        ).fetchall()
+    return [dict(json.loads(event), seq=seq) for seq, event in rows]
+
+def discard_job(job_id):
+    """
+    Drops a job the session no longer needs: a queued or running job is cancelled (a running
+    worker stops at its next event), a finished one is deleted along with its output directory.
+    """
+    with _lock:
+        conn = _get_connection()
+        row = conn.execute("SELECT status, output_dir FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return
+        if row[0] not in FINISHED_STATUSES:
+            conn.execute("UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ?", (time.time(), job_id))
+            return
+        conn.execute("DELETE FROM job_events WHERE job_id = ?", (job_id,))
+        conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+    if row[1]:
+        output_store.remove_request_dir(row[1])
+
+def claim_job(worker_id):
+    """
+    Atomically takes the oldest queued job, or a running one whose lease expired, for worker_id.
+    Jobs abandoned JOB_MAX_ATTEMPTS times are failed instead. Returns (job_id, preferences,
+    created_at) or None when there is nothing to do.
+    """
+    now = time.time()
+    with _lock:
+        conn = _get_connection()
+        conn.execute("BEGIN IMMEDIATE") # Serializes claims across processes
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', finished_at = ?, error = 'Worker stopped responding'"
+                " WHERE status = 'running' AND lease_expires_at < ? AND attempts >= ?", (now, now, JOB_MAX_ATTEMPTS)
+            )
+            row = conn.execute(
+                "SELECT id, preferences, created_at, status FROM jobs"
+                " WHERE status = 'queued' OR (status = 'running' AND lease_expires_at < ?)"
+                " ORDER BY created_at LIMIT 1", (now,)
+            ).fetchone()
+            if row is not None:
+                if row[3] == "running": # Abandoned: restart from scratch (readers reset their cursor on the new attempt number)
+                    print(f"Job {row[0]} was abandoned by its worker; restarting it.")
+                    conn.execute("DELETE FROM job_events WHERE job_id = ?", (row[0],))
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, started_at = ?, lease_expires_at = ?"
+                    " WHERE id = ?", (worker_id, now, now + JOB_LEASE_SECONDS, row[0])
+                )
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+    return (row[0], json.loads(row[1]), row[2]) if row else None
+
+def _renew_lease(job_id, worker_id):
+    """Extends the job's lease. Returns False if the job was cancelled or taken over by another worker."""
+    with _lock:
+        cursor = _get_connection().execute(
+            "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND status = 'running' AND worker = ?",
+            (time.time() + JOB_LEASE_SECONDS, job_id, worker_id)
+        )
+    return cursor.rowcount == 1
+
+def _append_event(job_id, seq, event):
+    with _lock:
+        _get_connection().execute(
+            "INSERT OR REPLACE INTO job_events (job_id, seq, event) VALUES (?, ?, ?)",
+            (job_id, seq, json.dumps(event, default=_json_default, ensure_ascii=False))
+        )
+
+def _finish_job(job_id, worker_id, status, result=None, saved_path=None, error=None):
+    """Records the outcome unless the job was cancelled or taken over meanwhile. Returns True if recorded."""
+    with _lock:
+        cursor = _get_connection().execute(
+            "UPDATE jobs SET status = ?, finished_at = ?, result = ?, saved_path = ?, error = ?, lease_expires_at = NULL"
+            " WHERE id = ? AND status = 'running' AND worker = ?",
+            (status, time.time(), json.dumps(result, default=_json_default, ensure_ascii=False) if result else None,
+             saved_path, error, job_id, worker_id)
+        )
+    return cursor.rowcount == 1
+
+def _keep_lease(job_id, worker_id, stop_event, lost_event):
+    """Renews the lease while a long pipeline stage produces no events; flags cancellation."""
+    while not stop_event.wait(JOB_LEASE_SECONDS / 3):
+        if not _renew_lease(job_id, worker_id):
+            lost_event.set()
+            return
+
+def run_job(job_id, preferences, created_at, worker_id):
+    """Runs one claimed job: streams the pipeline, storing its events and final result."""
+    _, output_dir = output_store.create_request_dir(job_id)
+    with _lock:
+        _get_connection().execute("UPDATE jobs SET output_dir = ? WHERE id = ?", (output_dir, job_id))
+    stop_event, lost_event = threading.Event(), threading.Event()
+    threading.Thread(target=_keep_lease, args=(job_id, worker_id, stop_event, lost_event), name=f"job-lease-{job_id}", daemon=True).start()
+    status, result, saved_path, error = "failed", None, None, "Failed to get itinerary from LLM."
+    try:
+        with telemetry.span("job", job_id=job_id, queued_seconds=round(time.time() - created_at, 3)):
+            events = stream_travel_itinerary(dict(to_pipeline_preferences(preferences), request_id=job_id), output_dir=output_dir)
+            try:
+                for seq, event in enumerate(events, start=1):
+                    if lost_event.is_set() or not _renew_lease(job_id, worker_id):
+                        print(f"Job {job_id} was cancelled; stopping.")
+                        status, error = "cancelled", None
+                        break
+                    if event["event"] == "complete":
+                        status, result, saved_path, error = "done", event["itinerary"], event["saved_path"], None
+                    else:
+                        _append_event(job_id, seq, event)
+                        if event["event"] == "error":
+                            error = event.get("message", error)
+            finally:
+                events.close() # Stops the pipeline early on cancellation
+    except Exception as e: # One bad job must not take the worker down
+        print(f"Job {job_id} failed: {e}")
+        status, error = "failed", f"{e.__class__.__name__}: {e}"
+    finally:
+        stop_event.set()
+        output_store.release_request_dir(output_dir)
+    if not _finish_job(job_id, worker_id, status, result, saved_path, error):
+        output_store.remove_request_dir(output_dir) # Cancelled while running: nobody will read it
+
+def _worker_loop(worker_id, stop_event):
+    while not stop_event.is_set():
+        try:
+            claimed = claim_job(worker_id)
+        except sqlite3.Error as e:
+            print(f"Job worker {worker_id} could not claim a job: {e}")
+            claimed = None
+        if claimed is None:
+            _wakeup.wait(JOB_IDLE_POLL_SECONDS)
+            _wakeup.clear()
+            continue
+        run_job(*claimed, worker_id)
+
+def start_workers(count=None):
+    """
+    Starts count (default JOB_WORKERS) daemon worker threads in this process, once; later calls
+    are no-ops, so Streamlit reruns can call it freely. Returns the stop event of the pool.
+    """
+    count = JOB_WORKERS if count is None else count
+    with _workers_lock:
+        if _workers:
+            return _workers[0][1]
+        stop_event = threading.Event()
+        host = f"{socket.gethostname()}-{os.getpid()}"
+        for number in range(count):
+            worker_id = f"{host}-{number}-{uuid.uuid4().hex[:6]}"
+            thread = threading.Thread(target=_worker_loop, args=(worker_id, stop_event), name=f"job-worker-{number}", daemon=True)
+            thread.start()
+            _workers.append((thread, stop_event))
+        if count:
+            poi_index.start_background_build() # Ready before the first job builds its prompt
+            print(f"Started {count} itinerary job worker(s).")
+        return stop_event
+
+def main():
+    parser = argparse.ArgumentParser(description="Run itinerary job workers against the shared job queue.")
+    parser.add_argument("--workers", type=int, default=max(1, JOB_WORKERS), help="Number of worker threads")
+    args = parser.parse_args()
+
+    stop_event = start_workers(args.workers)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Stopping job workers after their current jobs...")
+        stop_event.set()
+        for thread, _ in _workers:
+            thread.join()
+
+if __name__ == "__main__":
+    main()
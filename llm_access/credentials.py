@@ -0,0 +1,136 @@
+# llm_access/credentials.py
+# Caches the credentials returned by the token endpoint together with their expiry, refreshes
+# them in a background thread shortly before they expire, and retries failed fetches with
+# exponential backoff. Callers keep using the current credentials while a refresh is running.
+import random
+import threading
+import time
+
+DEFAULT_TTL_SECONDS = 50 * 60 # Used when the token response carries no expiry information
+REFRESH_MARGIN_SECONDS = 5 * 60 # Refresh this long before the credentials expire
+FETCH_MAX_ATTEMPTS = 4 # Attempts per refresh before giving up for FAILURE_COOLDOWN_SECONDS
+FETCH_BACKOFF_BASE_SECONDS = 1.0
+FETCH_BACKOFF_MAX_SECONDS = 30.0
+FAILURE_COOLDOWN_SECONDS = 30.0 # After a failed refresh, callers get None instead of hammering the token endpoint
+MIN_REFRESH_INTERVAL_SECONDS = 5.0 # Guards against a refresh loop when tokens are very short-lived
+
+def _expiry_from(credentials, fetched_at, default_ttl_seconds):
+    """Derives an absolute expiry time from common token response fields, else applies the default TTL."""
+    for key in ("expires_in", "expires_in_seconds"):
+        try:
+            return fetched_at + float(credentials[key])
+        except (KeyError, TypeError, ValueError):
+            pass
+    for key in ("expires_at", "expires_on", "expiry"):
+        try:
+            return float(credentials[key]) # Epoch seconds
+        except (KeyError, TypeError, ValueError):
+            pass
+    return fetched_at + default_ttl_seconds
+
+class TokenCredentialManager:
+    """
+    Holds the current credentials for an LLM endpoint. fetch_fn performs one fetch and
+    returns the credentials dictionary, raising on any failure. Listeners registered with
+    add_refresh_listener are called with the new credentials after every successful fetch.
+    """
+
+    def __init__(self, fetch_fn, default_ttl_seconds=DEFAULT_TTL_SECONDS, refresh_margin_seconds=REFRESH_MARGIN_SECONDS):
+        self._fetch_fn = fetch_fn
+        self._default_ttl_seconds = default_ttl_seconds
+        self._refresh_margin_seconds = refresh_margin_seconds
+        self._fetch_lock = threading.Lock() # Only one fetch at a time; readers never take it
+        self._credentials = None
+        self._expires_at = 0.0
+        self._next_attempt_at = 0.0
+        self.last_error = None
+        self._listeners = []
+        self._refresh_thread = None
+        self._stop_event = threading.Event()
+
+    def add_refresh_listener(self, callback):
+        self._listeners.append(callback)
+
+    def _current(self):
+        credentials = self._credentials
+        if credentials is not None and time.time() < self._expires_at:
+            return credentials
+        return None
+
+    def get_credentials(self):
+        """
+        Returns valid credentials, fetching them synchronously if there are none yet or they
+        have expired. Returns None if fetching failed (the reason is in last_error); a new
+        attempt is made once FAILURE_COOLDOWN_SECONDS have passed.
+        """
+        credentials = self._current()
+        if credentials is not None:
+            return credentials
+        with self._fetch_lock:
+            credentials = self._current() # Another thread may have refreshed while we waited
+            if credentials is not None:
+                return credentials
+            if time.time() < self._next_attempt_at:
+                return None
+            self._refresh_locked()
+            return self._current()
+
+    def invalidate(self):
+        """Forces the next get_credentials call to fetch fresh credentials (e.g. after a 401)."""
+        self._expires_at = 0.0
+        self._next_attempt_at = 0.0
+
+    def _refresh_locked(self):
+        """Fetches new credentials with exponential backoff and jitter. Caller must hold _fetch_lock."""
+        for attempt in range(1, FETCH_MAX_ATTEMPTS + 1):
+            try:
+                fetched_at = time.time()
+                credentials = self._fetch_fn()
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Credential fetch attempt {attempt}/{FETCH_MAX_ATTEMPTS} failed: {e}")
+                if attempt < FETCH_MAX_ATTEMPTS:
+                    backoff = min(FETCH_BACKOFF_MAX_SECONDS, FETCH_BACKOFF_BASE_SECONDS * (2 ** (attempt - 1)))
+                    time.sleep(random.uniform(0, backoff)) # Full jitter
+                continue
+
+            self._credentials = credentials
+            self._expires_at = _expiry_from(credentials, fetched_at, self._default_ttl_seconds)
+            self._next_attempt_at = 0.0
+            self.last_error = None
+            for listener in list(self._listeners):
+                try:
+                    listener(credentials)
+                except Exception as e:
+                    print(f"Credential refresh listener failed: {e}")
+            self._ensure_refresh_thread()
+            return True
+
+        self._next_attempt_at = time.time() + FAILURE_COOLDOWN_SECONDS
+        return False
+
+    def _ensure_refresh_thread(self):
+        if self._refresh_thread is None or not self._refresh_thread.is_alive():
+            self._refresh_thread = threading.Thread(target=self._refresh_loop, name="llm-credential-refresh", daemon=True)
+            self._refresh_thread.start()
+
+    def _refresh_loop(self):
+        """Background loop: refreshes proactively before expiry; current credentials stay usable meanwhile."""
+        while not self._stop_event.is_set():
+            wait_seconds = self._expires_at - self._refresh_margin_seconds - time.time()
+            if wait_seconds > 0:
+                self._stop_event.wait(max(wait_seconds, MIN_REFRESH_INTERVAL_SECONDS))
+                continue
+            with self._fetch_lock:
+                if self._expires_at - self._refresh_margin_seconds - time.time() > 0:
+                    continue # A foreground fetch already refreshed
+                print("Refreshing LLM credentials before expiry...")
+                refreshed = self._refresh_locked()
+            if not refreshed:
+                self._stop_event.wait(FAILURE_COOLDOWN_SECONDS)
+            else:
+                self._stop_event.wait(MIN_REFRESH_INTERVAL_SECONDS)
+
+    def stop(self):
+        """Stops the background refresh thread."""
+        self._stop_event.set()
@@ -0,0 +1,108 @@
+# llm_access/http_session.py
+# Shared, pooled requests sessions for all plain HTTP traffic: image probes and downloads in
+# pipeline/image_cache and the token call in llm_api. Connections are kept alive per host,
+# idempotent requests are retried on connection errors and transient statuses, and every
+# request gets separate connect/read timeouts unless the caller passes its own.
+import threading
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+HTTP_POOL_CONNECTIONS = 16 # Number of hosts whose connection pools are kept
+HTTP_POOL_MAXSIZE = 16 # Keep-alive connections per host; matches the image worker count with headroom
+HTTP_RETRIES = 2 # Retries for GET/HEAD on connection errors and HTTP_RETRY_STATUS_CODES
+HTTP_RETRY_BACKOFF_FACTOR = 0.3 # Sleeps 0.3s, 0.6s, ... between retries (Retry-After is honoured)
+HTTP_RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+HTTP_CONNECT_TIMEOUT = 3.05 # Seconds; slightly above a TCP retransmission window
+HTTP_READ_TIMEOUT = 10 # Seconds between bytes, same as the original image download timeout
+
+_sessions = {} # (verify, retries) -> requests.Session
+_sessions_lock = threading.Lock()
+_insecure_hosts = set() # Hosts whose certificate failed verification once; later requests skip the failing handshake
+_insecure_hosts_lock = threading.Lock()
+
+def _build_session(verify, retries):
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=HTTP_RETRY_BACKOFF_FACTOR,
+        status_forcelist=HTTP_RETRY_STATUS_CODES,
+        allowed_methods=frozenset({"GET", "HEAD"}), # POSTs (token call) are retried by their callers
+        respect_retry_after_header=True,
+        raise_on_status=False, # Return the last response; callers call raise_for_status
+    )
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.verify = verify
+    return session
+
+def get_session(verify=True, retries=None):
+    """
+    Returns the process-wide session for the given SSL verification setting and retry count
+    (default HTTP_RETRIES), creating it on first use.
+    """
+    key = (verify, HTTP_RETRIES if retries is None else retries)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _build_session(*key)
+            _sessions[key] = session
+        return session
+
+def configure_http_session(pool_maxsize=None, retries=None, connect_timeout=None, read_timeout=None):
+    """Overrides pool size, retry count and timeouts. Existing sessions are closed and rebuilt on next use."""
+    global HTTP_POOL_MAXSIZE, HTTP_RETRIES, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT
+    if pool_maxsize is not None:
+        HTTP_POOL_MAXSIZE = pool_maxsize
+    if retries is not None:
+        HTTP_RETRIES = retries
+    if connect_timeout is not None:
+        HTTP_CONNECT_TIMEOUT = connect_timeout
+    if read_timeout is not None:
+        HTTP_READ_TIMEOUT = read_timeout
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+def default_timeout(read_timeout=None):
+    """(connect, read) timeout tuple as accepted by requests."""
+    return (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT if read_timeout is None else read_timeout)
+
+def request(method, url, insecure_fallback=False, retries=None, **kwargs):
+    """
+    Sends a request through the shared session. retries overrides HTTP_RETRIES (e.g. 0 for
+    quick probes that should fail fast). With insecure_fallback=True a certificate
+    verification failure is retried once without verification (on a separate pooled session),
+    and the host is remembered so later requests go there directly.
+    """
+    kwargs.setdefault("timeout", default_timeout())
+    host = urlparse(url).netloc.lower()
+    with _insecure_hosts_lock:
+        known_insecure = insecure_fallback and host in _insecure_hosts
+    if known_insecure:
+        return get_session(verify=False, retries=retries).request(method, url, **kwargs)
+    try:
+        return get_session(verify=True, retries=retries).request(method, url, **kwargs)
+    except requests.exceptions.SSLError as ssl_err:
+        if not insecure_fallback:
+            raise
+        print(f"SSL verification failed for {url}: {ssl_err}. Attempting with verify=False (SECURITY WARNING).")
+        print("WARNING: Disabling SSL verification. This is insecure and should ONLY be used in controlled development environments if you understand the risks.")
+        with _insecure_hosts_lock:
+            _insecure_hosts.add(host)
+        return get_session(verify=False, retries=retries).request(method, url, **kwargs)
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+def head(url, **kwargs):
+    return request("HEAD", url, **kwargs)
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
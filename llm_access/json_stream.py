@@ -0,0 +1,108 @@
+# llm_access/json_stream.py
+# Incremental JSON parsing for streamed LLM completions.
+# The LLM returns one JSON object such as {"destination": ..., "itinerary": [{day}, {day}, ...], ...};
+# JSONArrayItemStream picks out each element of one top-level array as soon as its closing
+# brace arrives, so callers can act on day 1 while later days are still being generated.
+import json
+
+class JSONArrayItemStream:
+    """
+    Feed text chunks of a single JSON object with feed(); each call returns the list of
+    newly completed items of the top-level array named array_key (parsed with json.loads).
+    Only objects and arrays inside that array are emitted; scalar elements are ignored.
+    """
+
+    def __init__(self, array_key):
+        self.array_key = array_key
+        self.buffer = ""
+        self._pos = 0 # Next character of buffer to scan
+        self._stack = [] # One frame per open container: {"type": "{" or "[", "expect_key": bool, "key": str}
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._in_target_array = False
+        self._item_start = None # Buffer index where the current array item started
+        self.last_item_end = None # Buffer index just past the last completed array item
+
+    def feed(self, text):
+        """Appends text to the buffer and returns the array items completed by it."""
+        self.buffer += text
+        completed = []
+        buffer = self.buffer
+        for i in range(self._pos, len(buffer)):
+            ch = buffer[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._on_string_end(buffer[self._string_start:i + 1])
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch in '{[':
+                if self._in_target_array and len(self._stack) == 2 and self._item_start is None:
+                    self._item_start = i
+                if ch == '[' and len(self._stack) == 1 and self._stack[0]["key"] == self.array_key:
+                    self._in_target_array = True
+                self._stack.append({"type": ch, "expect_key": ch == '{', "key": None})
+            elif ch in '}]':
+                if self._stack:
+                    self._stack.pop()
+                if len(self._stack) == 1 and self._in_target_array and ch == ']':
+                    self._in_target_array = False # The target array itself closed
+                elif len(self._stack) == 2 and self._in_target_array and self._item_start is not None:
+                    item_text = buffer[self._item_start:i + 1]
+                    self._item_start = None
+                    self.last_item_end = i + 1
+                    try:
+                        completed.append(json.loads(item_text))
+                    except json.JSONDecodeError as e:
+                        print(f"Skipping malformed streamed item: {e}")
+            elif ch == ':' and self._stack and self._stack[-1]["type"] == '{':
+                self._stack[-1]["expect_key"] = False
+            elif ch == ',' and self._stack and self._stack[-1]["type"] == '{':
+                self._stack[-1]["expect_key"] = True
+        self._pos = len(buffer)
+        return completed
+
+    def _on_string_end(self, quoted):
+        frame = self._stack[-1] if self._stack else None
+        if frame and frame["type"] == '{' and frame["expect_key"]:
+            try:
+                frame["key"] = json.loads(quoted)
+            except json.JSONDecodeError:
+                frame["key"] = quoted.strip('"')
+
+    def result(self):
+        """Parses the whole buffered document. Returns the object, or None if it is incomplete or invalid."""
+        try:
+            return json.loads(self.buffer)
+        except json.JSONDecodeError:
+            return None
+
+def recover_truncated_json(text, array_key):
+    """
+    Salvages a JSON object that was cut off (e.g. at max_tokens) inside its top-level array
+    array_key. Returns the complete object if text parses as is; otherwise the object closed
+    right after the last fully received array item, so keys that came before the array are
+    kept and the array holds every complete item. Returns None if no item was complete.
+    """
+    stream = JSONArrayItemStream(array_key)
+    items = stream.feed(text or "")
+    complete = stream.result()
+    if complete is not None:
+        return complete
+    if not items:
+        return None
+    try:
+        recovered = json.loads(stream.buffer[:stream.last_item_end] + "]}")
+    except json.JSONDecodeError: # Unexpected nesting before the array; keep just the items
+        recovered = None
+    if not isinstance(recovered, dict):
+        recovered = {array_key: items}
+    return recovered
@@ -1,9 +1,28 @@
 # llm_access/llm_api.py
 import openai
-from openai import AzureOpenAI
-import requests
+from openai import AzureOpenAI, AsyncAzureOpenAI
+import httpx
+import asyncio
+import contextvars
 import json
 import os # For potential future use with environment variables
+import threading
+import time
+
+try:
+    import h2 # noqa: F401 - its presence lets httpx negotiate HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+try:
+    from . import http_session, rate_limit, response_cache, telemetry, usage_ledger
+    from .credentials import TokenCredentialManager
+    from .token_count import count_chat_tokens, count_tokens
+except ImportError: # Running this file directly as a script (python llm_access/llm_api.py)
+    import http_session, rate_limit, response_cache, telemetry, usage_ledger
+    from credentials import TokenCredentialManager
+    from token_count import count_chat_tokens, count_tokens
 
 # --- Azure OpenAI Configuration ---
 # User inputs (as provided in the example)
@@ -12,130 +31,542 @@ WORKSPACE_ID = "RittikaPlaygneUd"
 MODEL_NAME = "gpt-4o"
 ASSET_ID = "204383"
 
-# URLs
-TOKEN_URL = "https://aiplatform.gcs.int.thomsonreuters.com/v1/openai/token"
-OPENAI_BASE_URL = "https://eais2-use.int.thomsonreuters.com"
+# URLs (LLM_TOKEN_URL / LLM_OPENAI_BASE_URL point them elsewhere, e.g. at benchmarks/mock_services.py)
+TOKEN_URL = os.environ.get("LLM_TOKEN_URL", "https://aiplatform.gcs.int.thomsonreuters.com/v1/openai/token")
+OPENAI_BASE_URL = os.environ.get("LLM_OPENAI_BASE_URL", "https://eais2-use.int.thomsonreuters.com")
+
+# Completion parameters (also part of the response cache key)
+SYSTEM_MESSAGE = "You are an AI travel planner. Respond ONLY with a valid JSON object as per the user's instructions. Do not add any explanatory text before or after the JSON."
+TEMPERATURE = 0.7 # Adjust for creativity vs. predictability
+MAX_TOKENS = 4096 # Adjust based on expected output size
+RESPONSE_FORMAT = {"type": "json_object"} # Request JSON output if supported by model/API version
+
+# Response cache is opt-in: set LLM_RESPONSE_CACHE=1 or call enable_response_cache()
+_response_cache_enabled = os.environ.get("LLM_RESPONSE_CACHE", "").strip().lower() in ("1", "true", "yes")
+
+# HTTP connection pool shared by all LLM calls (one pool per client, reused across calls)
+LLM_MAX_CONCURRENCY = 8 # Max in-flight chat completions across the whole process (semaphore)
+HTTP_MAX_CONNECTIONS = 32
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 16
+HTTP_KEEPALIVE_EXPIRY = 90 # Seconds an idle connection is kept open for reuse
+HTTP_CONNECT_TIMEOUT = 10
+HTTP_READ_TIMEOUT = 120 # Long itineraries can take a while to generate
 
 # Global variable to store the client, initialized once
 _azure_openai_client = None
 _client_error = None
+_client_settings = None # AzureOpenAI constructor arguments derived from the fetched credentials
 
-def _initialize_azure_openai_client():
-    global _azure_openai_client, _client_error
-    if _azure_openai_client:
-        return _azure_openai_client, None # Already initialized
+# Async client lives on a dedicated background event loop so every caller (sync wrappers,
+# worker threads, other event loops) shares one connection pool and one concurrency cap.
+_async_client = None
+_async_client_generation = None
+_async_loop = None
+_async_semaphore = None
+_async_loop_lock = threading.Lock()
+_rate_limiter = rate_limit.LLMRateLimiter() # Only touched from the background loop
+_client_init_lock = threading.Lock() # Guards swapping clients when credentials are refreshed
+_client_generation = 0 # Incremented whenever the clients are rebuilt with new credentials
 
+def _http_limits():
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+    )
+
+def _http_timeout():
+    return httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+
+def _fetch_token_credentials():
+    """
+    Fetches OpenAI credentials from TOKEN_URL once. Raises on network, HTTP, decoding or
+    missing-field errors; retries and caching are handled by the credential manager.
+    """
     payload = {
         "workspace_id": WORKSPACE_ID,
         "model_name": MODEL_NAME
     }
 
+    print(f"Attempting to fetch OpenAI credentials from {TOKEN_URL}...")
+    resp = http_session.post(TOKEN_URL, json=payload, timeout=http_session.default_timeout()) # Pooled keep-alive connection
+    resp.raise_for_status()  # Raise an exception for HTTP errors
     try:
-        print(f"Attempting to fetch OpenAI credentials from {TOKEN_URL}...")
-        resp = requests.post(TOKEN_URL, json=payload, timeout=10) # Added timeout
-        resp.raise_for_status()  # Raise an exception for HTTP errors
         credentials = resp.json()
-        print("Successfully fetched credentials.")
-    except requests.exceptions.RequestException as e:
-        _client_error = f"Failed to retrieve OpenAI credentials from token URL: {e}"
-        print(f"Error: {_client_error}")
-        return None, _client_error
     except json.JSONDecodeError as e:
-        _client_error = f"Failed to decode JSON response from token URL: {e}. Response content: {resp.text[:500]}" # Log part of response
+        raise ValueError(f"Failed to decode JSON response from token URL: {e}. Response content: {resp.text[:500]}") # Log part of response
+
+    if not ("openai_key" in credentials and "openai_endpoint" in credentials and "azure_deployment" in credentials):
+        raise ValueError(f"Failed to retrieve necessary OpenAI credentials. Check response structure. Keys received: {sorted(credentials)}")
+    print("Successfully fetched credentials.")
+    return credentials
+
+def _build_clients(credentials):
+    """
+    (Re)builds the sync client and the async client settings from freshly fetched credentials.
+    Requests already in flight keep the client object they started with, so they finish on
+    the old token while new requests pick up the new one.
+    """
+    global _azure_openai_client, _client_settings, _client_generation
+    openai_api_key = credentials["openai_key"]
+    openai_deployment_id = credentials["azure_deployment"]
+    openai_api_version = credentials["openai_api_version"]
+    # token = credentials["token"] # This token is for the TR API, not directly for Azure OpenAI client
+    llm_profile_key = openai_deployment_id.split("/")[0]
+
+    headers = {
+        "Authorization": f"Bearer {credentials['token']}",
+        "api-key": openai_api_key, # This is the key AzureOpenAI client will use
+        "Content-Type": "application/json",
+        "x-tr-chat-profile-name": "ai-platforms-chatprofile-prod",
+        "x-tr-userid": WORKSPACE_ID,
+        "x-tr-llm-profile-key": llm_profile_key,
+        "x-tr-user-sensitivity": "true",
+        "x-tr-sessionid": openai_deployment_id,
+        "x-tr-asset-id": ASSET_ID,
+        "x-tr-authorization": OPENAI_BASE_URL # This seems to be the base URL itself
+    }
+    
+    print(f"Initializing AzureOpenAI client with endpoint: {OPENAI_BASE_URL} and deployment: {openai_deployment_id}")
+    client_settings = {
+        "azure_endpoint": OPENAI_BASE_URL, # The base URL for the Azure service
+        "api_key": openai_api_key,         # The key obtained from credentials
+        "api_version": openai_api_version,
+        "azure_deployment": openai_deployment_id, # The specific deployment ID
+        "default_headers": headers # Pass all required headers
+    }
+    client = AzureOpenAI(
+        **client_settings,
+        max_retries=0, # Retries are handled by stream_llm_response
+        http_client=httpx.Client(limits=_http_limits(), timeout=_http_timeout(), http2=HTTP2_AVAILABLE)
+    )
+    with _client_init_lock:
+        _client_settings = client_settings
+        _azure_openai_client = client
+        _client_generation += 1 # Tells the background loop to rebuild its async client
+    print("AzureOpenAI client initialized successfully.")
+
+def _on_credentials_refreshed(credentials):
+    global _client_error
+    try:
+        _build_clients(credentials)
+        _client_error = None
+    except Exception as e:
+        _client_error = f"Failed to initialize AzureOpenAI client: {e}"
+        print(f"Error: {_client_error}")
+
+_credential_manager = TokenCredentialManager(_fetch_token_credentials)
+_credential_manager.add_refresh_listener(_on_credentials_refreshed)
+
+def _initialize_azure_openai_client():
+    """
+    Makes sure valid credentials and a matching client exist. Credentials are cached with their
+    expiry and refreshed in the background; a failed fetch is retried (with backoff) on a later
+    call instead of disabling the LLM for the rest of the process.
+    Returns (client, None) on success or (None, error_message).
+    """
+    global _client_error
+    credentials = _credential_manager.get_credentials()
+    if credentials is None:
+        _client_error = f"Failed to retrieve OpenAI credentials from token URL: {_credential_manager.last_error or 'retrying after cooldown'}"
         print(f"Error: {_client_error}")
         return None, _client_error
+    if _client_error or not _azure_openai_client:
+        return None, _client_error or "AzureOpenAI client is not initialized."
+    return _azure_openai_client, None
 
-    if "openai_key" in credentials and "openai_endpoint" in credentials and "azure_deployment" in credentials:
-        openai_api_key = credentials["openai_key"]
-        openai_deployment_id = credentials["azure_deployment"]
-        openai_api_version = credentials["openai_api_version"]
-        # token = credentials["token"] # This token is for the TR API, not directly for Azure OpenAI client
-        llm_profile_key = openai_deployment_id.split("/")[0]
-
-        headers = {
-            "Authorization": f"Bearer {credentials['token']}",
-            "api-key": openai_api_key, # This is the key AzureOpenAI client will use
-            "Content-Type": "application/json",
-            "x-tr-chat-profile-name": "ai-platforms-chatprofile-prod",
-            "x-tr-userid": WORKSPACE_ID,
-            "x-tr-llm-profile-key": llm_profile_key,
-            "x-tr-user-sensitivity": "true",
-            "x-tr-sessionid": openai_deployment_id,
-            "x-tr-asset-id": ASSET_ID,
-            "x-tr-authorization": OPENAI_BASE_URL # This seems to be the base URL itself
-        }
-        
+def _get_ready_client():
+    """Returns an AzureOpenAI client with valid credentials, or None (error is printed)."""
+    client, error = _initialize_azure_openai_client()
+    if error:
+        print(f"Cannot call LLM due to client initialization error: {error}")
+        return None
+    return client
+
+def enable_response_cache(enabled=True):
+    """Turns the persistent LLM response cache (see response_cache.py) on or off for this process."""
+    global _response_cache_enabled
+    _response_cache_enabled = bool(enabled)
+
+def _get_async_loop():
+    """Returns the background event loop used for all async LLM calls, starting it on first use."""
+    global _async_loop
+    with _async_loop_lock:
+        if _async_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="llm-async-loop", daemon=True).start()
+            _async_loop = loop
+    return _async_loop
+
+def _get_async_client():
+    """Returns the shared AsyncAzureOpenAI client. Must be called on the background loop."""
+    global _async_client, _async_client_generation, _async_semaphore
+    if _async_semaphore is None:
+        _async_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    if _client_settings and _async_client_generation != _client_generation:
+        # New credentials: swap in a new client; calls already awaiting the old one finish on it
+        _async_client = AsyncAzureOpenAI(
+            **_client_settings,
+            max_retries=0, # Retries are handled by _create_completion_scheduled
+            http_client=httpx.AsyncClient(limits=_http_limits(), timeout=_http_timeout(), http2=HTTP2_AVAILABLE)
+        )
+        _async_client_generation = _client_generation
+    return _async_client
+
+def _cache_lookup(prompt_content, bypass_cache):
+    """
+    Returns (cache_key, cached_response); both None when the response cache is disabled.
+    The outcome is recorded as the current span's 'cache' attribute.
+    """
+    if not _response_cache_enabled:
+        telemetry.annotate(cache="disabled")
+        return None, None
+    cache_key = response_cache.make_cache_key(MODEL_NAME, SYSTEM_MESSAGE, prompt_content, TEMPERATURE, RESPONSE_FORMAT)
+    if bypass_cache:
+        telemetry.annotate(cache="bypass")
+        return cache_key, None
+    cached_response = response_cache.get_cached_response(cache_key)
+    if cached_response is not None:
+        print(f"LLM response cache hit for prompt: '{prompt_content[:100]}...'")
+    telemetry.annotate(cache="hit" if cached_response is not None else "miss")
+    return cache_key, cached_response
+
+def configure_rate_limits(requests_per_minute=None, tokens_per_minute=None):
+    """Replaces the client-side rate limiter; defaults come from rate_limit.LLM_REQUESTS/TOKENS_PER_MINUTE."""
+    global _rate_limiter
+    _rate_limiter = rate_limit.LLMRateLimiter(
+        requests_per_minute or rate_limit.LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute or rate_limit.LLM_TOKENS_PER_MINUTE
+    )
+
+def _is_retryable(error):
+    """429s, 5xx, timeouts and connection failures are worth retrying; other API errors are not."""
+    if isinstance(error, openai.APIConnectionError): # Includes APITimeoutError
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code in rate_limit.RETRYABLE_STATUS_CODES
+
+def _build_messages(prompt_content):
+    return [
+        {"role": "system", "content": SYSTEM_MESSAGE},
+        {"role": "user", "content": prompt_content},
+    ]
+
+def _acquire_rate_limit_blocking(estimated_tokens):
+    """Reserves rate-limit budget from a regular thread (used by the sync streaming call)."""
+    asyncio.run_coroutine_threadsafe(_rate_limiter.acquire(estimated_tokens), _get_async_loop()).result()
+
+def _call_on_limiter_loop(method, *args):
+    """Runs a _rate_limiter method (settle, pause) on the background loop, which owns the buckets."""
+    _get_async_loop().call_soon_threadsafe(method, *args)
+
+async def _create_completion_scheduled(messages, max_tokens):
+    """
+    Sends one chat completion through the client-side scheduler: waits for requests/min and
+    tokens/min budget, then retries retryable failures with exponential backoff and jitter.
+    A Retry-After from the server pauses every queued call, not just this one.
+    Returns the completion; raises the last error when it is not retryable or attempts run out.
+    """
+    estimated_tokens = count_chat_tokens(messages, MODEL_NAME) + (max_tokens or MAX_TOKENS)
+    for attempt in range(1, rate_limit.LLM_MAX_ATTEMPTS + 1):
+        await _rate_limiter.acquire(estimated_tokens)
+        client = _get_async_client() # Re-read every attempt: credentials may have been refreshed
+        if not client:
+            raise RuntimeError("AsyncAzureOpenAI client is not initialized.")
         try:
-            print(f"Initializing AzureOpenAI client with endpoint: {OPENAI_BASE_URL} and deployment: {openai_deployment_id}")
-            _azure_openai_client = AzureOpenAI(
-                azure_endpoint=OPENAI_BASE_URL, # The base URL for the Azure service
-                api_key=openai_api_key,         # The key obtained from credentials
-                api_version=openai_api_version,
-                azure_deployment=openai_deployment_id, # The specific deployment ID
-                default_headers=headers # Pass all required headers
-            )
-            print("AzureOpenAI client initialized successfully.")
-            return _azure_openai_client, None
-        except Exception as e:
-            _client_error = f"Failed to initialize AzureOpenAI client: {e}"
-            print(f"Error: {_client_error}")
-            return None, _client_error
-    else:
-        _client_error = "Failed to retrieve necessary OpenAI credentials. Check response structure."
-        print(f"Error: {_client_error}. Credentials received: {credentials}")
-        return None, _client_error
+            async with _async_semaphore: # Cap concurrent completions process-wide
+                response = await client.chat.completions.create(
+                    model=MODEL_NAME, # This should align with the model for which credentials were fetched
+                    messages=messages,
+                    temperature=TEMPERATURE,
+                    max_tokens=max_tokens or MAX_TOKENS,
+                    response_format=RESPONSE_FORMAT
+                )
+        except openai.APIError as e:
+            if not _is_retryable(e) or attempt == rate_limit.LLM_MAX_ATTEMPTS:
+                raise
+            error_response = getattr(e, "response", None)
+            retry_after = rate_limit.parse_retry_after(error_response.headers if error_response is not None else None)
+            if retry_after is not None:
+                _rate_limiter.pause(retry_after)
+            delay = rate_limit.backoff_delay(attempt, retry_after)
+            print(f"Retryable LLM error ({e.__class__.__name__}) on attempt {attempt}/{rate_limit.LLM_MAX_ATTEMPTS}; retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            continue
+
+        usage = getattr(response, "usage", None)
+        _rate_limiter.settle(estimated_tokens, getattr(usage, "total_tokens", None))
+        return response
+
+def _usage_attributes(response):
+    """Token counts from response.usage as span attributes (empty if the API did not report usage)."""
+    usage = getattr(response, "usage", None)
+    return {key: getattr(usage, key) for key in telemetry.TOKEN_ATTRIBUTES if isinstance(getattr(usage, key, None), int)}
 
-def get_llm_response(prompt_content):
+def _estimated_usage(messages, completion_text):
+    """Locally counted usage for calls the API reported none for (e.g. streams)."""
+    prompt_tokens = count_chat_tokens(messages, MODEL_NAME)
+    completion_tokens = count_tokens(completion_text or "", MODEL_NAME)
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+def _reserve_budget(messages, max_tokens, caller):
     """
-    Gets a response from the configured Azure OpenAI LLM.
-    The prompt_content should be the user's message to the LLM.
-    Returns a Python dictionary parsed from the LLM's JSON response, or None on failure.
+    Applies the token budget of the enclosing usage_ledger.request_scope, if any.
+    Returns (max_tokens to request, reserved tokens); max_tokens is None when the budget is spent.
     """
-    global _azure_openai_client, _client_error
-    
-    if not _azure_openai_client and not _client_error:
-        _initialize_azure_openai_client()
+    max_tokens = max_tokens or MAX_TOKENS
+    budget = usage_ledger.current_budget()
+    if budget is None:
+        return max_tokens, 0
+    prompt_tokens = count_chat_tokens(messages, MODEL_NAME)
+    granted = budget.reserve(prompt_tokens, max_tokens)
+    if granted is None:
+        print(f"Token budget of request {budget.request_id} is spent; skipping {caller} LLM call.")
+        usage_ledger.record_usage(caller, MODEL_NAME, outcome="refused")
+        return None, 0
+    if granted < max_tokens:
+        print(f"Token budget of request {budget.request_id} is running low; limiting {caller} LLM call to {granted} output tokens.")
+    return granted, prompt_tokens + granted
 
-    if _client_error:
-        print(f"Cannot call LLM due to client initialization error: {_client_error}")
-        return None
-    
-    if not _azure_openai_client:
-        print("Error: AzureOpenAI client is not initialized and no previous error recorded.")
-        return None
+def _record_call(caller, usage, reserved_tokens, outcome):
+    """Writes a finished call to the usage ledger and settles its budget reservation."""
+    usage_ledger.record_usage(
+        caller, MODEL_NAME, usage.get("prompt_tokens"), usage.get("completion_tokens"), usage.get("total_tokens"),
+        estimated=usage.get("estimated", False), outcome=outcome
+    )
+    budget = usage_ledger.current_budget()
+    if budget is not None:
+        budget.settle(reserved_tokens, usage.get("total_tokens") or 0)
 
+def _restore_context(context):
+    """Re-applies a caller's context variables (spans, request budget) inside a background loop task."""
+    for variable, value in context.items():
+        variable.set(value)
+
+async def _request_llm_response(prompt_content, max_tokens, partial_parser=None, parent_span=None):
+    """
+    Performs one scheduled chat completion on the background loop.
+    Returns (parsed JSON or None on failure, complete, usage) where complete is False when the
+    result was salvaged by partial_parser from invalid (typically truncated) JSON, and usage
+    holds the token counts of response.usage ({} if no response arrived).
+    The call and the JSON parse are recorded as 'llm_call' and 'json_parse' spans under
+    parent_span (the caller's span; the background loop does not share its context).
+    """
+    llm_output_content = None
+    finish_reason = None
+    usage = {}
     try:
         print(f"Sending prompt to LLM (model: {MODEL_NAME}): '{prompt_content[:200]}...'") # Log a snippet of the prompt
-        
-        response = _azure_openai_client.chat.completions.create(
-            model=MODEL_NAME, # This should align with the model for which credentials were fetched
-            messages=[
-                {"role": "system", "content": "You are an AI travel planner. Respond ONLY with a valid JSON object as per the user's instructions. Do not add any explanatory text before or after the JSON."},
-                {"role": "user", "content": prompt_content},
-            ],
-            temperature=0.7, # Adjust for creativity vs. predictability
-            max_tokens=4096, # Adjust based on expected output size
-            response_format={"type": "json_object"} # Request JSON output if supported by model/API version
-        )
-
-        llm_output_content = response.choices[0].message.content
+        messages = _build_messages(prompt_content)
+        with telemetry.span("llm_call", parent_span, model=MODEL_NAME, prompt_bytes=len(prompt_content.encode("utf-8"))) as call_span:
+            response = await _create_completion_scheduled(messages, max_tokens)
+            llm_output_content = response.choices[0].message.content
+            finish_reason = response.choices[0].finish_reason
+            usage = _usage_attributes(response) or dict(_estimated_usage(messages, llm_output_content), estimated=True)
+            call_span.set(bytes=len((llm_output_content or "").encode("utf-8")), finish_reason=finish_reason, **usage)
         print(f"Raw LLM response content: {llm_output_content[:500]}...") # Log a snippet of the raw response
 
         # The LLM should return a string that is a valid JSON object.
-        parsed_response = json.loads(llm_output_content)
+        with telemetry.span("json_parse", parent_span, bytes=len(llm_output_content.encode("utf-8"))):
+            parsed_response = json.loads(llm_output_content)
         print("Successfully parsed LLM JSON response.")
-        return parsed_response
+        return parsed_response, True, usage
 
+    except openai.AuthenticationError as e:
+        print(f"OpenAI authentication failed, credentials will be refreshed: {e}")
+        _credential_manager.invalidate()
     except openai.APIError as e:
         print(f"OpenAI API Error: {e}")
-    except requests.exceptions.RequestException as e: # Catch potential network errors during the API call itself
+    except httpx.HTTPError as e: # Catch potential network errors during the API call itself
         print(f"Network error during LLM call: {e}")
     except json.JSONDecodeError as e:
-        print(f"Failed to parse JSON from LLM response: {e}. Response was: {llm_output_content}")
+        print(f"Failed to parse JSON from LLM response (finish_reason: {finish_reason}): {e}. Response was: {llm_output_content}")
+        if partial_parser is not None:
+            with telemetry.span("json_recover", parent_span, bytes=len(llm_output_content.encode("utf-8"))) as recover_span:
+                salvaged = partial_parser(llm_output_content)
+                recover_span.set(recovered=salvaged is not None)
+            if salvaged is not None:
+                print("Recovered a partial response from the invalid JSON.")
+                return salvaged, False, usage
     except Exception as e:
         print(f"An unexpected error occurred while getting LLM response: {e}")
     
-    return None # Return None if any error occurs
+    return None, False, usage # Return None if any error occurs
+
+def _finish_request(request_span, caller, result, reserved_tokens, cache_key, cache_ttl_seconds):
+    """Shared tail of get_llm_response(_async): records usage and caches complete responses."""
+    parsed_response, complete, usage = result
+    outcome = "complete" if complete else ("partial" if parsed_response is not None else "failed")
+    request_span.set(outcome=outcome)
+    _record_call(caller, usage, reserved_tokens, outcome)
+    if cache_key and parsed_response is not None and complete: # Never cache salvaged partial responses
+        response_cache.store_response(cache_key, parsed_response, cache_ttl_seconds)
+    return parsed_response
+
+async def get_llm_response_async(prompt_content, bypass_cache=False, cache_ttl_seconds=None, max_tokens=None, partial_parser=None, caller=None):
+    """
+    Async version of get_llm_response, usable from any event loop. The request itself runs
+    on the shared background loop, so it reuses the pooled AsyncAzureOpenAI connections and
+    counts against LLM_MAX_CONCURRENCY.
+    Returns a Python dictionary parsed from the LLM's JSON response, or None on failure.
+    """
+    caller = caller or usage_ledger.DEFAULT_CALLER
+    with telemetry.span("llm_request", caller=caller) as request_span:
+        cache_key, cached_response = _cache_lookup(prompt_content, bypass_cache)
+        if cached_response is not None:
+            usage_ledger.record_usage(caller, MODEL_NAME, cached=True)
+            return cached_response
+
+        if not await asyncio.to_thread(_get_ready_client): # Token fetch is blocking; keep it off the loop
+            request_span.set(outcome="no_client")
+            return None
+        max_tokens, reserved_tokens = _reserve_budget(_build_messages(prompt_content), max_tokens, caller)
+        if max_tokens is None:
+            request_span.set(outcome="refused")
+            return None
+
+        future = asyncio.run_coroutine_threadsafe(_request_llm_response(prompt_content, max_tokens, partial_parser, request_span), _get_async_loop())
+        result = await asyncio.wrap_future(future)
+        return _finish_request(request_span, caller, result, reserved_tokens, cache_key, cache_ttl_seconds)
+
+def get_llm_response(prompt_content, bypass_cache=False, cache_ttl_seconds=None, max_tokens=None, partial_parser=None, caller=None):
+    """
+    Gets a response from the configured Azure OpenAI LLM.
+    The prompt_content should be the user's message to the LLM.
+    Synchronous wrapper around the shared async client (see get_llm_response_async); safe to
+    call from any thread except the background LLM loop itself.
+    When the response cache is enabled, identical requests are answered from the local
+    cache; bypass_cache=True forces a fresh call (the fresh result still refreshes the cache).
+    max_tokens overrides MAX_TOKENS for prompts with a known, smaller output size.
+    partial_parser, if given, is called with the raw text when it is not valid JSON (e.g. the
+    completion hit max_tokens); its non-None result is returned instead of None, uncached.
+    caller tags the call in the usage ledger (e.g. "itinerary", "placeholder_image", "city_list").
+    Inside a usage_ledger.request_scope, max_tokens is reduced to the request's remaining token
+    budget and the call is skipped (None is returned) once the budget is spent.
+    Returns a Python dictionary parsed from the LLM's JSON response, or None on failure.
+    """
+    caller = caller or usage_ledger.DEFAULT_CALLER
+    with telemetry.span("llm_request", caller=caller) as request_span:
+        cache_key, cached_response = _cache_lookup(prompt_content, bypass_cache)
+        if cached_response is not None:
+            usage_ledger.record_usage(caller, MODEL_NAME, cached=True)
+            return cached_response
+
+        if not _get_ready_client():
+            request_span.set(outcome="no_client")
+            return None
+        max_tokens, reserved_tokens = _reserve_budget(_build_messages(prompt_content), max_tokens, caller)
+        if max_tokens is None:
+            request_span.set(outcome="refused")
+            return None
+
+        future = asyncio.run_coroutine_threadsafe(_request_llm_response(prompt_content, max_tokens, partial_parser, request_span), _get_async_loop())
+        return _finish_request(request_span, caller, future.result(), reserved_tokens, cache_key, cache_ttl_seconds)
+
+def get_llm_responses_concurrently(prompts, **kwargs):
+    """
+    Sends several prompts at once and returns their parsed responses (or None entries)
+    in the same order. Concurrency is bounded by LLM_MAX_CONCURRENCY; keyword arguments
+    are passed to get_llm_response_async.
+    """
+    caller_context = contextvars.copy_context() # The background loop does not share the caller's spans and budget
+
+    async def gather_responses():
+        _restore_context(caller_context)
+        with telemetry.span("llm_batch", prompts=len(prompts)):
+            return await asyncio.gather(*(get_llm_response_async(prompt, **kwargs) for prompt in prompts), return_exceptions=True)
+
+    results = asyncio.run_coroutine_threadsafe(gather_responses(), _get_async_loop()).result()
+    responses = []
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"An unexpected error occurred while getting LLM response: {result}")
+            result = None
+        responses.append(result)
+    return responses
+
+def stream_llm_response(prompt_content, max_tokens=None, caller=None):
+    """
+    Streams a completion from the configured Azure OpenAI LLM (chat completions with stream=True).
+    Yields the content text deltas as they arrive, to be parsed incrementally by the caller
+    (see json_stream.JSONArrayItemStream). On failure the error is printed and the generator
+    simply stops. Streamed calls do not use the response cache. Usage is recorded under caller
+    (counted locally unless the deployment reports it) and budgets apply as in get_llm_response.
+    Rate limiting, retries and Retry-After handling follow _create_completion_scheduled; a call
+    is only retried while nothing has been yielded yet.
+    """
+    caller = caller or usage_ledger.DEFAULT_CALLER
+    if not _get_ready_client():
+        return
+
+    messages = _build_messages(prompt_content)
+    max_tokens, reserved_tokens = _reserve_budget(messages, max_tokens, caller)
+    if max_tokens is None:
+        return
+    estimated_tokens = count_chat_tokens(messages, MODEL_NAME) + max_tokens
+    rate_limiter = _rate_limiter # The limiter that holds this call's reservation
+    streamed_chunks = []
+    usage = {}
+    outcome = "failed"
+    try:
+        with telemetry.span("llm_stream", caller=caller, model=MODEL_NAME, prompt_bytes=len(prompt_content.encode("utf-8")), cache="disabled") as stream_span:
+            for attempt in range(1, rate_limit.LLM_MAX_ATTEMPTS + 1):
+                _acquire_rate_limit_blocking(estimated_tokens)
+                client = _get_ready_client() # Re-read every attempt: credentials may have been refreshed
+                if not client:
+                    return
+                try:
+                    print(f"Streaming prompt to LLM (model: {MODEL_NAME}): '{prompt_content[:200]}...'")
+                    stream = client.chat.completions.create(
+                        model=MODEL_NAME,
+                        messages=messages,
+                        temperature=TEMPERATURE,
+                        max_tokens=max_tokens,
+                        response_format=RESPONSE_FORMAT,
+                        stream=True
+                    )
+                    for chunk in stream:
+                        if getattr(chunk, "usage", None): # Only sent when the deployment reports usage for streams
+                            usage = _usage_attributes(chunk)
+                            stream_span.set(**usage)
+                        if not chunk.choices:
+                            continue # e.g. Azure content-filter preamble chunks
+                        if chunk.choices[0].finish_reason:
+                            stream_span.set(finish_reason=chunk.choices[0].finish_reason)
+                            outcome = "complete" if chunk.choices[0].finish_reason == "stop" else "partial"
+                        delta_content = chunk.choices[0].delta.content if chunk.choices[0].delta else None
+                        if delta_content:
+                            if "first_chunk_seconds" not in stream_span.attributes:
+                                stream_span.set(first_chunk_seconds=round(stream_span.elapsed(), 4))
+                            stream_span.add("bytes", len(delta_content.encode("utf-8")))
+                            streamed_chunks.append(delta_content)
+                            yield delta_content
+                    return
+                except openai.APIError as e:
+                    if streamed_chunks or not _is_retryable(e) or attempt == rate_limit.LLM_MAX_ATTEMPTS:
+                        raise
+                    error_response = getattr(e, "response", None)
+                    retry_after = rate_limit.parse_retry_after(error_response.headers if error_response is not None else None)
+                    if retry_after is not None:
+                        _call_on_limiter_loop(rate_limiter.pause, retry_after)
+                    delay = rate_limit.backoff_delay(attempt, retry_after)
+                    print(f"Retryable LLM error ({e.__class__.__name__}) while streaming, attempt {attempt}/{rate_limit.LLM_MAX_ATTEMPTS}; retrying in {delay:.1f}s")
+                    stream_span.set(retries=attempt)
+                    time.sleep(delay)
+    except openai.AuthenticationError as e:
+        print(f"OpenAI authentication failed while streaming, credentials will be refreshed: {e}")
+        _credential_manager.invalidate()
+    except openai.APIError as e:
+        print(f"OpenAI API Error while streaming: {e}")
+    except httpx.HTTPError as e: # Network errors while reading the stream body
+        print(f"Network error during streamed LLM call: {e}")
+    except Exception as e:
+        print(f"An unexpected error occurred while streaming LLM response: {e}")
+    finally: # Also runs when the consumer stops iterating early
+        if not usage and streamed_chunks:
+            usage = dict(_estimated_usage(messages, "".join(streamed_chunks)), estimated=True)
+        if usage.get("total_tokens") is not None:
+            _call_on_limiter_loop(rate_limiter.settle, estimated_tokens, usage["total_tokens"])
+        _record_call(caller, usage, reserved_tokens, outcome if streamed_chunks else "failed")
 
 def generate_and_save_world_cities_list(output_directory="input", filename="world_cities.json"):
     """
@@ -151,7 +582,7 @@ def generate_and_save_world_cities_list(output_directory="input", filename="worl
     )
     
     print(f"Attempting to generate a list of world cities using LLM...")
-    response_data = get_llm_response(cities_prompt) # Expects a dictionary
+    response_data = get_llm_response(cities_prompt, caller="city_list") # Expects a dictionary
     
     if response_data and isinstance(response_data, dict) and "cities" in response_data and isinstance(response_data["cities"], list):
         cities_list = [str(city) for city in response_data["cities"] if isinstance(city, str)]
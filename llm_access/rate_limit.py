@@ -0,0 +1,108 @@
+# llm_access/rate_limit.py
+# Client-side scheduling for LLM calls: token buckets for requests/min and tokens/min,
+# a shared pause when the server answers 429 with Retry-After, and exponential backoff
+# with jitter for retries. All coroutines run on llm_api's single background event loop,
+# so bucket updates between awaits need no locking.
+import asyncio
+import email.utils
+import random
+import time
+
+LLM_REQUESTS_PER_MINUTE = 60 # Keep in line with the deployment's quota
+LLM_TOKENS_PER_MINUTE = 90000 # Prompt + completion tokens, as counted by Azure OpenAI
+LLM_MAX_ATTEMPTS = 5 # Initial call plus retries
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+RETRYABLE_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504)
+
+class TokenBucket:
+    """Classic token bucket: holds up to capacity tokens, refilled continuously at capacity per period_seconds."""
+
+    def __init__(self, capacity, period_seconds=60.0):
+        self.capacity = float(capacity)
+        self.refill_per_second = self.capacity / period_seconds
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+
+    def wait_time(self, amount):
+        """Seconds until amount tokens are available (0 if available now)."""
+        self._refill()
+        amount = min(amount, self.capacity) # Oversized requests wait for a full bucket instead of forever
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_per_second
+
+    def take(self, amount):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def give_back(self, amount):
+        """Returns (or, with a negative amount, charges) tokens after the real usage is known."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+class LLMRateLimiter:
+    """Combines a requests/min and a tokens/min bucket with a global pause for server-side throttling."""
+
+    def __init__(self, requests_per_minute=LLM_REQUESTS_PER_MINUTE, tokens_per_minute=LLM_TOKENS_PER_MINUTE):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.paused_until = 0.0 # time.monotonic() value before which no request is sent
+
+    async def acquire(self, estimated_tokens):
+        """Waits until one request and estimated_tokens tokens fit into the budget, then reserves them."""
+        while True:
+            wait_seconds = max(
+                self.paused_until - time.monotonic(),
+                self.request_bucket.wait_time(1),
+                self.token_bucket.wait_time(estimated_tokens)
+            )
+            if wait_seconds <= 0:
+                self.request_bucket.take(1)
+                self.token_bucket.take(estimated_tokens)
+                return
+            await asyncio.sleep(wait_seconds)
+
+    def settle(self, estimated_tokens, actual_tokens):
+        """Corrects the token bucket once the response's real usage is known."""
+        if actual_tokens is not None:
+            self.token_bucket.give_back(estimated_tokens - actual_tokens)
+
+    def pause(self, seconds):
+        """Holds back every queued request for seconds (e.g. from a Retry-After header)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+def parse_retry_after(headers):
+    """Returns the server-requested delay in seconds from retry-after-ms / Retry-After headers, or None."""
+    if not headers:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000.0)
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try: # HTTP-date form
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, retry_after=None):
+    """Exponential backoff with full jitter for the given (1-based) attempt, never shorter than retry_after."""
+    delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** (attempt - 1))))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
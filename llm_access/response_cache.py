@@ -0,0 +1,103 @@
+# llm_access/response_cache.py
+# Opt-in, persistent cache for parsed LLM responses, stored in a local SQLite file.
+# Entries are keyed on everything that determines the completion:
+# (model, system message, prompt, temperature, response_format).
+import json
+import os
+import sqlite3
+import hashlib
+import threading
+import time
+
+# Project root is one level above llm_access, so the cache lands next to the image cache
+CACHE_DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "llm_responses.sqlite3")
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60 # A week; city lists and placeholder URLs are near-static
+MAX_ENTRIES = 5000 # Least-recently-used entries beyond this are evicted
+
+_connection = None
+_lock = threading.Lock() # One shared connection, serialized across worker threads
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+def _get_connection():
+    """Opens (and creates, if needed) the cache database. Caller must hold _lock."""
+    global _connection
+    if _connection is None:
+        os.makedirs(os.path.dirname(CACHE_DB_PATH), exist_ok=True)
+        _connection = sqlite3.connect(CACHE_DB_PATH, check_same_thread=False)
+        _connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " response TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        _connection.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access)")
+        _connection.commit()
+    return _connection
+
+def make_cache_key(model, system_message, prompt, temperature, response_format):
+    """Builds a stable cache key from all parameters that influence the completion."""
+    key_material = json.dumps(
+        [model, system_message, prompt, temperature, response_format],
+        sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(key_material.encode('utf-8')).hexdigest()
+
+def get_cached_response(key):
+    """Returns the cached parsed response for key, or None on a miss or expired entry."""
+    now = time.time()
+    try:
+        with _lock:
+            conn = _get_connection()
+            row = conn.execute("SELECT response, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] < now:
+                if row is not None:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    conn.commit()
+                _stats["misses"] += 1
+                return None
+            conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            conn.commit()
+            _stats["hits"] += 1
+        return json.loads(row[0])
+    except (sqlite3.Error, json.JSONDecodeError) as e:
+        print(f"LLM response cache lookup failed: {e}")
+        return None
+
+def store_response(key, response, ttl_seconds=None):
+    """Stores a parsed (JSON-serializable) response under key, evicting LRU entries beyond MAX_ENTRIES."""
+    now = time.time()
+    ttl = DEFAULT_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+    try:
+        serialized = json.dumps(response, ensure_ascii=False)
+        with _lock:
+            conn = _get_connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, serialized, now, now + ttl, now)
+            )
+            _stats["stores"] += 1
+            conn.execute("DELETE FROM responses WHERE expires_at < ?", (now,))
+            (count,) = conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+            if count > MAX_ENTRIES:
+                conn.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)",
+                    (count - MAX_ENTRIES,)
+                )
+                _stats["evictions"] += count - MAX_ENTRIES
+            conn.commit()
+    except (sqlite3.Error, TypeError, ValueError) as e:
+        print(f"Failed to store LLM response in cache: {e}")
+
+def get_cache_stats():
+    """Returns a copy of the hit/miss/store/eviction counters for this process."""
+    with _lock:
+        return dict(_stats)
+
+def clear_cache():
+    """Removes every cached response."""
+    with _lock:
+        conn = _get_connection()
+        conn.execute("DELETE FROM responses")
+        conn.commit()
@@ -0,0 +1,345 @@
+# llm_access/telemetry.py
+# Per-stage timing spans for the itinerary pipeline, exported through pluggable sinks.
+# A span times one stage (prompt build, LLM call, JSON parse, cost parsing, image download,
+# placeholder lookup, save) and carries attributes such as bytes, token usage from
+# response.usage and cache hit/miss. Spans nest: the current span is kept in a context
+# variable, so stages called from inside another stage become its children.
+# Sinks receive every finished span:
+#   JSONLogSink       - one JSON object per span, printed or appended to a file
+#   PrometheusSink    - per-stage duration histograms and byte/token/cache counters in the
+#                       Prometheus text format, optionally served on /metrics
+#   OpenTelemetrySink - re-emits the spans through the OpenTelemetry API (optional dependency);
+#                       the exporter itself is set up by the application's TracerProvider
+# Sinks are chosen with PIPELINE_TELEMETRY, e.g. "json", "json:Output/telemetry.jsonl",
+# "prometheus:9464,otel", or registered with add_sink(). Without sinks spans are only timed.
+import contextvars
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+TELEMETRY_ENV_VAR = "PIPELINE_TELEMETRY" # Comma-separated sink specs, see configure_from_env
+METRICS_PREFIX = "itinerary" # Prefix of every Prometheus metric name
+PROMETHEUS_DEFAULT_PORT = 9464 # Used by "prometheus" without a port
+PROMETHEUS_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120) # Seconds
+TOKEN_ATTRIBUTES = ("prompt_tokens", "completion_tokens", "total_tokens") # Taken from response.usage
+OTEL_TRACER_NAME = "itinerary.pipeline"
+
+_current_span = contextvars.ContextVar("telemetry_current_span", default=None)
+_sinks = () # Replaced, never mutated, so spans can iterate it without locking
+_sinks_lock = threading.Lock()
+_span_ids = itertools.count(1)
+
+class Span:
+    """One timed stage. attributes hold JSON-serializable values; set() and add() update them."""
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.span_id = next(_span_ids)
+        self.parent_id = parent.span_id if parent else None
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.attributes = dict(attributes or {})
+        self.status = "ok"
+        self.error = None
+        self.start_time_ns = time.time_ns()
+        self.duration = None # Seconds, set when the span ends
+        self._started_at = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+        return self
+
+    def add(self, key, amount):
+        """Adds amount to a numeric attribute, e.g. bytes over several chunks."""
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+        return self
+
+    def elapsed(self):
+        """Seconds since the span started."""
+        return time.perf_counter() - self._started_at
+
+    def finish(self):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self._started_at
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time_ns / 1e9,
+            "duration_ms": round((self.duration or 0.0) * 1000, 3),
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+class Sink:
+    """Receives spans. Subclasses override on_start and/or on_end; on_end is called once per finished span, from any thread."""
+
+    def on_start(self, span):
+        pass
+
+    def on_end(self, span):
+        pass
+
+class JSONLogSink(Sink):
+    """Writes each finished span as one JSON line to path (appending), or prints it when path is None."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        if path and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def on_end(self, span):
+        line = json.dumps(span.to_dict(), default=str, ensure_ascii=False)
+        if not self.path:
+            print(f"telemetry {line}")
+            return
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+
+class PrometheusSink(Sink):
+    """
+    Aggregates spans per stage name into Prometheus metrics:
+      <prefix>_stage_duration_seconds{stage,status}  histogram of span durations
+      <prefix>_stage_bytes_total{stage}              sum of the 'bytes' attribute
+      <prefix>_llm_tokens_total{stage,kind}          sums of the response.usage token counts
+      <prefix>_cache_requests_total{stage,result}    spans by their 'cache' attribute (hit, miss, ...)
+    render() returns the text exposition; start_http_server() serves it on /metrics.
+    """
+
+    def __init__(self, port=None, host="0.0.0.0"):
+        self._lock = threading.Lock()
+        self._histograms = {} # (stage, status) -> [bucket counts..., count, sum]
+        self._bytes = {} # stage -> total
+        self._tokens = {} # (stage, kind) -> total
+        self._cache = {} # (stage, result) -> count
+        self.server = None
+        if port is not None:
+            self.start_http_server(port, host)
+
+    def on_end(self, span):
+        attributes = span.attributes
+        with self._lock:
+            histogram = self._histograms.setdefault((span.name, span.status), [0] * (len(PROMETHEUS_DURATION_BUCKETS) + 2))
+            for position, bound in enumerate(PROMETHEUS_DURATION_BUCKETS):
+                if span.duration <= bound:
+                    histogram[position] += 1
+            histogram[-2] += 1
+            histogram[-1] += span.duration
+            if isinstance(attributes.get("bytes"), (int, float)):
+                self._bytes[span.name] = self._bytes.get(span.name, 0) + attributes["bytes"]
+            for kind in TOKEN_ATTRIBUTES:
+                if isinstance(attributes.get(kind), (int, float)):
+                    self._tokens[(span.name, kind)] = self._tokens.get((span.name, kind), 0) + attributes[kind]
+            if attributes.get("cache"):
+                key = (span.name, str(attributes["cache"]))
+                self._cache[key] = self._cache.get(key, 0) + 1
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        with self._lock:
+            name = f"{METRICS_PREFIX}_stage_duration_seconds"
+            lines += [f"# HELP {name} Duration of pipeline stages.", f"# TYPE {name} histogram"]
+            for (stage, status), histogram in sorted(self._histograms.items()):
+                labels = f'stage="{_label(stage)}",status="{_label(status)}"'
+                for bound, count in zip(PROMETHEUS_DURATION_BUCKETS, histogram):
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram[-2]}')
+                lines.append(f"{name}_count{{{labels}}} {histogram[-2]}")
+                lines.append(f"{name}_sum{{{labels}}} {histogram[-1]:.6f}")
+
+            name = f"{METRICS_PREFIX}_stage_bytes_total"
+            lines += [f"# HELP {name} Bytes handled by pipeline stages.", f"# TYPE {name} counter"]
+            for stage, total in sorted(self._bytes.items()):
+                lines.append(f'{name}{{stage="{_label(stage)}"}} {total}')
+
+            name = f"{METRICS_PREFIX}_llm_tokens_total"
+            lines += [f"# HELP {name} LLM tokens reported by response.usage.", f"# TYPE {name} counter"]
+            for (stage, kind), total in sorted(self._tokens.items()):
+                lines.append(f'{name}{{stage="{_label(stage)}",kind="{_label(kind)}"}} {total}')
+
+            name = f"{METRICS_PREFIX}_cache_requests_total"
+            lines += [f"# HELP {name} Cache lookups by result.", f"# TYPE {name} counter"]
+            for (stage, result), count in sorted(self._cache.items()):
+                lines.append(f'{name}{{stage="{_label(stage)}",result="{_label(result)}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def start_http_server(self, port=PROMETHEUS_DEFAULT_PORT, host="0.0.0.0"):
+        """Serves render() on http://host:port/metrics from a daemon thread. Returns the server."""
+        sink = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = sink.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args): # Keep scrapes out of the console
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self.server.serve_forever, name="telemetry-metrics", daemon=True).start()
+        print(f"Serving pipeline metrics on http://{host}:{self.server.server_address[1]}/metrics")
+        return self.server
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+class OpenTelemetrySink(Sink):
+    """
+    Mirrors spans into OpenTelemetry spans (same names, nesting, timing and attributes) using
+    tracer, by default the global tracer provider's. Raises ImportError if opentelemetry-api
+    is not installed.
+    """
+
+    def __init__(self, tracer=None):
+        if otel_trace is None:
+            raise ImportError("OpenTelemetrySink requires the 'opentelemetry-api' package (and an SDK exporter).")
+        self.tracer = tracer or otel_trace.get_tracer(OTEL_TRACER_NAME)
+        self._open_spans = {} # span_id -> OpenTelemetry span
+        self._lock = threading.Lock()
+
+    def on_start(self, span):
+        with self._lock:
+            parent = self._open_spans.get(span.parent_id)
+        context = otel_trace.set_span_in_context(parent) if parent is not None else None
+        otel_span = self.tracer.start_span(span.name, context=context, start_time=span.start_time_ns)
+        with self._lock:
+            self._open_spans[span.span_id] = otel_span
+
+    def on_end(self, span):
+        with self._lock:
+            otel_span = self._open_spans.pop(span.span_id, None)
+        if otel_span is None: # Sink was added while the span was running
+            return
+        for key, value in span.attributes.items():
+            if value is not None:
+                otel_span.set_attribute(key, value if isinstance(value, (str, bool, int, float)) else str(value))
+        if span.status == "error":
+            otel_span.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR, span.error))
+        otel_span.end(end_time=span.start_time_ns + int(span.duration * 1e9))
+
+def add_sink(sink):
+    """Registers sink for all spans started from now on. Returns sink."""
+    global _sinks
+    with _sinks_lock:
+        _sinks = _sinks + (sink,)
+    return sink
+
+def remove_sink(sink):
+    global _sinks
+    with _sinks_lock:
+        _sinks = tuple(s for s in _sinks if s is not sink)
+
+def _notify(callback, current):
+    try:
+        callback(current)
+    except Exception as e: # A broken exporter must never fail an itinerary
+        print(f"Telemetry sink {callback.__self__.__class__.__name__} failed: {e}")
+
+def current_span():
+    """Returns the innermost active span in this context, or None."""
+    return _current_span.get()
+
+def annotate(**attributes):
+    """Sets attributes on the current span, if any; a no-op outside of spans."""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+@contextmanager
+def span(name, parent=None, **attributes):
+    """
+    Times the enclosed block as a span named name, child of parent (default: the current span).
+    Yields the Span; an exception marks it as an error and is re-raised.
+    """
+    current = Span(name, parent or _current_span.get(), attributes)
+    sinks = _sinks
+    for sink in sinks:
+        _notify(sink.on_start, current)
+    previous = _current_span.get()
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        if not isinstance(e, GeneratorExit): # A consumer closing a generator early is not an error
+            current.status = "error"
+            current.error = f"{e.__class__.__name__}: {e}"
+        raise
+    finally:
+        try:
+            _current_span.reset(token)
+        except ValueError: # Generator resumed in another context: restore by value instead
+            _current_span.set(previous)
+        current.finish()
+        for sink in sinks:
+            _notify(sink.on_end, current)
+
+def traced(name, **attributes):
+    """Decorator form of span() for a whole function."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name, **attributes):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def bind(function):
+    """
+    Returns function bound to a copy of the current context, so spans it starts on a worker
+    thread are children of the span active at submit time. Bind once per submitted call.
+    """
+    return functools.partial(contextvars.copy_context().run, function)
+
+def configure_from_env(value=None):
+    """
+    Registers the sinks named in value (default: the PIPELINE_TELEMETRY environment variable):
+      json[:path]        JSONLogSink
+      prometheus[:port]  PrometheusSink serving /metrics (default port PROMETHEUS_DEFAULT_PORT)
+      otel               OpenTelemetrySink
+    Returns the list of sinks added; unknown or unavailable sinks are reported and skipped.
+    """
+    value = os.environ.get(TELEMETRY_ENV_VAR, "") if value is None else value
+    added = []
+    for spec in value.split(","):
+        kind, _, option = spec.strip().partition(":")
+        kind = kind.lower()
+        if not kind:
+            continue
+        try:
+            if kind == "json":
+                added.append(add_sink(JSONLogSink(option or None)))
+            elif kind == "prometheus":
+                added.append(add_sink(PrometheusSink(int(option) if option else PROMETHEUS_DEFAULT_PORT)))
+            elif kind in ("otel", "opentelemetry"):
+                added.append(add_sink(OpenTelemetrySink()))
+            else:
+                print(f"Unknown telemetry sink '{spec.strip()}' in {TELEMETRY_ENV_VAR}; expected json, prometheus or otel.")
+        except (ImportError, OSError, ValueError) as e:
+            print(f"Could not enable telemetry sink '{spec.strip()}': {e}")
+    return added
+
+configure_from_env()
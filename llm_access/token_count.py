@@ -0,0 +1,46 @@
+# llm_access/token_count.py
+# Token counting with tiktoken (listed in requirements). Falls back to a character-based
+# estimate if tiktoken or its encoding files are unavailable, so callers never fail on it.
+import threading
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+CHARS_PER_TOKEN_ESTIMATE = 4 # Rough average for English text with GPT tokenizers
+FALLBACK_ENCODING = "o200k_base" # gpt-4o family
+
+_encoders = {} # model name -> encoder (or None when unavailable)
+_encoders_lock = threading.Lock()
+
+def _get_encoder(model_name):
+    with _encoders_lock:
+        if model_name in _encoders:
+            return _encoders[model_name]
+        encoder = None
+        if tiktoken is not None:
+            try:
+                encoder = tiktoken.encoding_for_model(model_name)
+            except KeyError: # Model unknown to this tiktoken version
+                try:
+                    encoder = tiktoken.get_encoding(FALLBACK_ENCODING)
+                except Exception as e:
+                    print(f"tiktoken encoding unavailable, estimating tokens from length: {e}")
+            except Exception as e: # e.g. encoding files cannot be downloaded
+                print(f"tiktoken encoding unavailable, estimating tokens from length: {e}")
+        _encoders[model_name] = encoder
+        return encoder
+
+def count_tokens(text, model_name="gpt-4o"):
+    """Returns the number of tokens in text for model_name (estimated if tiktoken is unavailable)."""
+    if not text:
+        return 0
+    encoder = _get_encoder(model_name)
+    if encoder is None:
+        return len(text) // CHARS_PER_TOKEN_ESTIMATE + 1
+    return len(encoder.encode(text, disallowed_special=()))
+
+def count_chat_tokens(messages, model_name="gpt-4o"):
+    """Returns the approximate prompt token count of a chat messages list (content plus per-message overhead)."""
+    return sum(count_tokens(message.get("content", ""), model_name) + 4 for message in messages) + 3
@@ -0,0 +1,221 @@
+# llm_access/usage_ledger.py
+# Append-only ledger of LLM token usage, stored in a local SQLite file next to the response cache.
+# Every call made through llm_api is recorded with the caller that made it ('itinerary',
+# 'placeholder_image', 'city_list', ...), the request it belongs to, the token counts from
+# response.usage (estimated with tiktoken for streamed calls) and an approximate cost.
+# summarize_usage() answers capacity-planning questions (tokens per caller, per request, per day);
+# request_scope() gives one request a token budget that llm_api enforces by shrinking max_tokens
+# or refusing calls once it is spent.
+import argparse
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Project root is one level above llm_access, so the ledger lands next to the other caches
+LEDGER_DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "llm_usage.sqlite3")
+PROMPT_COST_PER_1K_TOKENS = 0.0025 # USD, gpt-4o list price; adjust to the deployment's contract
+COMPLETION_COST_PER_1K_TOKENS = 0.01
+MIN_COMPLETION_TOKENS = 256 # A budget that cannot grant this many output tokens refuses the call
+DEFAULT_CALLER = "other"
+GROUP_BY_COLUMNS = {
+    "caller": "caller",
+    "request": "request_id",
+    "model": "model",
+    "outcome": "outcome",
+    "day": "date(created_at, 'unixepoch', 'localtime')",
+}
+
+_connection = None
+_lock = threading.Lock() # One shared connection, serialized across worker threads
+_current_budget = contextvars.ContextVar("usage_ledger_budget", default=None)
+
+def _get_connection():
+    """Opens (and creates, if needed) the ledger database. Caller must hold _lock."""
+    global _connection
+    if _connection is None:
+        os.makedirs(os.path.dirname(LEDGER_DB_PATH), exist_ok=True)
+        _connection = sqlite3.connect(LEDGER_DB_PATH, check_same_thread=False)
+        _connection.execute(
+            "CREATE TABLE IF NOT EXISTS usage ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " created_at REAL NOT NULL,"
+            " request_id TEXT,"
+            " caller TEXT NOT NULL,"
+            " model TEXT NOT NULL,"
+            " prompt_tokens INTEGER NOT NULL,"
+            " completion_tokens INTEGER NOT NULL,"
+            " total_tokens INTEGER NOT NULL,"
+            " cost_usd REAL NOT NULL,"
+            " cached INTEGER NOT NULL," # Answered from the response cache: no tokens spent
+            " estimated INTEGER NOT NULL," # Counted locally because the API reported no usage
+            " outcome TEXT NOT NULL)" # complete, partial, failed, refused
+        )
+        _connection.execute("CREATE INDEX IF NOT EXISTS idx_usage_created_at ON usage (created_at)")
+        _connection.execute("CREATE INDEX IF NOT EXISTS idx_usage_request_id ON usage (request_id)")
+        _connection.commit()
+    return _connection
+
+def estimate_cost(prompt_tokens, completion_tokens):
+    """Approximate USD cost of a call at the configured per-1K-token prices."""
+    return (prompt_tokens * PROMPT_COST_PER_1K_TOKENS + completion_tokens * COMPLETION_COST_PER_1K_TOKENS) / 1000
+
+class RequestBudget:
+    """
+    Token budget (prompt + completion) for one request. Calls reserve their prompt plus their
+    granted max_tokens up front, so concurrent calls cannot overshoot together, and settle the
+    reservation with the actual usage when they finish.
+    """
+
+    def __init__(self, request_id, token_budget=None):
+        self.request_id = request_id
+        self.token_budget = token_budget
+        self.used_tokens = 0
+        self.reserved_tokens = 0
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        """Tokens not yet used or reserved, or None for an unlimited budget."""
+        if self.token_budget is None:
+            return None
+        with self._lock:
+            return max(0, self.token_budget - self.used_tokens - self.reserved_tokens)
+
+    def reserve(self, prompt_tokens, max_tokens):
+        """
+        Reserves budget for a call. Returns the max_tokens to request (possibly reduced to what is
+        left), or None if fewer than MIN_COMPLETION_TOKENS output tokens would remain.
+        """
+        with self._lock:
+            if self.token_budget is None:
+                granted = max_tokens
+            else:
+                available = self.token_budget - self.used_tokens - self.reserved_tokens - prompt_tokens
+                if available < min(max_tokens, MIN_COMPLETION_TOKENS):
+                    return None
+                granted = min(max_tokens, available)
+            self.reserved_tokens += prompt_tokens + granted
+            return granted
+
+    def settle(self, reserved_tokens, used_tokens):
+        """Releases a reservation and charges the tokens the call actually used."""
+        with self._lock:
+            self.reserved_tokens = max(0, self.reserved_tokens - reserved_tokens)
+            self.used_tokens += used_tokens
+
+@contextmanager
+def request_scope(request_id=None, token_budget=None):
+    """
+    Tags LLM calls made in the enclosed block (and in contexts copied from it) with request_id
+    and enforces token_budget across them. Nested scopes join the enclosing one, so a request
+    that delegates to another pipeline entry point keeps a single budget. Yields the RequestBudget.
+    """
+    budget = _current_budget.get()
+    if budget is not None:
+        yield budget
+        return
+    budget = RequestBudget(request_id, token_budget)
+    token = _current_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        try:
+            _current_budget.reset(token)
+        except ValueError: # Generator resumed in another context
+            _current_budget.set(None)
+
+def current_budget():
+    """Returns the RequestBudget of the enclosing request_scope, or None."""
+    return _current_budget.get()
+
+def record_usage(caller, model, prompt_tokens=0, completion_tokens=0, total_tokens=None,
+                 cached=False, estimated=False, outcome="complete", request_id=None):
+    """Appends one call to the ledger. request_id defaults to the enclosing request_scope's."""
+    if request_id is None and _current_budget.get() is not None:
+        request_id = _current_budget.get().request_id
+    prompt_tokens = int(prompt_tokens or 0)
+    completion_tokens = int(completion_tokens or 0)
+    total_tokens = prompt_tokens + completion_tokens if total_tokens is None else int(total_tokens)
+    try:
+        with _lock:
+            conn = _get_connection()
+            conn.execute(
+                "INSERT INTO usage (created_at, request_id, caller, model, prompt_tokens, completion_tokens,"
+                " total_tokens, cost_usd, cached, estimated, outcome) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), request_id, caller or DEFAULT_CALLER, model, prompt_tokens, completion_tokens, total_tokens,
+                 estimate_cost(prompt_tokens, completion_tokens), int(bool(cached)), int(bool(estimated)), outcome)
+            )
+            conn.commit()
+    except sqlite3.Error as e:
+        print(f"Failed to record LLM usage: {e}")
+
+def summarize_usage(group_by="caller", since=None, until=None, request_id=None, caller=None):
+    """
+    Aggregates the ledger grouped by one of GROUP_BY_COLUMNS ('caller', 'request', 'model',
+    'outcome', 'day'), optionally restricted to a time range (epoch seconds), a request or a caller.
+    Returns a list of dictionaries with 'group', 'calls', 'cached_calls', 'prompt_tokens',
+    'completion_tokens', 'total_tokens', 'avg_total_tokens' and 'cost_usd', largest total first.
+    """
+    if group_by not in GROUP_BY_COLUMNS:
+        raise ValueError(f"group_by must be one of {sorted(GROUP_BY_COLUMNS)}")
+    conditions, parameters = [], []
+    for column, operator, value in (("created_at", ">=", since), ("created_at", "<", until), ("request_id", "=", request_id), ("caller", "=", caller)):
+        if value is not None:
+            conditions.append(f"{column} {operator} ?")
+            parameters.append(value)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    query = (
+        f"SELECT {GROUP_BY_COLUMNS[group_by]} AS grp, COUNT(*), SUM(cached), SUM(prompt_tokens),"
+        f" SUM(completion_tokens), SUM(total_tokens), SUM(cost_usd) FROM usage {where}"
+        " GROUP BY grp ORDER BY SUM(total_tokens) DESC"
+    )
+    try:
+        with _lock:
+            rows = _get_connection().execute(query, parameters).fetchall()
+    except sqlite3.Error as e:
+        print(f"Failed to query LLM usage: {e}")
+        return []
+    summary = []
+    for group, calls, cached_calls, prompt_tokens, completion_tokens, total_tokens, cost in rows:
+        uncached_calls = calls - (cached_calls or 0)
+        summary.append({
+            "group": group,
+            "calls": calls,
+            "cached_calls": cached_calls or 0,
+            "prompt_tokens": prompt_tokens or 0,
+            "completion_tokens": completion_tokens or 0,
+            "total_tokens": total_tokens or 0,
+            "avg_total_tokens": round((total_tokens or 0) / uncached_calls, 1) if uncached_calls else 0.0,
+            "cost_usd": round(cost or 0.0, 4),
+        })
+    return summary
+
+def get_request_usage(request_id):
+    """Totals for one request id (see summarize_usage), or None if nothing was recorded for it."""
+    summary = summarize_usage(group_by="request", request_id=request_id)
+    return summary[0] if summary else None
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize recorded LLM token usage.")
+    parser.add_argument("--group-by", default="caller", choices=sorted(GROUP_BY_COLUMNS))
+    parser.add_argument("--hours", type=float, help="Only include calls from the last N hours")
+    parser.add_argument("--request", dest="request_id", help="Only include calls of this request id")
+    parser.add_argument("--caller", help="Only include calls of this caller")
+    args = parser.parse_args()
+
+    since = time.time() - args.hours * 3600 if args.hours else None
+    summary = summarize_usage(args.group_by, since=since, request_id=args.request_id, caller=args.caller)
+    if not summary:
+        print("No LLM usage recorded.")
+        return
+    print(f"{args.group_by:<36} {'calls':>7} {'cached':>7} {'prompt':>10} {'completion':>11} {'avg/call':>9} {'cost USD':>10}")
+    for row in summary:
+        print(
+            f"{str(row['group'])[:36]:<36} {row['calls']:>7} {row['cached_calls']:>7} {row['prompt_tokens']:>10} "
+            f"{row['completion_tokens']:>11} {row['avg_total_tokens']:>9} {row['cost_usd']:>10.4f}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+# output_store.py
+# Per-request output directories, so concurrent itinerary runs (several Streamlit sessions,
+# batch workers) never write into the same folder and nothing has to clear 'Output' globally.
+# Layout:
+#   Output/requests/<request_id>/Generated_Output.json
+#   Output/requests/<request_id>/images/...
+# A background thread removes request directories by age and keeps the total size bounded.
+# Directories that are still being written are never collected: the writer keeps an in-use
+# marker file (.in_use.<host>.<pid>.<token>) inside the directory, which the collector of
+# every process (app, batch runs, job queue workers) respects.
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+
+OUTPUT_REQUESTS_DIR = os.path.join("Output", "requests")
+OUTPUT_MAX_AGE_SECONDS = 24 * 60 * 60 # Request directories older than this are removed
+OUTPUT_MAX_BYTES = 1024 * 1024 * 1024 # Oldest request directories are removed beyond this total size
+OUTPUT_GC_INTERVAL_SECONDS = 10 * 60 # How often the background collector runs
+IN_USE_MARKER_PREFIX = ".in_use."
+
+_active_markers = {} # Absolute request directory path -> marker files this process created in it
+_active_lock = threading.Lock()
+_gc_thread = None
+_gc_thread_lock = threading.Lock()
+
+def new_request_id():
+    """Returns a unique, time-sortable request id such as '20250710T153000-1a2b3c4d'."""
+    return f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+def request_dir_path(request_id):
+    return os.path.join(OUTPUT_REQUESTS_DIR, request_id)
+
+def create_request_dir(request_id=None):
+    """
+    Creates the output directory for one request and marks it active so the garbage collector
+    leaves it alone until release_request_dir is called. Starts the background collector on
+    first use. Returns (request_id, directory_path).
+    """
+    request_id = request_id or new_request_id()
+    path = request_dir_path(request_id)
+    os.makedirs(path, exist_ok=True)
+    marker_path = os.path.join(path, f"{IN_USE_MARKER_PREFIX}{socket.gethostname()}.{os.getpid()}.{uuid.uuid4().hex[:8]}")
+    with open(marker_path, 'w', encoding='utf-8'):
+        pass
+    os.utime(path, None) # Age is measured from the last time the request was (re)used
+    with _active_lock:
+        _active_markers.setdefault(os.path.abspath(path), []).append(marker_path)
+    start_background_gc()
+    return request_id, path
+
+def release_request_dir(path):
+    """Marks a request directory as finished; it becomes eligible for garbage collection."""
+    with _active_lock:
+        marker_paths = _active_markers.pop(os.path.abspath(path), [])
+    for marker_path in marker_paths:
+        try:
+            os.remove(marker_path)
+        except FileNotFoundError:
+            pass
+
+def _marker_is_live(marker_name, marker_path, now, max_age_seconds):
+    """
+    A marker counts until its writer releases it. Markers left behind by a process that died
+    are ignored: on this host the pid is checked, otherwise the marker expires like the directory.
+    """
+    parts = marker_name[len(IN_USE_MARKER_PREFIX):].rsplit(".", 2)
+    if os.name == "posix" and len(parts) == 3 and parts[0] == socket.gethostname() and parts[1].isdigit():
+        try:
+            os.kill(int(parts[1]), 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError: # Alive, owned by another user
+            pass
+        return True
+    try:
+        return now - os.path.getmtime(marker_path) <= max_age_seconds
+    except OSError:
+        return False
+
+def _in_use(path, now, max_age_seconds):
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return False
+    return any(
+        _marker_is_live(name, os.path.join(path, name), now, max_age_seconds)
+        for name in names if name.startswith(IN_USE_MARKER_PREFIX)
+    )
+
+def remove_request_dir(path):
+    """Deletes a finished request directory right away (e.g. a session's previous result)."""
+    release_request_dir(path)
+    shutil.rmtree(path, ignore_errors=True)
+
+def _unique_size(path):
+    """
+    Bytes held by files under path. Images are hard links into the shared image cache, so
+    files with more than one link are not counted; removing the directory would not free them.
+    """
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                stat = os.stat(os.path.join(dirpath, filename))
+            except OSError:
+                continue
+            if stat.st_nlink <= 1:
+                total += stat.st_size
+    return total
+
+def collect_garbage(max_age_seconds=None, max_bytes=None):
+    """
+    Removes request directories without a live in-use marker older than max_age_seconds, then the oldest remaining
+    ones until their total size fits max_bytes. Returns the number of directories removed.
+    """
+    max_age_seconds = OUTPUT_MAX_AGE_SECONDS if max_age_seconds is None else max_age_seconds
+    max_bytes = OUTPUT_MAX_BYTES if max_bytes is None else max_bytes
+    try:
+        names = os.listdir(OUTPUT_REQUESTS_DIR)
+    except FileNotFoundError:
+        return 0
+
+    now = time.time()
+    candidates = [] # (mtime, path, size) of inactive directories, kept if young enough
+    removed = 0
+    for name in names:
+        path = os.path.join(OUTPUT_REQUESTS_DIR, name)
+        if not os.path.isdir(path) or _in_use(path, now, max_age_seconds):
+            continue
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            continue
+        if now - mtime > max_age_seconds:
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+        else:
+            candidates.append((mtime, path, _unique_size(path)))
+
+    total = sum(size for _, _, size in candidates)
+    for _, path, size in sorted(candidates):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        removed += 1
+
+    if removed:
+        print(f"Output garbage collection removed {removed} request director{'y' if removed == 1 else 'ies'}.")
+    return removed
+
+def _gc_loop():
+    while True:
+        try:
+            collect_garbage()
+        except Exception as e: # Never let the collector thread die
+            print(f"Output garbage collection failed: {e}")
+        time.sleep(OUTPUT_GC_INTERVAL_SECONDS)
+
+def start_background_gc():
+    """Starts the daemon garbage collection thread once per process."""
+    global _gc_thread
+    with _gc_thread_lock:
+        if _gc_thread is None or not _gc_thread.is_alive():
+            _gc_thread = threading.Thread(target=_gc_loop, name="output-gc", daemon=True)
+            _gc_thread.start()
@@ -4,13 +4,103 @@ import os
 import re
 import datetime
 import requests # For downloading images
-import uuid # For unique filenames
+import contextlib
+import copy
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse # To get file extension
-from llm_access.llm_api import get_llm_response # Assuming this is the function to call the LLM
+import image_cache # Persistent, content-addressed image cache shared across runs
+import image_thumbnails # Bounded-resolution renditions of cached images, made in a process pool
+import output_store # Per-request output directories with background garbage collection
+import poi_index # Local POI retrieval used to ground the itinerary prompt
+from single_flight import SingleFlight, FlightAbandoned # Coalesces identical in-flight requests within this process
+from prompt_templates import PromptTemplate, plan_token_budget
+from llm_access.llm_api import get_llm_response, get_llm_responses_concurrently, stream_llm_response # Assuming this is the function to call the LLM
+from llm_access.json_stream import JSONArrayItemStream, recover_truncated_json
+from llm_access import telemetry # Per-stage timing spans, exported by the sinks configured there
+from llm_access import usage_ledger # Per-call token usage, tagged by caller, and per-request token budgets
 
 INPUT_DIR = "input"
-OUTPUT_DIR = "Output" # Base output directory, changed to capital 'O'
+OUTPUT_DIR = "Output" # Base output directory, changed to capital 'O'; each run writes to its own output_store request directory
 IMAGES_SUBDIR = "images" # Subdirectory for storing downloaded images
+IMAGE_FETCH_WORKERS = 8 # Max number of activity images processed concurrently
+IMAGE_FETCH_PER_HOST_LIMIT = 4 # Max concurrent downloads against a single host (be polite to CDNs)
+DEFAULT_GENERATION_MODE = "single" # "single" (one LLM call), "parallel_days" (skeleton + one call per day) or "auto"
+PARALLEL_DAYS_MIN_DURATION = 4 # In "auto" mode, trips at least this long are generated per day
+SKELETON_MAX_TOKENS = 1024 # The skeleton is a compact list of themes and anchor POIs (minimum budget)
+SKELETON_TOKENS_PER_DAY = 60 # Added to the skeleton budget per trip day
+CONTINUATION_MAX_ROUNDS = 2 # Follow-up requests for days missing from a truncated itinerary
+POI_CANDIDATES_LIMIT = 15 # Known POIs injected into the prompt (0 disables grounding)
+POI_CANDIDATE_DESCRIPTION_CHARS = 120 # Dataset descriptions are truncated to keep the prompt small
+ITINERARY_TOKEN_BUDGET = 120000 # Prompt + completion tokens one itinerary may spend (preferences['token_budget'] overrides; None = unlimited)
+PLACEHOLDER_BUDGET_RESERVE = 8000 # Placeholder lookups are skipped when less than this is left, keeping it for the itinerary itself
+
+# --- Itinerary response schema (shared by single-call and per-day generation) ---
+DAY_OBJECT_SCHEMA = (
+    "   a. 'day': (integer) The day number (e.g., 1). "
+    "   b. 'day_summary': (string) A brief overall summary for the day's theme or main focus. "
+    # "   c. 'image_url': (string) A publicly accessible, royalty-free (if possible) direct URL to a general image representing the day. Use an empty string if no suitable image is found. " # REMOVED
+    "   c. 'activities': (list of objects) Each object in this list represents a specific POI or activity for the day and *must* include: " # Note: 'c' was 'd'
+    "      i. 'name': (string) Name of the POI or activity (e.g., \"Eiffel Tower Visit\"). "
+    "      ii. 'time_of_day': (string) Suggested time (e.g., \"Morning\", \"9:00 AM - 12:00 PM\", \"Afternoon\"). "
+    "      iii. 'description': (string) A detailed description of the POI/activity. "
+    "      iv. 'why_relevant': (string) Reason why this POI/activity is included or interesting. "
+    "      v. 'estimated_duration': (string) Estimated time to spend (e.g., \"2-3 hours\"). "
+    "      vi. 'estimated_cost': (string) Estimated cost (e.g., \"€25 per person\", \"Free\", \"$$ - Moderate\"). "
+    "      vii. 'poi_image_url': (string, optional) A direct URL to an image specific to this POI/activity. Use an empty string if not available. "
+    "   e. 'daily_meal_suggestions': (object) An object with keys 'breakfast', 'lunch', and 'dinner'. Each key should have a string value with a suggestion for that meal. If a meal suggestion isn't applicable or available, use an empty string for its value. Example: {\"breakfast\": \"Hotel breakfast or local bakery.\", \"lunch\": \"Cafe near museum.\", \"dinner\": \"Traditional restaurant for pasta.\"} "
+    "   f. 'daily_logistical_tips': (string) Any logistical tips for the day (e.g., \"Book museum tickets online. Wear comfortable shoes.\"). "
+)
+DAY_OBJECT_EXAMPLE = (
+    "{\"day\": 1, \"day_summary\": \"Exploring iconic Parisian landmarks.\", "
+    " \"activities\": [{\"name\": \"Eiffel Tower\", \"time_of_day\": \"Morning\", \"description\": \"Visit the iconic tower.\", \"why_relevant\": \"Symbol of Paris.\", \"estimated_duration\": \"2-3 hours\", \"estimated_cost\": \"€25\", \"poi_image_url\": \"https://example.com/eiffel.jpg\"}], "
+    " \"daily_meal_suggestions\": {\"breakfast\": \"Croissants and coffee.\", \"lunch\": \"Crepes from a street vendor.\", \"dinner\": \"Romantic bistro meal.\"}, \"daily_logistical_tips\": \"Book Eiffel Tower tickets online to avoid queues.\"} "
+)
+ITINERARY_RESPONSE_INSTRUCTIONS = (
+    " IMPORTANT: Respond *only* with a single, valid JSON object. Do not include any text or explanation before or after the JSON. "
+    "The JSON object must have the following top-level keys: "
+    "1. 'destination': A string with the name of the destination (e.g., \"Paris, France\"). "
+    "2. 'itinerary': A list of objects. Each object represents a single day's plan and *must* have the following keys: "
+    + DAY_OBJECT_SCHEMA +
+    "3. 'estimated_cost': A string describing the overall estimated cost for the trip *excluding meals* (e.g., for accommodation, activities, local transport: \"$1000 - $1500 for 2 people\"). "
+    "4. 'estimated_daily_meal_cost_per_person': A string representing a typical daily cost for three meals per person (e.g., \"$50-70 USD\", \"€40-60 EUR\"). This should align with the user's budget preference. "
+    "Example of a day object within the 'itinerary' list: "
+    + DAY_OBJECT_EXAMPLE +
+    "The number of day objects in the 'itinerary' list should match the trip duration."
+)
+SKELETON_RESPONSE_INSTRUCTIONS = (
+    " For now, produce ONLY a compact trip skeleton, not the detailed plan. "
+    "IMPORTANT: Respond *only* with a single, valid JSON object. Do not include any text or explanation before or after the JSON. "
+    "The JSON object must have the following top-level keys: "
+    "1. 'destination': A string with the name of the destination (e.g., \"Paris, France\"). "
+    "2. 'days': A list with exactly one object per day of the trip. Each object *must* have the following keys: "
+    "   a. 'day': (integer) The day number (e.g., 1). "
+    "   b. 'theme': (string) One short sentence describing the day's theme or main focus. "
+    "   c. 'anchor_pois': (list of strings) 1-3 names of the key POIs or activities that anchor the day. Never repeat a POI on more than one day. "
+    "3. 'estimated_cost': A string describing the overall estimated cost for the trip *excluding meals* (e.g., for accommodation, activities, local transport: \"$1000 - $1500 for 2 people\"). "
+    "4. 'estimated_daily_meal_cost_per_person': A string representing a typical daily cost for three meals per person (e.g., \"$50-70 USD\", \"€40-60 EUR\"). This should align with the user's budget preference. "
+    "Keep every string short. "
+    "Example: {\"destination\": \"Paris, France\", \"days\": [{\"day\": 1, \"theme\": \"Iconic landmarks.\", \"anchor_pois\": [\"Eiffel Tower\", \"Seine River Cruise\"]}], \"estimated_cost\": \"€1200 - €1600 for 2 people\", \"estimated_daily_meal_cost_per_person\": \"€40-60 EUR\"}"
+)
+
+DAY_RESPONSE_INSTRUCTIONS = (
+    " IMPORTANT: Respond *only* with a single, valid JSON object representing this one day's plan. Do not include any text or explanation before or after the JSON. "
+    "The JSON object *must* have the following keys: "
+    + DAY_OBJECT_SCHEMA +
+    "Example of a day object: "
+    + DAY_OBJECT_EXAMPLE
+)
+
+# Compiled once: the static instructions are tokenized a single time, see prompt_templates.py
+ITINERARY_TEMPLATE = PromptTemplate(ITINERARY_RESPONSE_INSTRUCTIONS)
+SKELETON_TEMPLATE = PromptTemplate(SKELETON_RESPONSE_INSTRUCTIONS)
+DAY_TEMPLATE = PromptTemplate(DAY_RESPONSE_INSTRUCTIONS)
+
+_host_semaphores = {} # (host, limit) -> BoundedSemaphore, shared by all image workers
+_host_semaphores_lock = threading.Lock()
+_itinerary_flights = SingleFlight("itinerary") # Identical concurrent create_travel_itinerary calls share one generation
+_itinerary_stream_flights = SingleFlight("itinerary stream") # Same for stream_travel_itinerary
+_placeholder_flights = SingleFlight("placeholder lookup") # Identical placeholder prompts share one LLM call
 
 def sanitize_foldername(name):
     """Sanitizes a string to be used as a folder or file name."""
@@ -18,6 +108,7 @@ def sanitize_foldername(name):
     name = re.sub(r'(?u)[^-\w.]', '', name) # Keep alphanumeric, underscore, hyphen, dot
     return name[:100] if name else "unknown_item" # Limit length
 
+@telemetry.traced("placeholder_lookup", requested=1)
 def get_llm_placeholder_image_url(description_for_image):
     """
     Asks the LLM for a generic, royalty-free, publicly accessible image URL
@@ -31,7 +122,9 @@ def get_llm_placeholder_image_url(description_for_image):
         "Example: https://images.unsplash.com/photo-12345. If no suitable royalty-free image can be found, respond with an empty string."
     )
     try:
-        response = get_llm_response(prompt) # Assuming get_llm_response can handle direct string if LLM returns just URL
+        response, joined = _placeholder_flights.do(prompt, get_llm_response, prompt, caller="placeholder_image") # Assuming get_llm_response can handle direct string if LLM returns just URL
+        if joined:
+            telemetry.annotate(coalesced=True)
         if isinstance(response, str) and response.strip().startswith(('http://', 'https://')):
             print(f"LLM provided placeholder image URL: {response.strip()}")
             return response.strip()
@@ -49,55 +142,462 @@ def get_llm_placeholder_image_url(description_for_image):
         print(f"Error fetching placeholder image URL from LLM for '{description_for_image}': {e}")
         return None
 
+def _get_host_semaphore(image_url):
+    """Returns the semaphore limiting concurrent downloads against the host of image_url."""
+    host = urlparse(image_url).netloc.lower()
+    key = (host, IMAGE_FETCH_PER_HOST_LIMIT)
+    with _host_semaphores_lock:
+        semaphore = _host_semaphores.get(key)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(max(1, IMAGE_FETCH_PER_HOST_LIMIT))
+            _host_semaphores[key] = semaphore
+    return semaphore
+
 def download_image(image_url, destination_folder, base_filename):
     """
     Downloads an image from a URL and saves it locally.
+    The URL is probed first (see image_cache.probe_image) so dead links, non-images and
+    oversized files are rejected within seconds instead of the full download timeout.
     Returns the local path if successful, else None.
     """
     if not image_url or not isinstance(image_url, str) or not image_url.strip().startswith(('http://', 'https://')):
         return None
     
+    with telemetry.span("image_download", host=urlparse(image_url).netloc.lower()) as download_span:
+        with _get_host_semaphore(image_url): # Bound concurrent requests per host
+            download_span.set(queued_seconds=round(download_span.elapsed(), 4))
+            with telemetry.span("image_probe") as probe_span:
+                valid, reason = image_cache.probe_image(image_url)
+                probe_span.set(result=reason)
+            if not valid:
+                print(f"Skipping image {image_url}: {reason}")
+                download_span.set(outcome="rejected")
+                return None
+            return _download_image_unbounded(image_url, destination_folder, base_filename)
+
+def _download_image_unbounded(image_url, destination_folder, base_filename):
+    """
+    Performs the actual download for download_image, without any concurrency limits.
+    Bytes come from the shared image cache (see image_cache.py); the output file is a
+    hard link to a bounded-resolution thumbnail of the cached blob (or to the blob itself
+    if no thumbnail can be made), named after its content hash so reruns reuse it.
+    """
+    filepath = None
     try:
-        # Attempt with verification first
-        try:
-            response = requests.get(image_url, stream=True, timeout=10, verify=True)
-            response.raise_for_status()
-        except requests.exceptions.SSLError as ssl_err:
-            print(f"SSL verification failed for {image_url}: {ssl_err}. Attempting with verify=False (SECURITY WARNING).")
-            print("WARNING: Disabling SSL verification. This is insecure and should ONLY be used in controlled development environments if you understand the risks.")
-            response = requests.get(image_url, stream=True, timeout=10, verify=False)
-            response.raise_for_status() # Raise an exception for bad status codes even with verify=False
-
-        # Try to get a file extension
-        parsed_url = urlparse(image_url)
-        path_parts = os.path.splitext(parsed_url.path)
-        ext = path_parts[1] if len(path_parts) > 1 and path_parts[1] else '.jpg' # Default to .jpg
-        
-        # Sanitize base_filename further if needed, and add UUID to ensure uniqueness
-        filename = f"{sanitize_foldername(base_filename)}_{uuid.uuid4().hex[:8]}{ext}"
+        blob_path = image_cache.fetch_image(image_url)
+        display_path = image_thumbnails.get_thumbnail(blob_path) or blob_path
+
+        # Cached blobs are named <sha256><ext>; reuse the hash prefix instead of a random UUID
+        blob_name = os.path.splitext(os.path.basename(blob_path))[0]
+        ext = os.path.splitext(display_path)[1]
+        filename = f"{sanitize_foldername(base_filename)}_{blob_name[:8]}{ext}"
         filepath = os.path.join(destination_folder, filename)
         
-        os.makedirs(destination_folder, exist_ok=True)
-        
-        with open(filepath, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        image_cache.link_cached_image(display_path, filepath)
         print(f"Successfully downloaded image to {filepath}")
+        telemetry.annotate(outcome="ok", bytes=os.path.getsize(display_path), thumbnail=display_path != blob_path)
         return filepath
     except requests.exceptions.RequestException as e:
         print(f"Failed to download {image_url}: {e}")
+        telemetry.annotate(outcome="failed")
         return None
     except IOError as e:
         print(f"Failed to save image from {image_url} to {filepath}: {e}")
+        telemetry.annotate(outcome="failed")
         return None
 
-def create_travel_itinerary(preferences):
+@telemetry.traced("placeholder_lookup")
+def get_llm_placeholder_image_urls(descriptions_for_images):
     """
-    Generates a travel itinerary based on preferences, calls LLM,
-    adapts the response, and saves it to a structured output path.
-    Returns the itinerary data and the path where it was saved.
+    Batched variant of get_llm_placeholder_image_url: asks the LLM for one placeholder image
+    URL per description in a single structured JSON request.
+    Returns a list aligned with descriptions_for_images holding a URL string or None each.
+    """
+    if not descriptions_for_images:
+        return []
+    telemetry.annotate(requested=len(descriptions_for_images))
+    numbered_descriptions = "\n".join(f"{i}: {description}" for i, description in enumerate(descriptions_for_images))
+    prompt = (
+        "For each numbered description below, provide a single, publicly accessible, royalty-free image URL that best represents it. "
+        "The images should be suitable as general placeholders.\n"
+        f"{numbered_descriptions}\n"
+        "Respond with a JSON object with one key 'images' holding a list of objects, one per description, each with the keys "
+        "'id' (integer, the number of the description) and 'image_url' (string). "
+        "Example: {\"images\": [{\"id\": 0, \"image_url\": \"https://images.unsplash.com/photo-12345\"}]}. "
+        "If no suitable royalty-free image can be found for a description, use an empty string for its 'image_url'."
+    )
+    urls = [None] * len(descriptions_for_images)
+    try:
+        response, joined = _placeholder_flights.do(prompt, get_llm_response, prompt, caller="placeholder_image")
+    except Exception as e:
+        print(f"Error fetching placeholder image URLs from LLM: {e}")
+        return urls
+    if joined:
+        telemetry.annotate(coalesced=True)
+
+    entries = response.get("images") if isinstance(response, dict) else response
+    if not isinstance(entries, list):
+        print(f"LLM did not provide a valid placeholder URL list. Response: {str(response)[:200]}")
+        return urls
+    for position, entry in enumerate(entries):
+        if isinstance(entry, dict):
+            index, url = entry.get("id", position), entry.get("image_url") or entry.get("url")
+        else: # A bare list of URLs, in description order
+            index, url = position, entry
+        try:
+            index = int(index)
+        except (TypeError, ValueError):
+            continue
+        if 0 <= index < len(urls) and isinstance(url, str) and url.strip().startswith(('http://', 'https://')):
+            urls[index] = url.strip()
+    telemetry.annotate(resolved=sum(1 for url in urls if url))
+    print(f"LLM provided {sum(1 for url in urls if url)}/{len(urls)} placeholder image URLs in one request.")
+    return urls
+
+def _activity_image_basename(activity_raw, day_number, destination):
+    activity_name_sanitized = sanitize_foldername(activity_raw.get("name", "poi"))
+    return f"{destination}_day_{day_number}_{activity_name_sanitized}"
+
+def _placeholder_description(activity_raw, destination):
+    return f"an image representing {activity_raw.get('name', 'an activity')} in {destination}"
+
+def fetch_activity_image(activity_raw, day_number, destination, images_dir_path, use_placeholder=True):
+    """
+    Resolves the image for a single activity: downloads its 'poi_image_url' and,
+    if that fails or is empty, asks the LLM for a placeholder and downloads that instead.
+    With use_placeholder=False only the original URL is tried (the itinerary pipeline
+    resolves placeholders for all failed activities at once, see _collect_day_images).
+    Returns the local image path, or an empty string if no image could be obtained.
+    """
+    poi_image_url_original = activity_raw.get("poi_image_url")
+    local_poi_image_path_activity = None
+    poi_image_filename_base_activity = _activity_image_basename(activity_raw, day_number, destination)
+
+    if poi_image_url_original:
+        local_poi_image_path_activity = download_image(poi_image_url_original, images_dir_path, poi_image_filename_base_activity)
+
+    if not local_poi_image_path_activity and use_placeholder: # If original POI URL failed or was empty, try placeholder
+        print(f"Attempting to get placeholder for POI image: {activity_raw.get('name', 'Activity')} in {destination}")
+        placeholder_poi_url = get_llm_placeholder_image_url(_placeholder_description(activity_raw, destination))
+        if placeholder_poi_url:
+            local_poi_image_path_activity = download_image(placeholder_poi_url, images_dir_path, f"{poi_image_filename_base_activity}_placeholder")
+
+    return local_poi_image_path_activity if local_poi_image_path_activity else ""
+
+def _submit_day_images(executor, day_plan_raw, destination, images_dir_path):
+    """
+    Copies one raw day plan and submits a download task for each activity's original image.
+    Returns (day_plan_processed, pending_images) where pending_images holds
+    (activity_processed, future, day_number) per copied activity; the copies'
+    'poi_image_url' is empty until collected.
+    """
+    day_plan_processed = day_plan_raw.copy() # Start with a copy
+    
+    # Ensure 'image_url' for the day is not processed or added if it's not in the raw LLM response
+    if "image_url" in day_plan_processed:
+        del day_plan_processed["image_url"] # Remove it if LLM somehow still provides it
+
+    processed_activities = []
+    pending_images = []
+    day_number = day_plan_raw.get('day', 'unknown')
+    if "activities" in day_plan_raw and isinstance(day_plan_raw["activities"], list):
+        for activity_raw in day_plan_raw["activities"]:
+            activity_processed = activity_raw.copy()
+            activity_processed["poi_image_url"] = ""
+            future = executor.submit(telemetry.bind(fetch_activity_image), activity_raw, day_number, destination, images_dir_path, False)
+            pending_images.append((activity_processed, future, day_number))
+            processed_activities.append(activity_processed)
+    day_plan_processed["activities"] = processed_activities
+    return day_plan_processed, pending_images
+
+def _await_day_images(pending_images):
+    """
+    Waits for submitted image tasks and stores their local paths on the copied activities.
+    Returns (activity_processed, day_number) for each activity whose original image could not be downloaded.
+    """
+    missing = [] # (activity_processed, day_number) without an image
+    for activity_processed, future, day_number in pending_images:
+        try:
+            activity_processed["poi_image_url"] = future.result()
+        except Exception as e: # A single failed image must not fail the whole itinerary
+            print(f"Error processing image for activity '{activity_processed.get('name', 'Activity')}': {e}")
+            activity_processed["poi_image_url"] = ""
+        if not activity_processed["poi_image_url"]:
+            missing.append((activity_processed, day_number))
+    return missing
+
+def _resolve_placeholder_images(executor, missing, destination, images_dir_path):
+    """
+    Asks the LLM for placeholder URLs for all (activity_processed, day_number) in missing with one
+    request and downloads them on the executor, storing the local paths on the activities.
+    """
+    if not missing:
+        return
+    budget = usage_ledger.current_budget()
+    remaining_tokens = budget.remaining() if budget else None
+    if remaining_tokens is not None and remaining_tokens < PLACEHOLDER_BUDGET_RESERVE:
+        print(f"Skipping placeholders for {len(missing)} POI image(s): only {remaining_tokens} tokens left in the request's budget.")
+        return
+
+    print(f"Attempting to get placeholders for {len(missing)} POI image(s) in {destination}")
+    placeholder_urls = get_llm_placeholder_image_urls([_placeholder_description(activity, destination) for activity, _ in missing])
+    placeholder_downloads = []
+    for (activity_processed, day_number), placeholder_url in zip(missing, placeholder_urls):
+        if placeholder_url:
+            filename_base = f"{_activity_image_basename(activity_processed, day_number, destination)}_placeholder"
+            placeholder_downloads.append((activity_processed, executor.submit(telemetry.bind(download_image), placeholder_url, images_dir_path, filename_base)))
+    for activity_processed, future in placeholder_downloads:
+        try:
+            activity_processed["poi_image_url"] = future.result() or ""
+        except Exception as e:
+            print(f"Error processing placeholder image for activity '{activity_processed.get('name', 'Activity')}': {e}")
+
+def _collect_day_images(executor, pending_images, destination, images_dir_path):
+    """
+    Waits for submitted image tasks and stores their local paths on the copied activities.
+    Activities whose original image could not be downloaded get their placeholder URLs from
+    a single batched LLM request; the placeholders are then downloaded on the executor.
+    """
+    _resolve_placeholder_images(executor, _await_day_images(pending_images), destination, images_dir_path)
+
+@telemetry.traced("image_processing")
+def process_itinerary_images(raw_itinerary_details, destination, images_dir_path, image_workers=None):
+    """
+    Copies the raw day plans from the LLM and replaces every activity's 'poi_image_url'
+    with a local image path. Activity images are fetched concurrently on a bounded
+    thread pool (image_workers, default IMAGE_FETCH_WORKERS), with per-host limits
+    applied in download_image; placeholders for the whole itinerary are resolved with
+    one LLM request. The order of days and activities is preserved.
+    """
+    workers = max(1, int(image_workers or IMAGE_FETCH_WORKERS))
+    processed_details = []
+    pending_images = [] # (activity_processed, future, day_number) in itinerary order
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-fetch") as executor:
+        for day_plan_raw in raw_itinerary_details:
+            day_plan_processed, day_pending_images = _submit_day_images(executor, day_plan_raw, destination, images_dir_path)
+            pending_images.extend(day_pending_images)
+            processed_details.append(day_plan_processed)
+        _collect_day_images(executor, pending_images, destination, images_dir_path)
+
+    return processed_details
+
+def _poi_key(name):
+    """Normalizes a POI/activity name for duplicate detection (case, punctuation and spacing insensitive)."""
+    return re.sub(r'[^\w]+', ' ', str(name).lower()).strip()
+
+def _normalize_skeleton_days(skeleton_days_raw, duration_days):
+    """Returns exactly one {'day', 'theme', 'anchor_pois'} entry per trip day, filling gaps in the LLM skeleton."""
+    by_day = {}
+    if isinstance(skeleton_days_raw, list):
+        for index, day_raw in enumerate(skeleton_days_raw):
+            if not isinstance(day_raw, dict):
+                continue
+            try:
+                day_number = int(day_raw.get("day", index + 1))
+            except (TypeError, ValueError):
+                day_number = index + 1
+            anchors = day_raw.get("anchor_pois")
+            by_day.setdefault(day_number, {
+                "day": day_number,
+                "theme": str(day_raw.get("theme") or "").strip(),
+                "anchor_pois": [str(poi).strip() for poi in anchors if str(poi).strip()] if isinstance(anchors, list) else [],
+            })
+    return [by_day.get(day_number, {"day": day_number, "theme": "", "anchor_pois": []}) for day_number in range(1, duration_days + 1)]
+
+def _build_day_brief(trip_brief, skeleton_day, duration_days, pois_on_other_days):
+    """Builds the per-day part of the prompt asking for one skeleton day's detailed plan (see DAY_TEMPLATE)."""
+    day_number = skeleton_day["day"]
+    prompt = trip_brief + f" You are now planning ONLY day {day_number} of {duration_days}."
+    if skeleton_day["theme"]:
+        prompt += f" The theme for this day is: {skeleton_day['theme']}"
+    if skeleton_day["anchor_pois"]:
+        prompt += f" Build the day around these POIs: {', '.join(skeleton_day['anchor_pois'])}."
+    if pois_on_other_days:
+        prompt += f" These POIs are already planned on other days, do NOT include them: {', '.join(pois_on_other_days)}."
+    prompt += f" Set 'day' to {day_number}."
+    return prompt
+
+def merge_day_plans(day_plans):
+    """
+    Orders day plans by day number and removes activities whose POI already appears
+    on an earlier day (the first occurrence wins). Returns a new list of day plans.
+    """
+    seen_pois = set()
+    merged_days = []
+    for day_plan in sorted(day_plans, key=lambda d: d.get("day", 0)):
+        unique_activities = []
+        activities = day_plan.get("activities")
+        for activity in activities if isinstance(activities, list) else []:
+            poi_key = _poi_key(activity.get("name", "")) if isinstance(activity, dict) else ""
+            if poi_key and poi_key in seen_pois:
+                print(f"Dropping duplicate POI '{activity.get('name')}' from day {day_plan.get('day')}")
+                continue
+            if poi_key:
+                seen_pois.add(poi_key)
+            unique_activities.append(activity)
+        merged_days.append({**day_plan, "activities": unique_activities})
+    return merged_days
+
+def recover_partial_skeleton(raw_text):
+    """partial_parser for skeleton calls: keeps every fully closed outline day of a truncated response."""
+    return recover_truncated_json(raw_text, "days")
+
+def _build_skeleton_continuation_brief(trip_brief, outlined_days, duration_days):
+    """Builds the trip brief for a request that continues a skeleton after its outlined days."""
+    outlined_summary = "; ".join(
+        f"Day {index}: " + ", ".join(str(poi) for poi in (day.get("anchor_pois") if isinstance(day.get("anchor_pois"), list) else []))
+        for index, day in enumerate(outlined_days, start=1)
+    )
+    return trip_brief + (
+        f" Days 1 to {len(outlined_days)} of this {duration_days}-day trip are already outlined ({outlined_summary})."
+        f" Continue the outline: the 'days' list must contain ONLY days {len(outlined_days) + 1} to {duration_days}, numbered accordingly,"
+        " and must not repeat their anchor POIs."
+    )
+
+def get_trip_skeleton(trip_brief, duration_days):
+    """
+    Requests the compact trip skeleton for generate_itinerary_per_day. A truncated response
+    keeps its complete outline days (recover_partial_skeleton) and only the missing days are
+    requested again, up to CONTINUATION_MAX_ROUNDS times; a failed first call is retried the
+    same way. Missing destination and cost fields are taken from the later responses.
+    Returns the skeleton dictionary with its 'days' numbered by position, or None if no day
+    could be outlined.
+    """
+    skeleton = {}
+    days = []
+    for round_number in range(1 + CONTINUATION_MAX_ROUNDS):
+        missing_days = duration_days - len(days)
+        if missing_days <= 0:
+            break
+        if round_number:
+            print(f"Trip skeleton has {len(days)} of {duration_days} days; requesting only the missing days.")
+        brief = _build_skeleton_continuation_brief(trip_brief, days, duration_days) if days else trip_brief
+        max_tokens = max(SKELETON_MAX_TOKENS, SKELETON_TOKENS_PER_DAY * missing_days)
+        response = get_llm_response(SKELETON_TEMPLATE.render(brief), max_tokens=max_tokens, partial_parser=recover_partial_skeleton, caller="itinerary")
+        if not isinstance(response, dict):
+            print("Warning: Trip skeleton request returned nothing usable.")
+            continue
+        new_days = response.get("days") if isinstance(response.get("days"), list) else []
+        for day in [day for day in new_days if isinstance(day, dict)][:missing_days]:
+            day["day"] = len(days) + 1 # Number by position; a continuation may restart at 1
+            days.append(day)
+        for key in ("destination", "estimated_cost", "estimated_daily_meal_cost_per_person"):
+            if not skeleton.get(key) and response.get(key):
+                skeleton[key] = response[key]
+    if not days:
+        return None
+    skeleton["days"] = days
+    return skeleton
+
+def generate_itinerary_per_day(trip_brief, destination_name, duration_days):
+    """
+    Generates an itinerary in two phases: one LLM call for a compact trip skeleton
+    (day themes and anchor POIs), then one concurrent LLM call per day on the shared
+    async LLM client. The day plans are merged, with POIs de-duplicated across days,
+    into the same shape as a single-call response ('destination', 'itinerary', cost fields).
+    Returns that dictionary, or None if no skeleton day could be generated (see
+    get_trip_skeleton) or a day prompt would overflow the model's context.
+    """
+    skeleton = get_trip_skeleton(trip_brief, duration_days)
+    if not skeleton:
+        print("Error: Failed to get trip skeleton from LLM.")
+        return None
+    skeleton_days = _normalize_skeleton_days(skeleton.get("days"), duration_days)
+
+    day_prompts = []
+    day_max_tokens = 0
+    for skeleton_day in skeleton_days:
+        pois_on_other_days = [poi for other in skeleton_days if other["day"] != skeleton_day["day"] for poi in other["anchor_pois"]]
+        day_brief = _build_day_brief(trip_brief, skeleton_day, duration_days, pois_on_other_days)
+        max_tokens, prompt_tokens, fits = plan_token_budget(DAY_TEMPLATE, day_brief, 1)
+        if not fits:
+            print(f"Error: Prompt for day {skeleton_day['day']} ({prompt_tokens} tokens) does not fit the model; not sending it.")
+            return None
+        day_max_tokens = max(day_max_tokens, max_tokens)
+        day_prompts.append(DAY_TEMPLATE.render(day_brief))
+    day_responses = get_llm_responses_concurrently(day_prompts, max_tokens=day_max_tokens, caller="itinerary") # Bounded by llm_api.LLM_MAX_CONCURRENCY
+
+    day_plans = []
+    for skeleton_day, day_plan in zip(skeleton_days, day_responses):
+        if isinstance(day_plan, dict) and isinstance(day_plan.get("itinerary"), list) and day_plan["itinerary"]:
+            day_plan = day_plan["itinerary"][0] # Model wrapped the day in a full itinerary object
+        if not isinstance(day_plan, dict):
+            print(f"Warning: No detailed plan for day {skeleton_day['day']}; keeping the skeleton theme only.")
+            day_plan = {
+                "day_summary": skeleton_day["theme"],
+                "activities": [],
+                "daily_meal_suggestions": {"breakfast": "", "lunch": "", "dinner": ""},
+                "daily_logistical_tips": "",
+            }
+        day_plan["day"] = skeleton_day["day"] # Trust the skeleton numbering over the model's
+        day_plans.append(day_plan)
+
+    return {
+        "destination": skeleton.get("destination", destination_name),
+        "itinerary": merge_day_plans(day_plans),
+        "estimated_cost": skeleton.get("estimated_cost"),
+        "estimated_daily_meal_cost_per_person": skeleton.get("estimated_daily_meal_cost_per_person"),
+    }
+
+def recover_partial_itinerary(raw_text):
+    """partial_parser for itinerary calls: keeps every fully closed day object of a truncated response."""
+    return recover_truncated_json(raw_text, "itinerary")
+
+def _build_continuation_brief(trip_brief, planned_days, duration_days):
+    """Builds the trip brief for a request that continues an itinerary after its planned days."""
+    first_missing_day = len(planned_days) + 1
+    planned_summary = "; ".join(
+        f"Day {index}: " + ", ".join(a.get("name", "") for a in day.get("activities", []) if isinstance(a, dict))
+        for index, day in enumerate(planned_days, start=1)
+    )
+    return trip_brief + (
+        f" Days 1 to {len(planned_days)} of this {duration_days}-day itinerary are already planned ({planned_summary})."
+        f" Continue it: the 'itinerary' list must contain ONLY days {first_missing_day} to {duration_days}, numbered accordingly,"
+        " and must not repeat POIs from the planned days."
+    )
+
+def complete_missing_days(llm_response, trip_brief, duration_days):
+    """
+    Requests only the days missing from an itinerary response (e.g. one salvaged by
+    recover_partial_itinerary after hitting max_tokens) instead of regenerating the whole trip.
+    Missing cost fields are taken from the continuation. Returns the completed response;
+    if the continuation fails, the days received so far are kept.
+    """
+    if not isinstance(llm_response, dict) or not isinstance(llm_response.get("itinerary"), list):
+        return llm_response
+    days = [day for day in llm_response["itinerary"] if isinstance(day, dict)]
+    for _ in range(CONTINUATION_MAX_ROUNDS):
+        if not days or len(days) >= duration_days:
+            break
+        print(f"Itinerary has {len(days)} of {duration_days} days; requesting only the missing days.")
+        continuation_brief = _build_continuation_brief(trip_brief, days, duration_days)
+        max_tokens, _, fits = plan_token_budget(ITINERARY_TEMPLATE, continuation_brief, duration_days - len(days))
+        if not fits:
+            print("Error: Continuation prompt does not fit the model; keeping the days received so far.")
+            break
+        continuation = get_llm_response(ITINERARY_TEMPLATE.render(continuation_brief), max_tokens=max_tokens, partial_parser=recover_partial_itinerary, caller="itinerary")
+        new_days = continuation.get("itinerary") if isinstance(continuation, dict) else None
+        new_days = [day for day in new_days or [] if isinstance(day, dict)][:duration_days - len(days)]
+        if not new_days:
+            print("Warning: Continuation request returned no days; keeping the days received so far.")
+            break
+        for day in new_days:
+            day["day"] = len(days) + 1 # Number by position; the model may restart at 1
+            days.append(day)
+        for key in ("estimated_cost", "estimated_daily_meal_cost_per_person"):
+            if not llm_response.get(key) and continuation.get(key):
+                llm_response[key] = continuation[key]
+    llm_response["itinerary"] = days
+    return llm_response
+
+@telemetry.traced("prompt_build")
+def build_trip_brief(preferences):
+    """
+    Builds the user-specific part of the itinerary prompt from the preferences.
+    Returns (trip_brief, trip): the prompt text and a dictionary with the normalized
+    trip facts ('destination_name', 'from_date', 'to_date', 'duration_days', 'num_travellers').
     """
-    # 1. Construct the prompt for the LLM (logic moved from app.py)
     prompt_parts = []
     destination_name = preferences.get('destination', 'a nice place')
     from_date = preferences.get('from_date') # Expected to be datetime.date object
@@ -129,6 +629,17 @@ def create_travel_itinerary(preferences):
     
     prompt_parts.append("Based STRICTLY on these user-provided details, generate a detailed day-by-day travel itinerary.")
 
+    candidate_pois = poi_index.find_candidate_pois(destination_name, interests, additional_prefs, POI_CANDIDATES_LIMIT) if POI_CANDIDATES_LIMIT else []
+    if candidate_pois:
+        prompt_parts.append(
+            "Candidate points of interest from our local database for this destination "
+            "(prefer these where they fit the user's interests, reuse their names exactly and keep their descriptions short):"
+        )
+        for number, poi in enumerate(candidate_pois, start=1):
+            categories = f" ({', '.join(poi['categories'])})" if poi["categories"] else ""
+            description = poi["description"][:POI_CANDIDATE_DESCRIPTION_CHARS]
+            prompt_parts.append(f"{number}. {poi['name']}{categories}{' - ' + description if description else ''};")
+
     destination_lower = str(destination_name).lower()
     interests_lower = [str(i).lower() for i in interests if isinstance(i, str)] if interests else []
 
@@ -146,46 +657,32 @@ def create_travel_itinerary(preferences):
         if "mountain" not in destination_lower:
             prompt_parts.append("Focus on mountain activities.")
 
-    final_prompt = " ".join(prompt_parts)
-    final_prompt += (
-        " IMPORTANT: Respond *only* with a single, valid JSON object. Do not include any text or explanation before or after the JSON. "
-        "The JSON object must have the following top-level keys: "
-        "1. 'destination': A string with the name of the destination (e.g., \"Paris, France\"). "
-        "2. 'itinerary': A list of objects. Each object represents a single day's plan and *must* have the following keys: "
-        "   a. 'day': (integer) The day number (e.g., 1). "
-        "   b. 'day_summary': (string) A brief overall summary for the day's theme or main focus. "
-        # "   c. 'image_url': (string) A publicly accessible, royalty-free (if possible) direct URL to a general image representing the day. Use an empty string if no suitable image is found. " # REMOVED
-        "   c. 'activities': (list of objects) Each object in this list represents a specific POI or activity for the day and *must* include: " # Note: 'c' was 'd'
-        "      i. 'name': (string) Name of the POI or activity (e.g., \"Eiffel Tower Visit\"). "
-        "      ii. 'time_of_day': (string) Suggested time (e.g., \"Morning\", \"9:00 AM - 12:00 PM\", \"Afternoon\"). "
-        "      iii. 'description': (string) A detailed description of the POI/activity. "
-        "      iv. 'why_relevant': (string) Reason why this POI/activity is included or interesting. "
-        "      v. 'estimated_duration': (string) Estimated time to spend (e.g., \"2-3 hours\"). "
-        "      vi. 'estimated_cost': (string) Estimated cost (e.g., \"€25 per person\", \"Free\", \"$$ - Moderate\"). "
-        "      vii. 'poi_image_url': (string, optional) A direct URL to an image specific to this POI/activity. Use an empty string if not available. "
-        "   e. 'daily_meal_suggestions': (object) An object with keys 'breakfast', 'lunch', and 'dinner'. Each key should have a string value with a suggestion for that meal. If a meal suggestion isn't applicable or available, use an empty string for its value. Example: {\"breakfast\": \"Hotel breakfast or local bakery.\", \"lunch\": \"Cafe near museum.\", \"dinner\": \"Traditional restaurant for pasta.\"} "
-        "   f. 'daily_logistical_tips': (string) Any logistical tips for the day (e.g., \"Book museum tickets online. Wear comfortable shoes.\"). "
-        "3. 'estimated_cost': A string describing the overall estimated cost for the trip *excluding meals* (e.g., for accommodation, activities, local transport: \"$1000 - $1500 for 2 people\"). "
-        "4. 'estimated_daily_meal_cost_per_person': A string representing a typical daily cost for three meals per person (e.g., \"$50-70 USD\", \"€40-60 EUR\"). This should align with the user's budget preference. "
-        "Example of a day object within the 'itinerary' list: "
-        "{\"day\": 1, \"day_summary\": \"Exploring iconic Parisian landmarks.\", "
-        " \"activities\": [{\"name\": \"Eiffel Tower\", \"time_of_day\": \"Morning\", \"description\": \"Visit the iconic tower.\", \"why_relevant\": \"Symbol of Paris.\", \"estimated_duration\": \"2-3 hours\", \"estimated_cost\": \"€25\", \"poi_image_url\": \"https://example.com/eiffel.jpg\"}], "
-        " \"daily_meal_suggestions\": {\"breakfast\": \"Croissants and coffee.\", \"lunch\": \"Crepes from a street vendor.\", \"dinner\": \"Romantic bistro meal.\"}, \"daily_logistical_tips\": \"Book Eiffel Tower tickets online to avoid queues.\"} "
-        "The number of day objects in the 'itinerary' list should match the trip duration."
-    )
-    
-    # 2. Call the LLM
-    llm_response = get_llm_response(final_prompt)
-    if not llm_response: # Basic check if LLM failed
-        print("Error: Failed to get itinerary from LLM.")
-        return None, None # Indicate failure
+    trip = {
+        "destination_name": destination_name,
+        "from_date": from_date,
+        "to_date": to_date,
+        "duration_days": duration_days,
+        "num_travellers": num_travellers,
+    }
+    trip_brief = " ".join(prompt_parts)
+    telemetry.annotate(bytes=len(trip_brief.encode("utf-8")), candidate_pois=len(candidate_pois))
+    return trip_brief, trip
+
+@telemetry.traced("cost_parse")
+def adapt_llm_response(llm_response, trip):
+    """
+    Converts the LLM's top-level response into the adapted_itinerary structure used by
+    the app (dates, duration, cost fields and computed total meal cost). 'details' is left
+    empty; callers fill it once images are processed.
+    """
+    duration_days = trip["duration_days"]
+    num_travellers = trip["num_travellers"]
 
-    # 3. Adapt LLM response (logic moved from app.py)
     # Initialize adapted_itinerary with basic structure
     adapted_itinerary = {
-        "destination": llm_response.get("destination", destination_name),
-        "from_date": from_date.strftime('%Y-%m-%d') if from_date and hasattr(from_date, 'strftime') else None,
-        "to_date": to_date.strftime('%Y-%m-%d') if to_date and hasattr(to_date, 'strftime') else None,
+        "destination": llm_response.get("destination", trip["destination_name"]),
+        "from_date": trip["from_date"].strftime('%Y-%m-%d') if trip["from_date"] and hasattr(trip["from_date"], 'strftime') else None,
+        "to_date": trip["to_date"].strftime('%Y-%m-%d') if trip["to_date"] and hasattr(trip["to_date"], 'strftime') else None,
         "duration": duration_days,
         "num_travellers": num_travellers,
         "details": [], # Will be populated after image processing
@@ -208,64 +705,337 @@ def create_travel_itinerary(preferences):
             total_estimated_meal_cost_str = f"{currency_symbol}{total_meal_cost:.2f} for {num_travellers} person(s) over {duration_days} day(s)"
             adapted_itinerary["total_estimated_meal_cost"] = total_estimated_meal_cost_str
             print(f"Calculated total meal cost: {total_estimated_meal_cost_str}")
+            telemetry.annotate(meal_cost_parsed=True)
         else:
             # If no numbers found, but string exists, store it as is for display
             adapted_itinerary["total_estimated_meal_cost"] = f"Approx. {daily_meal_cost_str} per person/day (total for {num_travellers} over {duration_days} days not auto-calculated)"
 
+    return adapted_itinerary
 
-    # Create images directory
-    images_dir_path = os.path.join(OUTPUT_DIR, IMAGES_SUBDIR)
-    os.makedirs(images_dir_path, exist_ok=True)
-
-    raw_itinerary_details = llm_response.get("itinerary", [])
-    processed_details = []
-
-    for day_plan_raw in raw_itinerary_details:
-        day_plan_processed = day_plan_raw.copy() # Start with a copy
-        
-        # Ensure 'image_url' for the day is not processed or added if it's not in the raw LLM response
-        if "image_url" in day_plan_processed:
-            del day_plan_processed["image_url"] # Remove it if LLM somehow still provides it
-
-        processed_activities = []
-        if "activities" in day_plan_raw and isinstance(day_plan_raw["activities"], list):
-            for activity_raw in day_plan_raw["activities"]:
-                activity_processed = activity_raw.copy()
-                poi_image_url_original = activity_raw.get("poi_image_url")
-                local_poi_image_path_activity = None
-                activity_name_sanitized = sanitize_foldername(activity_raw.get("name", "poi"))
-                poi_image_filename_base_activity = f"{adapted_itinerary['destination']}_day_{day_plan_raw.get('day', 'unknown')}_{activity_name_sanitized}"
-
-                if poi_image_url_original:
-                    local_poi_image_path_activity = download_image(poi_image_url_original, images_dir_path, poi_image_filename_base_activity)
-
-                if not local_poi_image_path_activity: # If original POI URL failed or was empty, try placeholder
-                    print(f"Attempting to get placeholder for POI image: {activity_raw.get('name', 'Activity')} in {adapted_itinerary['destination']}")
-                    placeholder_desc_poi = f"an image representing {activity_raw.get('name', 'an activity')} in {adapted_itinerary['destination']}"
-                    placeholder_poi_url = get_llm_placeholder_image_url(placeholder_desc_poi)
-                    if placeholder_poi_url:
-                        local_poi_image_path_activity = download_image(placeholder_poi_url, images_dir_path, f"{poi_image_filename_base_activity}_placeholder")
-                
-                activity_processed["poi_image_url"] = local_poi_image_path_activity if local_poi_image_path_activity else ""
-                processed_activities.append(activity_processed)
-        day_plan_processed["activities"] = processed_activities
-        processed_details.append(day_plan_processed)
-    
-    adapted_itinerary["details"] = processed_details
-
-    # 4. Save the generated itinerary (with local image paths)
+@telemetry.traced("save")
+def save_itinerary(adapted_itinerary, output_dir=None):
+    """
+    Saves the itinerary (with local image paths) as JSON under output_dir (default OUTPUT_DIR).
+    Returns the saved path, or None on failure.
+    """
     try:
         output_filename_leaf = "Generated_Output.json"
-        output_filepath = os.path.join(OUTPUT_DIR, output_filename_leaf)
+        output_filepath = os.path.join(output_dir or OUTPUT_DIR, output_filename_leaf)
         
         with open(output_filepath, 'w', encoding='utf-8') as f:
             json.dump(adapted_itinerary, f, indent=4, ensure_ascii=False)
         print(f"Successfully saved itinerary with local image paths to {output_filepath}")
-        return adapted_itinerary, output_filepath
+        telemetry.annotate(bytes=os.path.getsize(output_filepath))
+        return output_filepath
         
     except Exception as e:
         print(f"Error saving itinerary: {e}")
-        return adapted_itinerary, None # Return data even if save fails, but no path
+        return None
+
+def _parse_date(value):
+    if isinstance(value, str) and value.strip():
+        try:
+            return datetime.date.fromisoformat(value.strip())
+        except ValueError:
+            print(f"Warning: Ignoring invalid date '{value}'")
+    return None
+
+def to_pipeline_preferences(preferences):
+    """
+    Converts a JSON preference set (batch input lines, queued jobs) into the shape
+    create_travel_itinerary expects (date objects, duration).
+    """
+    converted = dict(preferences)
+    converted["from_date"] = _parse_date(preferences.get("from_date"))
+    converted["to_date"] = _parse_date(preferences.get("to_date"))
+    if converted["from_date"] and converted["to_date"]:
+        converted["duration"] = (converted["to_date"] - converted["from_date"]).days + 1
+    return converted
+
+@telemetry.traced("itinerary")
+def create_travel_itinerary(preferences, image_workers=None, generation_mode=None, output_dir=None):
+    """
+    Generates a travel itinerary based on preferences, calls LLM,
+    adapts the response, and saves it to a structured output path.
+    Activity images are fetched concurrently; image_workers overrides IMAGE_FETCH_WORKERS.
+    generation_mode (or preferences['generation_mode']) selects "single", "parallel_days"
+    or "auto"; see generate_itinerary_per_day. Defaults to DEFAULT_GENERATION_MODE.
+    Files are written to output_dir, or to a new output_store request directory when it is
+    None, so concurrent runs never share files.
+    LLM usage is recorded under preferences['request_id'] (or a new id) and limited to
+    preferences['token_budget'] (default ITINERARY_TOKEN_BUDGET) tokens.
+    Concurrent calls with identical preferences (see itinerary_request_key) share one
+    generation; the callers that joined it get a copy saved to their own output_dir.
+    Returns the itinerary data and the path where it was saved.
+    """
+    with _request_scope(preferences):
+        key = itinerary_request_key(preferences, generation_mode)
+        (adapted_itinerary, output_filepath), joined = _itinerary_flights.do(key, _generate_travel_itinerary, preferences, image_workers, generation_mode, output_dir)
+        if not joined or not adapted_itinerary:
+            return adapted_itinerary, output_filepath
+        print(f"Joined an identical in-flight itinerary request for {adapted_itinerary.get('destination')}.")
+        telemetry.annotate(coalesced=True)
+        return _adopt_shared_itinerary(adapted_itinerary, output_dir)
+
+def itinerary_request_key(preferences, generation_mode=None):
+    """
+    Returns the single-flight key of an itinerary request: the preferences that shape the prompt
+    with case, whitespace and interest order normalized, plus the generation mode and token
+    budget. 'request_id' and output locations are not part of it.
+    """
+    def normalize(value):
+        return " ".join(str(value).split()).lower() if value is not None else None
+
+    from_date, to_date = preferences.get('from_date'), preferences.get('to_date')
+    key = {
+        "destination": normalize(preferences.get('destination')),
+        "dates": [value.isoformat() if hasattr(value, "isoformat") else normalize(value) for value in (from_date, to_date)],
+        "duration": None if from_date and to_date else normalize(preferences.get('duration', 7)),
+        "num_travellers": normalize(preferences.get('num_travellers', 1)),
+        "interests": sorted(normalize(interest) for interest in preferences.get("interests") or []),
+        "budget": normalize(preferences.get("budget")),
+        "additional_prefs": normalize(preferences.get("additional_prefs")),
+        "generation_mode": generation_mode or preferences.get("generation_mode") or DEFAULT_GENERATION_MODE,
+        "token_budget": preferences.get("token_budget", ITINERARY_TOKEN_BUDGET),
+    }
+    return json.dumps(key, sort_keys=True)
+
+def _link_day_images(day_plan, images_dir_path):
+    """
+    Points a copied day plan at images_dir_path: local images of the request that produced it
+    are linked into that directory (see image_cache.link_cached_image) and the paths rewritten.
+    """
+    for activity in day_plan.get("activities") or []:
+        image_path = activity.get("poi_image_url") if isinstance(activity, dict) else None
+        if image_path and os.path.isfile(image_path):
+            activity["poi_image_url"] = image_cache.link_cached_image(image_path, os.path.join(images_dir_path, os.path.basename(image_path)))
+
+def _adopt_shared_event(event, output_dir, images_dir_path):
+    """Copies a stream event of a joined identical request into this request's directory; the final itinerary is saved there too."""
+    event = copy.deepcopy(event)
+    if event.get("event") in ("day", "day_images"):
+        _link_day_images(event["day"], images_dir_path)
+    elif event.get("event") == "complete":
+        for day_plan in event["itinerary"].get("details", []):
+            _link_day_images(day_plan, images_dir_path)
+        event["saved_path"] = save_itinerary(event["itinerary"], output_dir)
+    return event
+
+def _adopt_shared_itinerary(adapted_itinerary, output_dir):
+    """Saves a copy of an itinerary generated by a joined identical request to output_dir (or a new request directory). Returns (itinerary, saved_path)."""
+    owns_output_dir = output_dir is None
+    if owns_output_dir:
+        _, output_dir = output_store.create_request_dir()
+    try:
+        images_dir_path = os.path.join(output_dir, IMAGES_SUBDIR)
+        os.makedirs(images_dir_path, exist_ok=True)
+        event = _adopt_shared_event({"event": "complete", "itinerary": adapted_itinerary}, output_dir, images_dir_path)
+        return event["itinerary"], event["saved_path"]
+    finally:
+        if owns_output_dir:
+            output_store.release_request_dir(output_dir)
+
+@contextlib.contextmanager
+def _request_scope(preferences):
+    """Opens the usage_ledger.request_scope of one itinerary and tags the current span with its id."""
+    request_id = preferences.get("request_id") or output_store.new_request_id()
+    with usage_ledger.request_scope(request_id, preferences.get("token_budget", ITINERARY_TOKEN_BUDGET)) as budget:
+        telemetry.annotate(request_id=budget.request_id)
+        yield budget
+
+def _generate_travel_itinerary(preferences, image_workers, generation_mode, output_dir):
+    """Body of create_travel_itinerary, run inside the request's usage scope."""
+    # 1. Construct the prompt for the LLM (logic moved from app.py)
+    trip_brief, trip = build_trip_brief(preferences)
+    destination_name = trip["destination_name"]
+    duration_days = trip["duration_days"]
+    
+    # 2. Call the LLM, either once for the whole trip or once per day in parallel
+    generation_mode = generation_mode or preferences.get("generation_mode") or DEFAULT_GENERATION_MODE
+    if generation_mode == "auto":
+        generation_mode = "parallel_days" if duration_days >= PARALLEL_DAYS_MIN_DURATION else "single"
+
+    # Output budget sized from the trip length; a trip too long for one response is split per day
+    max_tokens, prompt_tokens, fits = plan_token_budget(ITINERARY_TEMPLATE, trip_brief, duration_days)
+    if generation_mode != "parallel_days" and not fits:
+        print(f"A {duration_days}-day itinerary does not fit a single response ({prompt_tokens} prompt tokens); generating it per day.")
+        generation_mode = "parallel_days"
+    telemetry.annotate(destination=destination_name, duration_days=duration_days, generation_mode=generation_mode, estimated_prompt_tokens=prompt_tokens)
+
+    if generation_mode == "parallel_days":
+        llm_response = generate_itinerary_per_day(trip_brief, destination_name, duration_days)
+        if not llm_response and fits:
+            print("Per-day generation failed; falling back to a single itinerary call.")
+            telemetry.annotate(fallback="single")
+            generation_mode = "single"
+    if generation_mode != "parallel_days":
+        llm_response = get_llm_response(ITINERARY_TEMPLATE.render(trip_brief), max_tokens=max_tokens, partial_parser=recover_partial_itinerary, caller="itinerary")
+        llm_response = complete_missing_days(llm_response, trip_brief, duration_days)
+    if not llm_response: # Basic check if LLM failed
+        print("Error: Failed to get itinerary from LLM.")
+        telemetry.annotate(outcome="failed")
+        return None, None # Indicate failure
+
+    # 3. Adapt LLM response (logic moved from app.py)
+    adapted_itinerary = adapt_llm_response(llm_response, trip)
+
+    # Create images directory (in a fresh request directory unless the caller chose one)
+    owns_output_dir = output_dir is None
+    if owns_output_dir:
+        _, output_dir = output_store.create_request_dir()
+    try:
+        images_dir_path = os.path.join(output_dir, IMAGES_SUBDIR)
+        os.makedirs(images_dir_path, exist_ok=True)
+
+        raw_itinerary_details = llm_response.get("itinerary", [])
+        processed_details = process_itinerary_images(raw_itinerary_details, adapted_itinerary['destination'], images_dir_path, image_workers)
+
+        adapted_itinerary["details"] = processed_details
+
+        # 4. Save the generated itinerary (with local image paths)
+        output_filepath = save_itinerary(adapted_itinerary, output_dir)
+    finally:
+        if owns_output_dir:
+            output_store.release_request_dir(output_dir)
+    return adapted_itinerary, output_filepath # Return data even if save fails, but no path
+
+def stream_travel_itinerary(preferences, image_workers=None, output_dir=None):
+    """
+    Streaming variant of create_travel_itinerary (single-call generation, same output_dir
+    handling). The completion is streamed and parsed incrementally, so each day is available
+    as soon as the LLM closes its JSON object, and its images start downloading while later
+    days are still being generated. Trips too long for one response are generated per day
+    and their days emitted once complete.
+    Yields event dictionaries:
+      {"event": "day", "index": i, "day": day_plan}        - day text; 'poi_image_url' values are still empty
+      {"event": "day_images", "index": i, "day": day_plan} - the same day once its images are stored locally
+      {"event": "complete", "itinerary": adapted_itinerary, "saved_path": path_or_None}
+      {"event": "error", "message": str}                   - nothing usable was generated
+    Concurrent streams with identical preferences share one generation, as in create_travel_itinerary.
+    """
+    with telemetry.span("itinerary_stream"), _request_scope(preferences):
+        yield from _coalesced_stream(preferences, image_workers, output_dir)
+
+def _coalesced_stream(preferences, image_workers, output_dir):
+    """
+    Runs _stream_travel_itinerary through _itinerary_stream_flights. A request that joins an
+    identical stream copies each event into its own output directory as it arrives, and
+    generates the itinerary itself if the leading request stops early.
+    """
+    key = itinerary_request_key(preferences, "stream")
+    events = _itinerary_stream_flights.stream(key, lambda output_dir=output_dir: _stream_travel_itinerary(preferences, image_workers, output_dir))
+    owns_output_dir = output_dir is None
+    images_dir_path = None # Created with the first joined event
+    try:
+        for event, joined in events:
+            if not joined:
+                yield event
+                continue
+            if images_dir_path is None:
+                if owns_output_dir:
+                    _, output_dir = output_store.create_request_dir()
+                images_dir_path = os.path.join(output_dir, IMAGES_SUBDIR)
+                os.makedirs(images_dir_path, exist_ok=True)
+                print("Joined an identical in-flight itinerary stream.")
+                telemetry.annotate(coalesced=True)
+            yield _adopt_shared_event(event, output_dir, images_dir_path)
+    except FlightAbandoned as e:
+        print(f"{e} Generating the itinerary for this request instead.")
+        yield from _stream_travel_itinerary(preferences, image_workers, output_dir) # Re-emits days by index; consumers replace them
+    finally:
+        events.close()
+        if owns_output_dir and images_dir_path is not None:
+            output_store.release_request_dir(output_dir)
+
+def _stream_travel_itinerary(preferences, image_workers, output_dir):
+    """Generator behind stream_travel_itinerary, run inside its 'itinerary_stream' span."""
+    trip_brief, trip = build_trip_brief(preferences)
+    max_tokens, prompt_tokens, fits = plan_token_budget(ITINERARY_TEMPLATE, trip_brief, trip["duration_days"])
+    telemetry.annotate(destination=trip["destination_name"], duration_days=trip["duration_days"], estimated_prompt_tokens=prompt_tokens)
+    if not fits: # Too long for one streamed response: generate per day, then emit the finished days
+        print(f"A {trip['duration_days']}-day itinerary does not fit a single response ({prompt_tokens} prompt tokens); generating it per day.")
+        adapted_itinerary, output_filepath = create_travel_itinerary(preferences, image_workers, "parallel_days", output_dir)
+        if not adapted_itinerary:
+            yield {"event": "error", "message": "Failed to get itinerary from LLM."}
+            return
+        for index, day_plan in enumerate(adapted_itinerary.get("details", [])):
+            yield {"event": "day_images", "index": index, "day": copy.deepcopy(day_plan)}
+        yield {"event": "complete", "itinerary": adapted_itinerary, "saved_path": output_filepath}
+        return
+    final_prompt = ITINERARY_TEMPLATE.render(trip_brief)
+    destination = trip["destination_name"] # The LLM's 'destination' is only known once the response is complete
+
+    owns_output_dir = output_dir is None
+    if owns_output_dir:
+        _, output_dir = output_store.create_request_dir()
+    try:
+        images_dir_path = os.path.join(output_dir, IMAGES_SUBDIR)
+        os.makedirs(images_dir_path, exist_ok=True)
+
+        day_stream = JSONArrayItemStream("itinerary")
+        days = [] # [day_plan_processed, pending_images, images_emitted] in itinerary order
+        raw_days = [] # The LLM's day objects, for continuing a truncated itinerary
+
+        def submit_day(executor, day_plan_raw):
+            raw_days.append(day_plan_raw)
+            day_plan_processed, pending_images = _submit_day_images(executor, day_plan_raw, destination, images_dir_path)
+            days.append([day_plan_processed, pending_images, False])
+            return {"event": "day", "index": len(days) - 1, "day": copy.deepcopy(day_plan_processed)}
+
+        missing_images = [] # (activity_processed, day_number) awaiting a placeholder, across all days
+        placeholder_days = [] # Indexes of days re-emitted once their placeholders are resolved
+
+        def finished_day_events(wait):
+            for index, day_entry in enumerate(days):
+                day_plan_processed, pending_images, images_emitted = day_entry
+                if images_emitted:
+                    continue
+                if not wait and not all(future.done() for _, future, _ in pending_images):
+                    continue
+                day_missing_images = _await_day_images(pending_images)
+                if day_missing_images:
+                    missing_images.extend(day_missing_images)
+                    placeholder_days.append(index)
+                day_entry[2] = True
+                yield {"event": "day_images", "index": index, "day": copy.deepcopy(day_plan_processed)}
+            if wait and missing_images: # One placeholder request for the whole itinerary
+                _resolve_placeholder_images(executor, missing_images, destination, images_dir_path)
+                for index in placeholder_days:
+                    yield {"event": "day_images", "index": index, "day": copy.deepcopy(days[index][0])}
+
+        workers = max(1, int(image_workers or IMAGE_FETCH_WORKERS))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-fetch") as executor:
+            for text_chunk in stream_llm_response(final_prompt, max_tokens=max_tokens, caller="itinerary"):
+                for day_plan_raw in day_stream.feed(text_chunk):
+                    if isinstance(day_plan_raw, dict):
+                        yield submit_day(executor, day_plan_raw)
+                yield from finished_day_events(wait=False)
+
+            llm_response = day_stream.result()
+            if not days and isinstance(llm_response, dict): # 'itinerary' was nested differently than expected
+                for day_plan_raw in llm_response.get("itinerary", []) or []:
+                    if isinstance(day_plan_raw, dict):
+                        yield submit_day(executor, day_plan_raw)
+            if not days:
+                print("Error: Failed to get itinerary from LLM.")
+                yield {"event": "error", "message": "Failed to get itinerary from LLM."}
+                return
+            if not isinstance(llm_response, dict):
+                print(f"Warning: Streamed itinerary was incomplete; keeping the {len(days)} day(s) received.")
+                llm_response = recover_truncated_json(day_stream.buffer, "itinerary") or {}
+            if len(days) < trip["duration_days"]: # Truncated or short: ask only for the missing days
+                llm_response = complete_missing_days(dict(llm_response, itinerary=list(raw_days)), trip_brief, trip["duration_days"])
+                for day_plan_raw in llm_response["itinerary"][len(days):]:
+                    yield submit_day(executor, day_plan_raw)
+            yield from finished_day_events(wait=True)
+
+        adapted_itinerary = adapt_llm_response(llm_response, trip)
+        adapted_itinerary["details"] = [day_entry[0] for day_entry in days]
+        output_filepath = save_itinerary(adapted_itinerary, output_dir)
+        yield {"event": "complete", "itinerary": adapted_itinerary, "saved_path": output_filepath}
+    finally:
+        if owns_output_dir:
+            output_store.release_request_dir(output_dir)
 
 # Example of how this pipeline might be run from a script (optional, for testing)
 def main_cli():
@@ -0,0 +1,133 @@
+# poi_dataset.py
+# Compact, indexed SQLite form of the POI dataset (Dataset/Dataset.CSV), replacing the
+# pretty-printed input/Dataset.json for readers that only need some columns.
+# Layout of input/Dataset.sqlite3:
+#   pois(id, <one TEXT column per CSV column except 'category'>) - a CSV 'id' column is stored as
+#                                            source_id and read back as 'id' by iter_pois
+#   categories(id, name)                   - every distinct category string stored once
+#   poi_categories(poi_id, category_id)    - the pipe-delimited 'category' field, split
+#
+# Usage:
+#   python poi_dataset.py [Dataset/Dataset.CSV] [input/Dataset.sqlite3]
+import csv
+import os
+import sqlite3
+import sys
+import uuid
+
+DATASET_CSV_PATH = os.path.join('Dataset', 'Dataset.CSV')
+DATASET_DB_PATH = os.path.join('input', 'Dataset.sqlite3')
+CATEGORY_COLUMN = 'category' # Pipe-delimited, e.g. "Museum | History"
+SOURCE_ID_COLUMN = 'source_id' # Stores the CSV's own 'id' column, which would collide with pois.id
+INSERT_BATCH_SIZE = 1000 # Rows buffered per executemany while streaming the CSV
+
+def _quote(identifier):
+    """Quotes a CSV header for use as an SQLite column name."""
+    return '"' + identifier.replace('"', '""') + '"'
+
+def _stored_column(csv_column):
+    """Name of the pois column holding csv_column (SQLite column names are case-insensitive)."""
+    return SOURCE_ID_COLUMN if csv_column.lower() == 'id' else csv_column
+
+def split_categories(categories_str):
+    if not categories_str or not isinstance(categories_str, str):
+        return []
+    return [cat.strip() for cat in categories_str.split('|') if cat.strip()]
+
+def convert_csv_to_sqlite(csv_path=DATASET_CSV_PATH, db_path=DATASET_DB_PATH):
+    """
+    Streams csv_path row by row into a new SQLite file at db_path (written to a temporary file
+    and moved into place, so readers never see a half-written dataset). Category strings are
+    interned in the categories table. Returns the number of POIs written.
+    """
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    tmp_path = f"{db_path}.{uuid.uuid4().hex[:8]}.tmp"
+    conn = sqlite3.connect(tmp_path)
+    try:
+        with open(csv_path, mode='r', encoding='utf-8', newline='') as csv_file:
+            csv_reader = csv.DictReader(csv_file)
+            columns = [name for name in (csv_reader.fieldnames or []) if name and name != CATEGORY_COLUMN]
+            stored_columns = [_stored_column(c) for c in columns]
+            conn.execute(f"CREATE TABLE pois (id INTEGER PRIMARY KEY{''.join(f', {_quote(c)} TEXT' for c in stored_columns)})")
+            conn.execute("CREATE TABLE categories (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)")
+            conn.execute("CREATE TABLE poi_categories (poi_id INTEGER NOT NULL, category_id INTEGER NOT NULL, PRIMARY KEY (poi_id, category_id)) WITHOUT ROWID")
+
+            insert_poi = f"INSERT INTO pois (id{''.join(f', {_quote(c)}' for c in stored_columns)}) VALUES (?{', ?' * len(columns)})"
+            category_ids = {} # name -> id, kept in memory; the number of distinct categories is small
+            poi_rows, link_rows = [], []
+            poi_count = 0
+            for poi_count, row in enumerate(csv_reader, start=1):
+                poi_rows.append([poi_count] + [row.get(c) for c in columns])
+                for category in split_categories(row.get(CATEGORY_COLUMN)):
+                    if category not in category_ids:
+                        category_ids[category] = len(category_ids) + 1
+                        conn.execute("INSERT INTO categories (id, name) VALUES (?, ?)", (category_ids[category], category))
+                    link_rows.append((poi_count, category_ids[category]))
+                if len(poi_rows) >= INSERT_BATCH_SIZE:
+                    conn.executemany(insert_poi, poi_rows)
+                    conn.executemany("INSERT OR IGNORE INTO poi_categories VALUES (?, ?)", link_rows)
+                    poi_rows, link_rows = [], []
+            conn.executemany(insert_poi, poi_rows)
+            conn.executemany("INSERT OR IGNORE INTO poi_categories VALUES (?, ?)", link_rows)
+        conn.execute("CREATE INDEX idx_poi_categories_category ON poi_categories (category_id)")
+        conn.commit()
+        conn.close()
+        os.replace(tmp_path, db_path)
+        return poi_count
+    finally:
+        conn.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _connect_readonly(db_path):
+    return sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+
+def load_categories(db_path=DATASET_DB_PATH):
+    """Returns the sorted list of distinct categories without touching any other column."""
+    conn = _connect_readonly(db_path)
+    try:
+        return [name for (name,) in conn.execute("SELECT name FROM categories ORDER BY name")]
+    finally:
+        conn.close()
+
+def iter_pois(columns=None, category=None, db_path=DATASET_DB_PATH):
+    """
+    Yields POIs as dictionaries holding only the requested columns (all columns if None).
+    Requesting CATEGORY_COLUMN rebuilds the pipe-delimited string; category restricts the
+    result to POIs tagged with that category.
+    """
+    conn = _connect_readonly(db_path)
+    try:
+        stored = {} # Column name as in the CSV -> pois column
+        for info in conn.execute("PRAGMA table_info(pois)"):
+            if info[1] != 'id':
+                stored['id' if info[1] == SOURCE_ID_COLUMN else info[1]] = info[1]
+        wanted = list(stored) + [CATEGORY_COLUMN] if columns is None else list(columns)
+        plain = [c for c in wanted if c in stored]
+        select = [f"p.{_quote(stored[c])}" for c in plain]
+        if CATEGORY_COLUMN in wanted: # Sorted by name so the rebuilt string does not depend on storage order
+            select.append(
+                "(SELECT group_concat(name, ' | ') FROM (SELECT c.name FROM poi_categories pc JOIN categories c ON c.id = pc.category_id"
+                " WHERE pc.poi_id = p.id ORDER BY c.name))"
+            )
+        query = f"SELECT {', '.join(select) or 'p.id'} FROM pois p"
+        params = ()
+        if category is not None:
+            query += " WHERE p.id IN (SELECT pc.poi_id FROM poi_categories pc JOIN categories c ON c.id = pc.category_id WHERE c.name = ?)"
+            params = (category,)
+        names = plain + ([CATEGORY_COLUMN] if CATEGORY_COLUMN in wanted else [])
+        for values in conn.execute(query + " ORDER BY p.id", params):
+            yield dict(zip(names, values))
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else DATASET_CSV_PATH
+    db_path = sys.argv[2] if len(sys.argv) > 2 else DATASET_DB_PATH
+    try:
+        count = convert_csv_to_sqlite(csv_path, db_path)
+        print(f"Successfully converted {count} POIs from {csv_path} to {db_path}")
+    except FileNotFoundError:
+        print(f"Error: The file {csv_path} was not found.")
+    except (csv.Error, sqlite3.Error) as e:
+        print(f"An error occurred while converting {csv_path}: {e}")
@@ -0,0 +1,231 @@
+# poi_index.py
+# In-process retrieval index over the POI dataset, used to ground itinerary prompts in known
+# POIs so the LLM mostly picks and sequences instead of inventing everything from scratch.
+#   by_city           - normalized city name -> POI ids, in dataset order
+#   by_city_category  - (city, normalized category) -> {POI id: CATEGORY_MATCH_BOOST}, in id order
+#   city_postings     - city -> term -> {POI id: BM25 weight} over name/category/description,
+#                       ordered by descending weight
+# Weights are computed once at build time and every list is ordered best-first, so a query reads
+# its lists in parallel and stops as soon as no unread POI can enter the top results (Fagin's
+# threshold algorithm): its cost depends on how quickly the best matches separate from the rest,
+# not on the size of the city or of the whole dataset. The index is built in the background at
+# startup (start_background_build) so the first prompt does not wait for it.
+import heapq
+from collections import Counter
+from operator import itemgetter
+import json
+import math
+import os
+import re
+import threading
+import poi_dataset
+
+DATASET_JSON_PATH = os.path.join("input", "Dataset.json") # Used when the SQLite dataset is absent
+NAME_FIELDS = ("name", "poi_name", "title") # First non-empty one is the POI's display name
+CITY_FIELDS = ("city", "destination", "location")
+DESCRIPTION_FIELDS = ("description", "short_description", "summary")
+BM25_K1 = 1.2
+BM25_B = 0.75
+CATEGORY_MATCH_BOOST = 2.0 # Added per requested interest the POI is tagged with
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+def tokenize(text):
+    return _TOKEN_RE.findall(str(text).lower()) if text else []
+
+def normalize_city(name):
+    """'Paris, France' and ' paris ' both map to 'paris'."""
+    return str(name).split(',')[0].strip().lower() if name else ""
+
+def _first_field(poi, fields):
+    for field in fields:
+        value = poi.get(field)
+        if isinstance(value, str) and value.strip():
+            return value.strip()
+    return ""
+
+class POIIndex:
+    """Inverted indexes by city and category plus per-city BM25 postings over an iterable of POI dictionaries."""
+
+    def __init__(self, pois):
+        self.pois = [] # id -> (name, city, categories tuple, description)
+        self.by_city = {}
+        self.by_city_category = {}
+        self.city_postings = {} # Holds [(POI id, term frequency)] until _weigh_postings runs
+        self._doc_lengths = []
+        for poi in pois:
+            self._add(poi)
+        self._weigh_postings()
+        self.by_city = {city: tuple(ids) for city, ids in self.by_city.items()} # Ids are appended in order: already sorted
+        self.by_city_category = {key: dict.fromkeys(ids, CATEGORY_MATCH_BOOST) for key, ids in self.by_city_category.items()}
+        del self._doc_lengths
+
+    def _add(self, poi):
+        name = _first_field(poi, NAME_FIELDS)
+        if not name:
+            return
+        poi_id = len(self.pois)
+        city = _first_field(poi, CITY_FIELDS)
+        city_key = normalize_city(city)
+        categories = tuple(poi_dataset.split_categories(poi.get(poi_dataset.CATEGORY_COLUMN)))
+        description = _first_field(poi, DESCRIPTION_FIELDS)
+        self.pois.append((name, city, categories, description))
+
+        self.by_city.setdefault(city_key, []).append(poi_id)
+        for category in {category.lower() for category in categories}:
+            self.by_city_category.setdefault((city_key, category), []).append(poi_id)
+        terms = tokenize(name) + tokenize(" ".join(categories)) + tokenize(description)
+        self._doc_lengths.append(len(terms))
+        city_terms = self.city_postings.setdefault(city_key, {})
+        for term, tf in Counter(terms).items():
+            postings = city_terms.get(term)
+            if postings is None:
+                city_terms[term] = [(poi_id, tf)]
+            else:
+                postings.append((poi_id, tf))
+
+    def _weigh_postings(self):
+        """Replaces term frequencies with BM25 weights, each list ordered by descending weight (then id)."""
+        total = len(self.pois)
+        average_length = (sum(self._doc_lengths) / total) if total else 0.0
+        length_norms = [BM25_K1 * (1 - BM25_B + BM25_B * length / (average_length or 1)) for length in self._doc_lengths]
+        document_frequency = Counter()
+        for terms in self.city_postings.values():
+            document_frequency.update({term: len(postings) for term, postings in terms.items()})
+        scales = {term: math.log(1 + (total - df + 0.5) / (df + 0.5)) * (BM25_K1 + 1) for term, df in document_frequency.items()}
+        for terms in self.city_postings.values():
+            for term, postings in terms.items():
+                scale = scales[term]
+                weighted = [(poi_id, scale * tf / (tf + length_norms[poi_id])) for poi_id, tf in postings]
+                if len(weighted) > 1:
+                    weighted.sort(key=itemgetter(1), reverse=True) # Stable: equal weights stay in id order
+                terms[term] = dict(weighted)
+
+    def __len__(self):
+        return len(self.pois)
+
+    @staticmethod
+    def _top_k(lists, limit):
+        """
+        Threshold algorithm over best-first {POI id: weight} lists: returns the limit POI ids with
+        the highest summed weight (ties by lower id), reading the lists only as deep as needed.
+        """
+        iterators = [iter(weights.items()) for weights in lists]
+        seen = set()
+        top = [] # Min-heap of (score, -POI id): the weakest of the current top results first
+        while True:
+            threshold = 0.0 # Best score any POI not read yet can still reach
+            frontier_id = -1
+            active = False
+            for position, iterator in enumerate(iterators):
+                if iterator is None:
+                    continue
+                entry = next(iterator, None)
+                if entry is None:
+                    iterators[position] = None
+                    continue
+                active = True
+                poi_id, weight = entry
+                threshold += weight
+                frontier_id = max(frontier_id, poi_id)
+                if poi_id in seen:
+                    continue
+                seen.add(poi_id)
+                score = 0.0
+                for weights in lists:
+                    score += weights.get(poi_id, 0.0)
+                if len(top) < limit:
+                    heapq.heappush(top, (score, -poi_id))
+                elif (score, -poi_id) > top[0]:
+                    heapq.heapreplace(top, (score, -poi_id))
+            if not active:
+                break
+            if len(top) == limit:
+                # An unread POI scores at most threshold, and only with an id above every list's frontier
+                weakest_score, weakest_negated_id = top[0]
+                if weakest_score > threshold or (weakest_score == threshold and -weakest_negated_id < frontier_id):
+                    break
+        return [-negated_id for _, negated_id in sorted(top, reverse=True)]
+
+    def search(self, city, interests=None, query=None, limit=15):
+        """
+        Returns up to limit POIs in city as dictionaries ('name', 'city', 'categories',
+        'description'), ranked by category matches with the interests plus BM25 relevance of
+        the interests and the free-text query. Returns [] if the city is unknown.
+        """
+        city_key = normalize_city(city)
+        city_ids = self.by_city.get(city_key)
+        if not city_ids or limit <= 0:
+            return []
+        interests = [str(i) for i in (interests or []) if i]
+        city_postings = self.city_postings.get(city_key, {})
+        lists = [city_postings[term] for term in set(tokenize(" ".join(interests + ([query] if query else [])))) if term in city_postings]
+        lists += [self.by_city_category[(city_key, interest.lower())] for interest in interests if (city_key, interest.lower()) in self.by_city_category]
+        ranked = self._top_k(lists, limit) if lists else []
+        if not ranked: # Nothing matched the interests; fall back to the city's POIs in dataset order
+            ranked = city_ids[:limit]
+        results = []
+        for poi_id in ranked:
+            name, poi_city, categories, description = self.pois[poi_id]
+            results.append({"name": name, "city": poi_city, "categories": list(categories), "description": description})
+        return results
+
+_index = None
+_index_signature = None
+_index_lock = threading.Lock()
+_build_thread = None
+_build_thread_lock = threading.Lock()
+
+def _source_signature():
+    """(path, mtime, size) of the dataset the index is built from, or None if there is none."""
+    for path in (poi_dataset.DATASET_DB_PATH, DATASET_JSON_PATH):
+        try:
+            stat = os.stat(path)
+            return (path, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            continue
+    return None
+
+def _load_pois(path):
+    if path.endswith(".json"):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return [poi for poi in data if isinstance(poi, dict)] if isinstance(data, list) else []
+    return poi_dataset.iter_pois(db_path=path)
+
+def get_poi_index():
+    """
+    Returns the process-wide POIIndex, building it on first use and rebuilding it when the
+    dataset file changes. Returns None if no POI dataset is available.
+    """
+    global _index, _index_signature
+    signature = _source_signature()
+    if signature is None:
+        return None
+    with _index_lock:
+        if _index_signature == signature:
+            return _index
+        try:
+            _index = POIIndex(_load_pois(signature[0]))
+            print(f"Built POI index with {len(_index)} POIs from {signature[0]}")
+        except Exception as e: # Corrupt or unexpected dataset: generate without grounding until it changes
+            print(f"Could not build POI index from {signature[0]}: {e}")
+            _index = None
+        _index_signature = signature
+        return _index
+
+def start_background_build():
+    """
+    Builds the index on a daemon thread, once per process, so the first prompt finds it ready
+    instead of building it itself. Prompts built meanwhile wait for the build to finish.
+    """
+    global _build_thread
+    with _build_thread_lock:
+        if _build_thread is None:
+            _build_thread = threading.Thread(target=get_poi_index, name="poi-index-build", daemon=True)
+            _build_thread.start()
+
+def find_candidate_pois(destination, interests=None, query=None, limit=15):
+    """Convenience wrapper: top POIs for a destination, or [] when there is no dataset or no match."""
+    index = get_poi_index()
+    return index.search(destination, interests, query, limit) if index else []
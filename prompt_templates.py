@@ -0,0 +1,71 @@
+# prompt_templates.py
+# Compiled itinerary prompt templates and output token budgeting.
+# The long static parts of the prompts (response schema, examples) are built once at import
+# time and their token counts cached, so each request only tokenizes its short trip brief.
+# Output budgets are sized from the trip length instead of a fixed max_tokens, and requests
+# whose prompt plus expected output would not fit the model are caught before any call is made.
+import os
+import threading
+from llm_access import llm_api # llm_api.MODEL_NAME selects the tokenizer used for counting
+from llm_access.token_count import count_chat_tokens, count_tokens
+
+MODEL_CONTEXT_TOKENS = 128000 # Prompt + completion limit of the deployment
+MODEL_MAX_OUTPUT_TOKENS = int(os.environ.get("LLM_MAX_OUTPUT_TOKENS", llm_api.MAX_TOKENS)) # Largest completion the deployment will produce
+ACTIVITIES_PER_DAY_ESTIMATE = 4 # Typical number of activities the model plans per day
+TOKENS_PER_ACTIVITY = 170 # name, time, description, why_relevant, duration, cost, image URL
+TOKENS_PER_DAY_OVERHEAD = 220 # day number, summary, meal suggestions, logistical tips
+TOKENS_RESPONSE_OVERHEAD = 150 # destination and cost fields around the itinerary list
+OUTPUT_BUDGET_HEADROOM = 1.25 # Multiplier on the estimate so long days are not cut off
+MIN_OUTPUT_TOKENS = 512
+
+class PromptTemplate:
+    """
+    A prompt made of a per-request part followed by a static suffix. The suffix is tokenized
+    once; count_tokens(variable_text) only tokenizes the part that changes between requests.
+    """
+
+    def __init__(self, static_suffix, model_name=None):
+        self.static_suffix = static_suffix
+        self._model_name = model_name # None follows llm_api.MODEL_NAME, the model the prompt is sent to
+        self._static_tokens = {} # model name -> token count of static_suffix
+        self._lock = threading.Lock()
+
+    @property
+    def model_name(self):
+        return self._model_name or llm_api.MODEL_NAME
+
+    @property
+    def static_tokens(self):
+        model_name = self.model_name
+        with self._lock:
+            if model_name not in self._static_tokens:
+                self._static_tokens[model_name] = count_tokens(self.static_suffix, model_name)
+            return self._static_tokens[model_name]
+
+    def render(self, variable_text):
+        return variable_text + self.static_suffix
+
+    def count_tokens(self, variable_text):
+        """Token count of render(variable_text); exact up to the token at the join."""
+        return count_tokens(variable_text, self.model_name) + self.static_tokens
+
+def estimate_output_tokens(duration_days, activities_per_day=None):
+    """Output tokens to request for an itinerary of duration_days days (headroom included)."""
+    activities_per_day = activities_per_day or ACTIVITIES_PER_DAY_ESTIMATE
+    per_day = TOKENS_PER_DAY_OVERHEAD + activities_per_day * TOKENS_PER_ACTIVITY
+    estimate = TOKENS_RESPONSE_OVERHEAD + max(1, int(duration_days or 1)) * per_day
+    return max(MIN_OUTPUT_TOKENS, int(estimate * OUTPUT_BUDGET_HEADROOM))
+
+def plan_token_budget(template, variable_text, duration_days, activities_per_day=None):
+    """
+    Sizes a request before it is sent. Returns (max_tokens, prompt_tokens, fits) where prompt_tokens
+    includes llm_api's system message and the chat message overhead, and fits is
+    False if the expected output exceeds MODEL_MAX_OUTPUT_TOKENS or prompt plus output would
+    exceed MODEL_CONTEXT_TOKENS; such a request would come back truncated and unparseable.
+    """
+    system_message = {"role": "system", "content": llm_api.SYSTEM_MESSAGE} # Sent with every prompt by llm_api
+    prompt_tokens = count_chat_tokens([system_message, {"role": "user", "content": ""}], template.model_name) + template.count_tokens(variable_text)
+    wanted_output = estimate_output_tokens(duration_days, activities_per_day)
+    fits = wanted_output <= MODEL_MAX_OUTPUT_TOKENS and prompt_tokens + wanted_output <= MODEL_CONTEXT_TOKENS
+    max_tokens = min(wanted_output, MODEL_MAX_OUTPUT_TOKENS, max(0, MODEL_CONTEXT_TOKENS - prompt_tokens))
+    return max_tokens, prompt_tokens, fits
@@ -0,0 +1,119 @@
+# single_flight.py
+# Request coalescing ("single flight") within one process: while a call for a key is in
+# flight, concurrent callers with the same key wait for it and share its result instead of
+# repeating the work. Nothing is kept once the call finishes, so this is not a cache.
+#   SingleFlight.do      - plain calls; followers receive the leader's return value or exception
+#   SingleFlight.stream  - generators; followers replay the items produced so far, then follow live
+import threading
+
+class FlightAbandoned(Exception):
+    """Raised to stream followers when the leading generator stopped early or failed."""
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class _StreamCall:
+    def __init__(self):
+        self.items = []
+        self.closed = False
+        self.completed = False
+        self.condition = threading.Condition()
+
+    def append(self, item):
+        with self.condition:
+            self.items.append(item)
+            self.condition.notify_all()
+
+    def close(self, completed):
+        with self.condition:
+            self.closed = True
+            self.completed = completed
+            self.condition.notify_all()
+
+    def wait_after(self, position):
+        """Blocks until there are items beyond position or the stream is closed. Returns (new items, closed, completed)."""
+        with self.condition:
+            while len(self.items) <= position and not self.closed:
+                self.condition.wait()
+            return self.items[position:], self.closed, self.completed
+
+class SingleFlight:
+    """Coalesces concurrent calls by key. Keys must be hashable; results are shared, not copied."""
+
+    def __init__(self, name="single flight"):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def _join(self, key, call_type):
+        """Returns (call, leader): the in-flight call for key, creating it if this caller leads."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = call_type()
+                return call, True
+            return call, False
+
+    def _leave(self, key, call):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+
+    def do(self, key, function, *args, **kwargs):
+        """
+        Calls function(*args, **kwargs) unless a call for key is already in flight, in which
+        case it waits for that call instead. Returns (result, joined) where joined is True when
+        the result came from another caller's call. Exceptions are re-raised to every caller.
+        """
+        call, leader = self._join(key, _Call)
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = function(*args, **kwargs)
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            self._leave(key, call) # Later callers start a new call
+            call.done.set()
+
+    def stream(self, key, make_iterator):
+        """
+        Generator form of do(): the leader iterates make_iterator() and records every item;
+        concurrent callers with the same key replay the recorded items and then receive new
+        ones as the leader produces them. Yields (item, joined). Followers get FlightAbandoned
+        if the leader stops before the iterator is exhausted (closed early or failed).
+        """
+        call, leader = self._join(key, _StreamCall)
+        if leader:
+            completed = False
+            iterator = make_iterator()
+            try:
+                for item in iterator:
+                    call.append(item)
+                    yield item, False
+                completed = True
+            finally:
+                self._leave(key, call)
+                call.close(completed)
+                if hasattr(iterator, "close"): # Stop the underlying generator when our caller stops early
+                    iterator.close()
+            return
+
+        position = 0
+        while True:
+            items, closed, completed = call.wait_after(position)
+            for item in items:
+                position += 1
+                yield item, True
+            if closed and position >= len(call.items):
+                if not completed:
+                    raise FlightAbandoned(f"The {self.name} leader for this request stopped early.")
+                return